@@ -0,0 +1,578 @@
+#!/usr/bin/python2
+###
+# pkgbench.py -- benchmark the pkgfile module and scripts on synthetic
+# files databases
+# This program is a part of pkgtools
+#
+# Pkgtools is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# Pkgtools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+##
+
+'''Benchmark the pkgfile module, pkgfile.py and pkgconflict.py
+
+Synthetic files databases are generated from a fixed seed, so two runs with
+the same parameters read the same data. Every case runs in its own child
+process, so that its peak RSS is its own, and the results are written as
+JSON. Nothing is read from the network nor from pacman: updates are fetched
+from a local HTTP server, and the local database of pacman is a generated
+directory.
+
+  make pkgfile.so
+  python2 bench/pkgbench.py -o before.json
+  ... change things, rebuild ...
+  python2 bench/pkgbench.py -o after.json
+  python2 bench/pkgbench.py --compare before.json after.json
+'''
+
+import os
+import re
+import sys
+import glob
+import gzip
+import json
+import time
+import random
+import shutil
+import tarfile
+import optparse
+import tempfile
+import threading
+import subprocess
+import StringIO
+import BaseHTTPServer
+import SimpleHTTPServer
+
+TOP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPTS_DIR = os.path.join(TOP_DIR, 'scripts')
+RESULTS_VERSION = 1
+
+SYLLABLES = ['al', 'be', 'co', 'da', 'ex', 'fi', 'go', 'ha', 'io', 'ju', 'ka',
+        'lo', 'mu', 'ne', 'or', 'pi', 'qu', 'ra', 'si', 'to', 'ur', 'vi', 'wo',
+        'xe', 'yo', 'ze']
+EXTENSIONS = ['h', 'py', 'png', 'html', 'txt', 'so', 'mo', 'gz', 'conf']
+# names found in many packages, like in the real databases
+COMMON_NAMES = ['README', 'COPYING', 'Makefile', '__init__.py', 'index.html',
+        'config.h']
+
+def setup_module_path(module_path):
+    '''put the pkgfile module built in modules/ first in sys.path, and
+    return the directory it was found in'''
+    if module_path is None:
+        builds = glob.glob(os.path.join(TOP_DIR, 'modules', 'build', 'lib.*-2.*'))
+        if builds:
+            module_path = builds[0]
+    if module_path is not None:
+        sys.path.insert(0, os.path.abspath(module_path))
+    return module_path
+
+def load_script(name):
+    '''import one of the scripts as a module, without shadowing the C module'''
+    import imp
+    sys.dont_write_bytecode = True
+    return imp.load_source('%s_script' % name, os.path.join(SCRIPTS_DIR, '%s.py' % name))
+
+class Package(object):
+    '''a synthetic package: name, version, files and dependencies'''
+
+    def __init__(self, name, files, depends):
+        self.name = name
+        self.version = '1.%d-1' % (len(name) % 5)
+        self.files = files
+        self.depends = depends
+
+    def dirname(self):
+        return '%s-%s' % (self.name, self.version)
+
+    def desc(self, local=False):
+        fields = [('FILENAME', '%s-x86_64.pkg.tar.xz' % self.dirname()),
+                ('NAME', self.name), ('VERSION', self.version),
+                ('DESC', 'synthetic package %s' % self.name),
+                ('CSIZE', '%d' % (1000 * len(self.files))),
+                ('ISIZE', '%d' % (4000 * len(self.files))),
+                ('MD5SUM', '%032x' % abs(hash(self.name))),
+                ('URL', 'http://example.org/%s' % self.name),
+                ('LICENSE', 'GPL'), ('ARCH', 'x86_64'),
+                ('BUILDDATE', '1300000000'), ('PACKAGER', 'pkgbench')]
+        if local:
+            fields += [('INSTALLDATE', '1300001000'), ('REASON', '1')]
+        return ''.join('%%%s%%\n%s\n\n' % f for f in fields)
+
+    def depends_entry(self):
+        return '%%DEPENDS%%\n%s\n\n' % '\n'.join(self.depends)
+
+    def files_entry(self, local=False):
+        data = '%%FILES%%\n%s\n\n' % '\n'.join(self.files)
+        if local:
+            data += '%%BACKUP%%\netc/%s.conf\t%032x\n\n' % (self.name, 0)
+        return data
+
+def make_packages(rng, npkgs, nfiles, first=0):
+    '''return npkgs packages of about nfiles files each'''
+    pkgs = []
+    for i in range(first, first + npkgs):
+        name = ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 3))) + str(i)
+        files = set(['usr/', 'usr/bin/', 'usr/lib/', 'usr/share/',
+                'usr/share/%s/' % name, 'usr/bin/%s' % name,
+                'usr/lib/lib%s.so' % name, 'usr/lib/lib%s.so.1' % name])
+        while len(files) < nfiles:
+            sub = 'usr/share/%s/%s/' % (name, rng.choice(SYLLABLES))
+            files.add(sub)
+            if rng.random() < 0.1:
+                base = rng.choice(COMMON_NAMES)
+            else:
+                base = '%s%d.%s' % (rng.choice(SYLLABLES), rng.randint(0, 999), rng.choice(EXTENSIONS))
+            files.add(sub + base)
+        pkgs.append(Package(name, sorted(files), []))
+    for pkg in pkgs:
+        pkg.depends = sorted(set(rng.choice(pkgs).name for _ in range(rng.randint(0, 4))) - set([pkg.name]))
+    return pkgs
+
+def add_entry(tar, name, data):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = 1300000000
+    tar.addfile(info, StringIO.StringIO(data))
+
+def write_files_db(pkgs, dbfile, compression):
+    '''write the files database of pkgs, compressed with gzip or xz'''
+    buf = StringIO.StringIO()
+    tar = tarfile.open(fileobj=buf, mode='w')
+    for pkg in pkgs:
+        info = tarfile.TarInfo(pkg.dirname())
+        info.type = tarfile.DIRTYPE
+        info.mtime = 1300000000
+        tar.addfile(info)
+        add_entry(tar, pkg.dirname() + '/desc', pkg.desc())
+        add_entry(tar, pkg.dirname() + '/depends', pkg.depends_entry())
+        add_entry(tar, pkg.dirname() + '/files', pkg.files_entry())
+    tar.close()
+    # the name is the same whatever the compression, libarchive finds it out
+    if compression == 'xz':
+        with open(dbfile, 'wb') as f:
+            p = subprocess.Popen(['xz', '-c', '-6'], stdin=subprocess.PIPE, stdout=f)
+            p.communicate(buf.getvalue())
+            if p.returncode != 0:
+                raise RuntimeError('xz failed')
+    else:
+        f = gzip.GzipFile(dbfile, 'wb', 6, mtime=1300000000)
+        f.write(buf.getvalue())
+        f.close()
+    os.utime(dbfile, (1300000000, 1300000000))
+
+def write_local_db(pkgs, dbpath):
+    '''write a pacman local database with pkgs installed'''
+    local = os.path.join(dbpath, 'local')
+    os.makedirs(local)
+    with open(os.path.join(local, 'ALPM_DB_VERSION'), 'w') as f:
+        f.write('9\n')
+    for pkg in pkgs:
+        d = os.path.join(local, pkg.dirname())
+        os.mkdir(d)
+        for name, data in (('desc', pkg.desc(local=True) + pkg.depends_entry()),
+                ('files', pkg.files_entry(local=True))):
+            with open(os.path.join(d, name), 'w') as f:
+                f.write(data)
+
+def write_package(pkg, filename):
+    '''write a package archive holding the files of pkg'''
+    tar = tarfile.open(filename, 'w:gz')
+    add_entry(tar, '.PKGINFO', 'pkgname = %s\npkgver = %s\n' % (pkg.name, pkg.version))
+    for f in pkg.files:
+        info = tarfile.TarInfo(f.rstrip('/'))
+        info.mtime = 1300000000
+        if f.endswith('/'):
+            info.type = tarfile.DIRTYPE
+            tar.addfile(info)
+        else:
+            add_entry(tar, f, 'x')
+    tar.close()
+
+class Env(object):
+    '''the generated databases of a benchmark run'''
+
+    def __init__(self, workdir, options):
+        rng = random.Random(options.seed)
+        self.workdir = workdir
+        self.mirror_dir = os.path.join(workdir, 'mirror')
+        self.lists_dir = os.path.join(workdir, 'lists')
+        self.dbpath = os.path.join(workdir, 'pacman')
+        self.repos = []
+        self.pkgs = {}
+        os.makedirs(self.lists_dir)
+        first = 0
+        for i in range(options.repos):
+            repo = 'repo%d' % i
+            pkgs = make_packages(rng, options.packages, options.files, first)
+            first += len(pkgs)
+            os.makedirs(os.path.join(self.mirror_dir, repo))
+            write_files_db(pkgs, os.path.join(self.mirror_dir, repo, '%s.files.tar.gz' % repo),
+                    options.compression)
+            shutil.copy2(os.path.join(self.mirror_dir, repo, '%s.files.tar.gz' % repo), self.lists_dir)
+            self.repos.append(repo)
+            self.pkgs[repo] = pkgs
+        self.all_pkgs = [p for r in self.repos for p in self.pkgs[r]]
+        write_local_db(rng.sample(self.all_pkgs, len(self.all_pkgs) // 4), self.dbpath)
+        self.pacman_conf = os.path.join(workdir, 'pacman.conf')
+        with open(self.pacman_conf, 'w') as f:
+            f.write('[options]\nDBPath = %s/\n' % self.dbpath)
+
+        # a package overlapping some files of the repos, for pkgconflict
+        conflict = Package('conflicting', sorted(set(
+            f for p in rng.sample(self.all_pkgs, 10) for f in p.files) |
+            set(make_packages(rng, 1, options.files * 10, first)[0].files)), [])
+        self.package = os.path.join(workdir, 'conflicting-1.0-1-x86_64.pkg.tar.gz')
+        write_package(conflict, self.package)
+        self.home = os.path.join(workdir, 'home')
+        os.makedirs(os.path.join(self.home, '.pkgtools'))
+        with open(os.path.join(self.home, '.pkgtools', 'pkgfile.conf'), 'w') as f:
+            f.write('FILELIST_DIR=%s\n' % self.lists_dir)
+
+        # the names looked up, picked from the middle of the first repo
+        pkgs = self.pkgs[self.repos[0]]
+        self.target = pkgs[len(pkgs) // 2]
+        self.targets = rng.sample(self.all_pkgs, min(20, len(self.all_pkgs)))
+
+    def dbfile(self, repo=None):
+        return os.path.join(self.lists_dir, '%s.files.tar.gz' % (repo or self.repos[0]))
+
+class MirrorHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
+    '''serve the files of the mirror directory of the server'''
+
+    def translate_path(self, path):
+        path = os.path.normpath(path.split('?', 1)[0]).lstrip('/')
+        return os.path.join(self.server.root, path)
+
+    def log_message(self, format, *args):
+        pass
+
+class MirrorServer(BaseHTTPServer.HTTPServer):
+    def handle_error(self, request, client_address):
+        # pkgfile closes the connection once it knows there is no update
+        pass
+
+def start_mirror(root, handler=MirrorHandler):
+    '''serve root on a local port from a thread, return the server'''
+    server = MirrorServer(('127.0.0.1', 0), handler)
+    server.root = root
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+def search_patterns(pkgfile, env):
+    '''return the pattern used for each match type and search type'''
+    t = env.target.name
+    names = [p.name for p in env.targets]
+    return {
+        pkgfile.MATCH_SIMPLE: {pkgfile.SEARCH_PACKAGE: t,
+            pkgfile.SEARCH_FILENAME: 'lib%s.so' % t,
+            pkgfile.SEARCH_PATH: 'usr/bin/%s' % t},
+        pkgfile.MATCH_SHELL: {pkgfile.SEARCH_PACKAGE: t[:-1] + '*',
+            pkgfile.SEARCH_FILENAME: 'lib%s.so*' % t,
+            pkgfile.SEARCH_PATH: 'usr/*/%s' % t},
+        pkgfile.MATCH_REGEX: {pkgfile.SEARCH_PACKAGE: '^%s$' % t,
+            pkgfile.SEARCH_FILENAME: '^lib%s\\.so' % t,
+            pkgfile.SEARCH_PATH: 'usr/bin/%s$' % t},
+        pkgfile.MATCH_SET: {pkgfile.SEARCH_PACKAGE: names,
+            pkgfile.SEARCH_FILENAME: ['lib%s.so' % n for n in names],
+            pkgfile.SEARCH_PATH: ['usr/bin/%s' % n for n in names]},
+        pkgfile.MATCH_MULTI_SHELL: {pkgfile.SEARCH_PACKAGE: [n[:-1] + '*' for n in names],
+            pkgfile.SEARCH_FILENAME: ['lib%s.so*' % n for n in names],
+            pkgfile.SEARCH_PATH: ['usr/*/%s' % n for n in names]},
+    }
+
+MATCH_TYPES = ['MATCH_SIMPLE', 'MATCH_SHELL', 'MATCH_REGEX', 'MATCH_PCRE',
+        'MATCH_SET', 'MATCH_MULTI_SHELL']
+SEARCH_TYPES = ['SEARCH_PACKAGE', 'SEARCH_FILENAME', 'SEARCH_PATH']
+
+def make_cases(env):
+    '''return the (name, prepare) benchmark cases; prepare is called in the
+    child process and returns the function to time'''
+    import pkgfile
+
+    cases = [('noop', lambda: lambda: None)]
+    patterns = search_patterns(pkgfile, env)
+    patterns[pkgfile.MATCH_PCRE] = patterns[pkgfile.MATCH_REGEX]
+    for mt_name in MATCH_TYPES:
+        for st_name in SEARCH_TYPES:
+            mt, st = getattr(pkgfile, mt_name), getattr(pkgfile, st_name)
+            def prepare(mt=mt, st=st):
+                search = pkgfile.Search(mt, st, patterns[mt][st])
+                return lambda: search(env.dbfile())
+            cases.append(('search/%s/%s' % (mt_name, st_name), prepare))
+
+    def prepare_iter():
+        search = pkgfile.Search(pkgfile.MATCH_SHELL, pkgfile.SEARCH_PATH, 'usr/share/*')
+        return lambda: sum(1 for m in search.iter(env.dbfile()))
+    cases.append(('search/iter', prepare_iter))
+
+    def prepare_build_index():
+        indexfile = os.path.join(tempfile.mkdtemp(dir=env.workdir), 'db.idx')
+        return lambda: pkgfile.build_index(env.dbfile(), indexfile)
+    cases.append(('index/build', prepare_build_index))
+
+    def prepare_lookup():
+        indexfile = os.path.join(tempfile.mkdtemp(dir=env.workdir), 'db.idx')
+        pkgfile.build_index(env.dbfile(), indexfile)
+        names = ['lib%s.so' % p.name for p in env.targets]
+        def run():
+            index = pkgfile.Index(indexfile)
+            return [index.lookup(pkgfile.SEARCH_FILENAME, n) for n in names]
+        return run
+    cases.append(('index/lookup', prepare_lookup))
+
+    cases.append(('list_packages', lambda: lambda: pkgfile.list_packages(env.dbfile())))
+    cases.append(('list_packages/local', lambda: lambda: pkgfile.list_packages(os.path.join(env.dbpath, 'local'))))
+    names = [p.name for p in env.pkgs[env.repos[0]][::10]]
+    cases.append(('pkg_info/many', lambda: lambda: pkgfile.pkg_info(env.dbfile(), names)))
+    cases.append(('pkg_info/all', lambda: lambda: pkgfile.pkg_info(env.dbfile(), None)))
+    cases.append(('archive_contents', lambda: lambda: pkgfile.archive_contents(env.package)))
+
+    # the scripts, through their own functions
+    def prepare_cli(args):
+        def prepare():
+            cli = load_script('pkgfile')
+            cli.PACMAN_CONF = env.pacman_conf
+            for dbfile in cli.list_repos(env.lists_dir):
+                cli.update_index(dbfile, filelist_dir=env.lists_dir)
+            options, targets = cli.make_parser(env.lists_dir).parse_args(args)
+            def run():
+                if options.list:
+                    cli.list_files(targets[0], options, filelist_dir=env.lists_dir)
+                else:
+                    cli.query_pkg(targets[0], options, filelist_dir=env.lists_dir)
+                cli._info_cache.clear()
+            return run
+        return prepare
+    t = env.target.name
+    cases.append(('pkgfile/search', prepare_cli(['-s', 'lib%s.so' % t])))
+    cases.append(('pkgfile/search-glob', prepare_cli(['-g', '-s', 'lib%s.so*' % t])))
+    cases.append(('pkgfile/search-regex', prepare_cli(['-r', '-s', 'lib%s\\.so' % t])))
+    cases.append(('pkgfile/info', prepare_cli(['-i', '-s', 'lib%s.so' % t])))
+    cases.append(('pkgfile/list', prepare_cli(['-l', t])))
+    cases.append(('pkgfile/list-glob', prepare_cli(['-g', '-l', '*'])))
+
+    def prepare_conflict():
+        # run from a copy, pkgfile.py next to it would be imported instead of
+        # the module
+        script = os.path.join(tempfile.mkdtemp(dir=env.workdir), 'pkgconflict.py')
+        shutil.copy(os.path.join(SCRIPTS_DIR, 'pkgconflict.py'), script)
+        cmd = [sys.executable, script, env.package]
+        environ = dict(os.environ, HOME=env.home, PYTHONPATH=os.pathsep.join(p for p in sys.path if p))
+        devnull = open(os.devnull, 'w')
+        def run():
+            if subprocess.call(cmd, env=environ, stdout=devnull) != 0:
+                raise RuntimeError('pkgconflict failed')
+        return run
+    cases.append(('pkgconflict', prepare_conflict))
+
+    def prepare_update(noop):
+        def prepare():
+            cli = load_script('pkgfile')
+            cli.PACMAN_CONF = env.pacman_conf
+            cli.get_mirrorlist = lambda: [(repo, 'http://127.0.0.1:%d/%s' % (env.mirror_port, repo))
+                    for repo in env.repos]
+            options = cli.make_parser(env.lists_dir).parse_args(['-u'])[0]
+            options.ratelimit = 0
+            if noop:
+                lists_dir = tempfile.mkdtemp(dir=env.workdir)
+                cli.update_repo(options, filelist_dir=lists_dir)
+                return lambda: cli.update_repo(options, filelist_dir=lists_dir)
+            return lambda: cli.update_repo(options, filelist_dir=tempfile.mkdtemp(dir=env.workdir))
+        return prepare
+    cases.append(('update/full', prepare_update(False)))
+    cases.append(('update/noop', prepare_update(True)))
+    return cases
+
+def malloc_in_use():
+    '''return the bytes allocated with malloc, None if it is not known'''
+    try:
+        import ctypes
+        libc = ctypes.CDLL(None)
+    except (ImportError, OSError):
+        return None
+    for func, ctype in (('mallinfo2', ctypes.c_size_t), ('mallinfo', ctypes.c_int)):
+        class Mallinfo(ctypes.Structure):
+            _fields_ = [(f, ctype) for f in ('arena', 'ordblks', 'smblks', 'hblks',
+                'hblkhd', 'usmblks', 'fsmblks', 'uordblks', 'fordblks', 'keepcost')]
+        try:
+            mallinfo = getattr(libc, func)
+        except AttributeError:
+            continue
+        mallinfo.restype = Mallinfo
+        info = mallinfo()
+        return info.uordblks + info.hblkhd
+    return None
+
+def measure(prepare, repeat):
+    '''time repeat runs of the function returned by prepare'''
+    run = prepare()
+    heap = malloc_in_use()
+    walls = []
+    start_times = os.times()
+    result = None
+    for i in range(repeat):
+        # the result of the previous run is freed before the next one
+        result = None
+        start = time.time()
+        result = run()
+        walls.append(time.time() - start)
+    # the time of the processes run by the case is included
+    cpu = sum(os.times()[i] - start_times[i] for i in range(4)) / repeat
+    walls.sort()
+    measures = {'wall_min': walls[0], 'wall_median': walls[len(walls) // 2],
+            'cpu': cpu, 'runs': repeat}
+    end = malloc_in_use()
+    if heap is not None and end is not None:
+        # what the result of the last run keeps allocated
+        measures['malloc_kb'] = (end - heap) // 1024
+    if isinstance(result, list):
+        measures['results'] = len(result)
+    return measures
+
+def run_case(prepare, repeat):
+    '''measure a case in a child process, and return its measures'''
+    r, w = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(r)
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, 1)
+        try:
+            measures = measure(prepare, repeat)
+        except Exception, e:
+            measures = {'error': '%s: %s' % (e.__class__.__name__, e)}
+        with os.fdopen(w, 'w') as f:
+            json.dump(measures, f)
+        os._exit(0)
+    os.close(w)
+    with os.fdopen(r) as f:
+        data = f.read()
+    status, rusage = os.wait4(pid, 0)[1:]
+    try:
+        measures = json.loads(data)
+    except ValueError:
+        measures = {'error': 'child exited with status %d' % status}
+    # the peak of the child and of the processes it waited for
+    measures['maxrss_kb'] = rusage.ru_maxrss
+    return measures
+
+def git_revision():
+    try:
+        p = subprocess.Popen(['git', 'describe', '--always', '--dirty'], cwd=TOP_DIR,
+                stdout=subprocess.PIPE, stderr=open(os.devnull, 'w'))
+        return p.communicate()[0].strip() or None
+    except OSError:
+        return None
+
+def run(options):
+    import pkgfile
+
+    workdir = tempfile.mkdtemp(prefix='pkgbench.', dir=options.workdir)
+    server = None
+    try:
+        start = time.time()
+        env = Env(workdir, options)
+        print >> sys.stderr, 'Generated databases in %.1fs' % (time.time() - start)
+        server = start_mirror(env.mirror_dir)
+        env.mirror_port = server.server_address[1]
+
+        cases = []
+        for name, prepare in make_cases(env):
+            if options.only and not re.search(options.only, name):
+                continue
+            measures = run_case(prepare, options.repeat)
+            print >> sys.stderr, '%-36s %s' % (name, measures.get('error') or
+                    '%.4fs %dkB' % (measures['wall_median'], measures['maxrss_kb']))
+            measures['name'] = name
+            cases.append(measures)
+        return {'version': RESULTS_VERSION, 'revision': git_revision(),
+                'module': pkgfile.__file__, 'python': sys.version.split()[0],
+                'params': {'packages': options.packages, 'files': options.files,
+                    'repos': options.repos, 'compression': options.compression,
+                    'repeat': options.repeat, 'seed': options.seed},
+                'dbsize': os.path.getsize(env.dbfile()),
+                'cases': cases}
+    finally:
+        if server is not None:
+            server.shutdown()
+        if options.keep:
+            print >> sys.stderr, 'Databases kept in %s' % workdir
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+def compare(old_file, new_file):
+    '''print the median wall time and peak RSS of the cases of two results'''
+    with open(old_file) as f:
+        old = json.load(f)
+    with open(new_file) as f:
+        new = json.load(f)
+    if old['params'] != new['params']:
+        print >> sys.stderr, 'Warning: the results were made with different parameters'
+    old_cases = dict((c['name'], c) for c in old['cases'])
+    print '%-36s %10s %10s %7s %10s %10s' % ('case', 'old', 'new', 'ratio', 'old RSS', 'new RSS')
+    for c in new['cases']:
+        o = old_cases.get(c['name'])
+        if o is None or 'error' in o or 'error' in c:
+            print '%-36s %s' % (c['name'], c.get('error') or (o or {}).get('error') or 'new case')
+            continue
+        ratio = c['wall_median'] / o['wall_median'] if o['wall_median'] else 0
+        print '%-36s %9.4fs %9.4fs %6.2fx %8dkB %8dkB' % (c['name'], o['wall_median'],
+                c['wall_median'], ratio, o['maxrss_kb'], c['maxrss_kb'])
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [OPTIONS]\n       %prog --compare OLD NEW')
+    parser.add_option('-p', '--packages', dest='packages', type='int', default=2000,
+            help='number of packages in each repo [%default]')
+    parser.add_option('-f', '--files', dest='files', type='int', default=60,
+            help='number of files and directories of each package [%default]')
+    parser.add_option('--repos', dest='repos', type='int', default=2,
+            help='number of repos [%default]')
+    parser.add_option('-z', '--compression', dest='compression', type='choice',
+            choices=('gz', 'xz'), default='gz', help='compression of the databases: gz or xz [%default]')
+    parser.add_option('-n', '--repeat', dest='repeat', type='int', default=5,
+            help='runs of each case, the median is reported [%default]')
+    parser.add_option('--seed', dest='seed', type='int', default=1,
+            help='seed of the generated databases [%default]')
+    parser.add_option('-k', '--only', dest='only', default=None,
+            help='only run the cases whose name matches this regex')
+    parser.add_option('-m', '--module-path', dest='module_path', default=None,
+            help='directory of the pkgfile module [modules/build/lib.*]')
+    parser.add_option('-o', '--output', dest='output', default=None,
+            help='write the JSON results to this file instead of stdout')
+    parser.add_option('--workdir', dest='workdir', default=None,
+            help='where to generate the databases [$TMPDIR]')
+    parser.add_option('--keep', dest='keep', action='store_true', default=False,
+            help='keep the generated databases')
+    parser.add_option('--compare', dest='compare', action='store_true', default=False,
+            help='compare two JSON results')
+    (options, args) = parser.parse_args()
+
+    if options.compare:
+        if len(args) != 2:
+            parser.error('--compare needs two result files')
+        compare(args[0], args[1])
+        return
+
+    setup_module_path(options.module_path)
+    results = run(options)
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+    else:
+        json.dump(results, sys.stdout, indent=1, sort_keys=True)
+        print
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,401 @@
+#define _GNU_SOURCE 1
+#include <archive.h>
+#include <archive_entry.h>
+#include <dirent.h>
+#include <libgen.h>
+#include <limits.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <sys/stat.h>
+#include <zlib.h>
+#include "db.h"
+#include "util.h"
+#include "pack.h"
+#define ABUFLEN 1024
+#define LINEBUFLEN 65536
+
+static cookie_io_functions_t archive_stream_funcs = {
+.read = (cookie_read_function_t*)archive_read_data,
+.write = NULL,
+.seek = NULL,
+.close = NULL
+};
+
+static FILE *open_archive_stream(struct archive *archive) {
+  return fopencookie(archive, "r", archive_stream_funcs);
+}
+
+/* entries read in each package directory, in this order */
+static const char *dir_entries[] = {"desc", "depends", "files", NULL};
+
+struct db_reader {
+  /* tarball */
+  struct archive *a;
+  char pname[ABUFLEN];
+  /* directory */
+  char *root;
+  struct dirent **pkgdirs;
+  int npkgdirs, next_pkgdir, next_entry;
+  char path[PATH_MAX];
+  /* pack, see pack.h */
+  struct pack_map pack;
+  const struct pack_entry *entry;
+  uint32_t pkg, next;
+  /* the current entry is only inflated when its data is read */
+  z_stream z;
+  int zinit, zstate;
+  size_t raw_pos;
+  /* current entry */
+  const char *dname, *fname;
+  time_t mtime;
+  FILE *fp;
+  /* lines of the current entry, read by blocks */
+  char *buf;
+  size_t alloc, start, end;
+  int eof;
+  /* counters, only kept when not NULL */
+  struct db_stats *stats;
+  int64_t position;
+};
+
+double db_clock(void) {
+  struct timespec ts;
+
+  clock_gettime(CLOCK_MONOTONIC, &ts);
+  return ts.tv_sec + ts.tv_nsec / 1e9;
+}
+
+void db_set_stats(struct db_reader *r, struct db_stats *stats) {
+  r->stats = stats;
+}
+
+/* account the time since start and what was decompressed meanwhile */
+static void db_account(struct db_reader *r, double start) {
+  int64_t position;
+
+  r->stats->read_time += db_clock() - start;
+  if(r->a != NULL) {
+    position = archive_position_uncompressed(r->a);
+    r->stats->bytes += position - r->position;
+    r->position = position;
+  }
+}
+
+int db_exists(const char *path) {
+  struct stat st;
+
+  return stat(path, &st) == 0 && (S_ISREG(st.st_mode) || S_ISDIR(st.st_mode));
+}
+
+static int filter_pkgdir(const struct dirent *de) {
+  return de->d_name[0] != '.';
+}
+
+/* read the data of the current entry of a pack, like read(2) */
+static ssize_t pack_read(struct db_reader *r, char *buf, size_t len) {
+  const struct pack_entry *e = r->entry;
+  int ret;
+
+  if(e == NULL || r->zstate == 2)
+    return 0;
+  /* stored as is */
+  if(e->csize == e->size) {
+    if(len > e->size - r->raw_pos)
+      len = e->size - r->raw_pos;
+    memcpy(buf, r->pack.map + e->offset + r->raw_pos, len);
+    r->raw_pos += len;
+    return len;
+  }
+  if(r->zstate == 0) {
+    if(!r->zinit) {
+      memset(&r->z, 0, sizeof(z_stream));
+      if(inflateInit(&r->z) != Z_OK)
+        return -1;
+      r->zinit = 1;
+    } else if(inflateReset(&r->z) != Z_OK) {
+      return -1;
+    }
+    r->z.next_in = (Bytef*)r->pack.map + e->offset;
+    r->z.avail_in = e->csize;
+    r->zstate = 1;
+  }
+  r->z.next_out = (Bytef*)buf;
+  r->z.avail_out = len;
+  ret = inflate(&r->z, Z_NO_FLUSH);
+  if(ret == Z_STREAM_END)
+    r->zstate = 2;
+  else if(ret != Z_OK)
+    return -1;
+  return len - r->z.avail_out;
+}
+
+static ssize_t pack_stream_read(void *cookie, char *buf, size_t len) {
+  return pack_read(cookie, buf, len);
+}
+
+static cookie_io_functions_t pack_stream_funcs = {
+.read = pack_stream_read,
+.write = NULL,
+.seek = NULL,
+.close = NULL
+};
+
+struct db_reader *db_open(const char *path) {
+  struct db_reader *r;
+  struct stat st;
+
+  if(stat(path, &st) == -1)
+    return NULL;
+  r = calloc(1, sizeof(struct db_reader));
+  if(r == NULL)
+    return NULL;
+
+  if(S_ISDIR(st.st_mode)) {
+    r->root = strdup(path);
+    if(r->root == NULL)
+      goto error;
+    r->npkgdirs = scandir(path, &r->pkgdirs, filter_pkgdir, alphasort);
+    if(r->npkgdirs == -1) {
+      r->npkgdirs = 0;
+      goto error;
+    }
+    r->next_entry = -1;
+    return r;
+  }
+
+  switch(pack_map(&r->pack, path)) {
+    case 0:
+      return r;
+    case -1:
+      goto error;
+  }
+
+  r->pname[ABUFLEN-1] = '\0';
+  r->a = archive_read_new();
+  if(r->a == NULL)
+    goto error;
+  archive_read_support_compression_all(r->a);
+  archive_read_support_format_all(r->a);
+  if(archive_read_open_filename(r->a, path, 10240) != ARCHIVE_OK)
+    goto error;
+  return r;
+
+error:
+  db_close(r);
+  return NULL;
+}
+
+int db_is_dir(struct db_reader *r) {
+  return r->root != NULL;
+}
+
+/* move to the next entry; return 1 if there is one, 0 at the end */
+int db_next(struct db_reader *r, const char **dname, const char **fname) {
+  struct archive_entry *entry;
+  struct stat st;
+  double start;
+  int ret;
+
+  if(r->fp != NULL) {
+    fclose(r->fp);
+    r->fp = NULL;
+  }
+  r->start = r->end = 0;
+  r->eof = 0;
+
+  if(r->pack.map != NULL) {
+    if(r->next >= r->pack.hdr->nentries)
+      return 0;
+    while(r->next >= r->pack.pkgs[r->pkg].first_entry + r->pack.pkgs[r->pkg].nentries)
+      r->pkg++;
+    r->entry = &r->pack.entries[r->next++];
+    r->zstate = 0;
+    r->raw_pos = 0;
+    r->dname = r->pack.strings + r->pack.pkgs[r->pkg].dname;
+    r->fname = r->pack.strings + r->entry->name;
+    r->mtime = r->entry->mtime;
+    *dname = r->dname;
+    *fname = r->fname;
+    return 1;
+  }
+
+  if(r->a != NULL) {
+    start = r->stats ? db_clock() : 0;
+    while ((ret = archive_read_next_header(r->a, &entry)) == ARCHIVE_OK) {
+      if(!S_ISREG(archive_entry_filetype(entry))) {
+        archive_read_data_skip(r->a);
+        continue;
+      }
+      strncpy(r->pname, archive_entry_pathname(entry), ABUFLEN-1);
+      r->fname = basename(r->pname);
+      r->dname = dirname(r->pname);
+      r->mtime = archive_entry_mtime(entry);
+      *dname = r->dname;
+      *fname = r->fname;
+      break;
+    }
+    if(r->stats)
+      db_account(r, start);
+    return ret == ARCHIVE_OK;
+  }
+
+  while(1) {
+    if(r->next_entry < 0 || dir_entries[r->next_entry] == NULL) {
+      if(r->next_pkgdir >= r->npkgdirs)
+        return 0;
+      r->dname = r->pkgdirs[r->next_pkgdir++]->d_name;
+      r->next_entry = 0;
+    }
+    r->fname = dir_entries[r->next_entry++];
+    snprintf(r->path, PATH_MAX, "%s/%s/%s", r->root, r->dname, r->fname);
+    if(stat(r->path, &st) == -1 || !S_ISREG(st.st_mode))
+      continue;
+    r->mtime = st.st_mtime;
+    *dname = r->dname;
+    *fname = r->fname;
+    return 1;
+  }
+}
+
+/* open a stream on the data of the current entry, to be closed with fclose */
+FILE *db_stream(struct db_reader *r) {
+  if(r->pack.map != NULL)
+    return fopencookie(r, "r", pack_stream_funcs);
+  if(r->a != NULL)
+    return open_archive_stream(r->a);
+  return fopen(r->path, "r");
+}
+
+/* read a block of the data of the current entry, like read(2) */
+static ssize_t db_read_block(struct db_reader *r, char *buf, size_t len) {
+  size_t n;
+
+  if(r->pack.map != NULL)
+    return pack_read(r, buf, len);
+  if(r->a != NULL)
+    return archive_read_data(r->a, buf, len);
+  if(r->fp == NULL) {
+    r->fp = fopen(r->path, "r");
+    if(r->fp == NULL)
+      return -1;
+  }
+  n = fread(buf, 1, len, r->fp);
+  if(n == 0 && ferror(r->fp))
+    return -1;
+  return n;
+}
+
+static ssize_t db_read(struct db_reader *r, char *buf, size_t len) {
+  double start;
+  ssize_t n;
+
+  if(r->stats == NULL)
+    return db_read_block(r, buf, len);
+  start = db_clock();
+  n = db_read_block(r, buf, len);
+  db_account(r, start);
+  if(r->a == NULL && n > 0)
+    r->stats->bytes += n;
+  return n;
+}
+
+/* Return the next line of the current entry in *line, without its newline
+ * and NUL terminated, and its length in *len. The line is only valid until
+ * the next call. Return 1 if there is a line, 0 at the end of the entry,
+ * -1 on error or if memory is exhausted. */
+int db_getline(struct db_reader *r, char **line, size_t *len) {
+  char *nl;
+  ssize_t n;
+  size_t pending;
+
+  while(1) {
+    pending = r->end - r->start;
+    nl = pending ? memchr(r->buf + r->start, '\n', pending) : NULL;
+    if(nl != NULL || (r->eof && pending > 0)) {
+      *line = r->buf + r->start;
+      if(nl == NULL)
+        nl = r->buf + r->end;
+      *len = nl - *line;
+      *nl = '\0';
+      r->start += *len + 1;
+      if(r->start > r->end)
+        r->start = r->end;
+      return 1;
+    }
+    if(r->eof)
+      return 0;
+    /* keep the beginning of the line and read the next block after it */
+    if(r->start > 0) {
+      memmove(r->buf, r->buf + r->start, pending);
+      r->start = 0;
+      r->end = pending;
+    }
+    /* one more byte is kept for the NUL of a last line without newline */
+    if(r->alloc - r->end < LINEBUFLEN / 2 + 1) {
+      nl = realloc(r->buf, r->alloc + LINEBUFLEN);
+      if(nl == NULL)
+        return -1;
+      r->buf = nl;
+      r->alloc += LINEBUFLEN;
+    }
+    n = db_read(r, r->buf + r->end, r->alloc - r->end - 1);
+    if(n < 0)
+      return -1;
+    if(n == 0)
+      r->eof = 1;
+    r->end += n;
+  }
+}
+
+/* read all the data of the current entry in *buf, grown as needed, and
+ * set its length in *size; return 0, or -1 on error */
+int db_read_entry(struct db_reader *r, char **buf, size_t *alloc, size_t *size) {
+  ssize_t n;
+
+  *size = 0;
+  do {
+    if(grow_array((void**)buf, alloc, *size + LINEBUFLEN, 1) == -1)
+      return -1;
+    n = db_read(r, *buf + *size, *alloc - *size);
+    if(n < 0)
+      return -1;
+    *size += n;
+  } while(n > 0);
+  return 0;
+}
+
+void db_skip(struct db_reader *r) {
+  double start;
+
+  if(r->a == NULL)
+    return;
+  start = r->stats ? db_clock() : 0;
+  archive_read_data_skip(r->a);
+  if(r->stats)
+    db_account(r, start);
+}
+
+time_t db_entry_mtime(struct db_reader *r) {
+  return r->mtime;
+}
+
+void db_close(struct db_reader *r) {
+  int i;
+
+  if(r == NULL)
+    return;
+  if(r->a != NULL)
+    archive_read_finish(r->a);
+  if(r->fp != NULL)
+    fclose(r->fp);
+  if(r->zinit)
+    inflateEnd(&r->z);
+  pack_unmap(&r->pack);
+  free(r->buf);
+  for(i = 0; i < r->npkgdirs; i++)
+    free(r->pkgdirs[i]);
+  free(r->pkgdirs);
+  free(r->root);
+  free(r);
+}
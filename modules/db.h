@@ -0,0 +1,42 @@
+#ifndef DB_H
+#define DB_H
+
+#include <stdio.h>
+#include <stdint.h>
+#include <time.h>
+#include <sys/types.h>
+
+/* Counters of the reading of a files database, see stats.h */
+struct db_stats {
+  uint64_t bytes;         /* decompressed */
+  uint64_t packages;
+  uint64_t lines;
+  uint64_t match_calls;
+  uint64_t matches;
+  uint64_t objects;
+  double read_time;       /* reading and decompressing the entries */
+  double scan_time;       /* reading and matching, read_time included */
+  double objects_time;
+};
+
+/* Reader of the entries of a files database. This is either a tarball, a
+ * directory laid out like the local database of pacman, that is a
+ * <pkgname>-<pkgver>/ directory holding desc, depends and files per package,
+ * or a pack made by build_pack whose entries are only decompressed when
+ * they are read. */
+struct db_reader;
+
+int db_exists(const char *path);
+struct db_reader *db_open(const char *path);
+int db_is_dir(struct db_reader *r);
+int db_next(struct db_reader *r, const char **dname, const char **fname);
+FILE *db_stream(struct db_reader *r);
+int db_getline(struct db_reader *r, char **line, size_t *len);
+int db_read_entry(struct db_reader *r, char **buf, size_t *alloc, size_t *size);
+void db_skip(struct db_reader *r);
+time_t db_entry_mtime(struct db_reader *r);
+void db_close(struct db_reader *r);
+void db_set_stats(struct db_reader *r, struct db_stats *stats);
+double db_clock(void);
+
+#endif /* DB_H */
@@ -0,0 +1,602 @@
+#include <Python.h>
+#include <archive.h>
+#include <archive_entry.h>
+#include <errno.h>
+#include <limits.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <unistd.h>
+#include <sys/stat.h>
+#include "delta.h"
+#include "util.h"
+#include "db.h"
+
+typedef enum {
+  DELTA_OK,
+  DELTA_ENOMEM,
+  DELTA_EREAD,      /* a database can not be read */
+  DELTA_EWRITE,     /* the output can not be written, see errno */
+  DELTA_EINVALID,   /* the delta can not be read or is not valid */
+  DELTA_EAPPLY      /* the delta was not made from the database */
+} DeltaError;
+
+/* A files tarball written to a temporary file, renamed over path once it
+ * is complete so that readers never see a partial one */
+struct writer {
+  struct archive *a;
+  int fd;
+  char *tmp;
+  const char *path;
+};
+
+static int writer_open(struct writer *w, const char *path) {
+  memset(w, 0, sizeof(struct writer));
+  w->fd = -1;
+  w->path = path;
+  w->fd = create_temp(path, &w->tmp);
+  if(w->fd == -1)
+    return -1;
+  w->a = archive_write_new();
+  if(w->a == NULL ||
+      archive_write_set_compression_gzip(w->a) != ARCHIVE_OK ||
+      archive_write_set_format_pax_restricted(w->a) != ARCHIVE_OK ||
+      archive_write_open_fd(w->a, w->fd) != ARCHIVE_OK) {
+    if(w->a != NULL)
+      archive_write_finish(w->a);
+    close(w->fd);
+    unlink(w->tmp);
+    free(w->tmp);
+    return -1;
+  }
+  return 0;
+}
+
+/* finish the tarball if ok, or throw it away; return -1 if it could not be
+ * finished */
+static int writer_close(struct writer *w, int ok) {
+  int err;
+
+  if(ok && (archive_write_close(w->a) != ARCHIVE_OK || fsync(w->fd) == -1))
+    ok = 0;
+  archive_write_finish(w->a);
+  if(close(w->fd) == -1)
+    ok = 0;
+  if(ok && rename(w->tmp, w->path) == -1)
+    ok = 0;
+  if(!ok) {
+    err = errno;
+    unlink(w->tmp);
+    errno = err;
+  }
+  free(w->tmp);
+  return ok ? 0 : -1;
+}
+
+/* write an entry of the package directory dname, the directory itself if
+ * fname is NULL; an entry without dname is written at the root */
+static int write_entry(struct writer *w, const char *dname, const char *fname,
+                       time_t mtime, const char *data, size_t size) {
+  struct archive_entry *entry;
+  char path[PATH_MAX];
+  int ret = 0;
+
+  if(dname == NULL)
+    snprintf(path, PATH_MAX, "%s", fname);
+  else if(fname == NULL)
+    snprintf(path, PATH_MAX, "%s/", dname);
+  else
+    snprintf(path, PATH_MAX, "%s/%s", dname, fname);
+  entry = archive_entry_new();
+  if(entry == NULL)
+    return -1;
+  archive_entry_set_pathname(entry, path);
+  archive_entry_set_filetype(entry, fname == NULL ? AE_IFDIR : AE_IFREG);
+  archive_entry_set_perm(entry, fname == NULL ? 0755 : 0644);
+  archive_entry_set_size(entry, fname == NULL ? 0 : size);
+  archive_entry_set_mtime(entry, mtime, 0);
+  if(archive_write_header(w->a, entry) != ARCHIVE_OK)
+    ret = -1;
+  else if(fname != NULL && size > 0 && archive_write_data(w->a, data, size) != (ssize_t)size)
+    ret = -1;
+  archive_entry_free(entry);
+  return ret;
+}
+
+static int cmp_string(const void *x, const void *y) {
+  return strcmp(*(char**)x, *(char**)y);
+}
+
+/* a sorted array of package directory names, to find out whether a
+ * package is in a database */
+struct names {
+  char **names;
+  size_t n, alloc;
+};
+
+static void names_free(struct names *s) {
+  free(s->names);
+}
+
+static int names_add(struct names *s, char *name) {
+  if(grow_array((void**)&s->names, &s->alloc, s->n + 1, sizeof(char*)) == -1)
+    return -1;
+  s->names[s->n++] = name;
+  return 0;
+}
+
+static void names_sort(struct names *s) {
+  qsort(s->names, s->n, sizeof(char*), cmp_string);
+}
+
+static char **names_find(struct names *s, const char *name) {
+  return bsearch(&name, s->names, s->n, sizeof(char*), cmp_string);
+}
+
+/* An entry of a delta */
+struct delta_entry {
+  char *dname;
+  char *fname;
+  time_t mtime;
+  char *data;
+  size_t size;
+};
+
+/* The entries of a package of a delta */
+struct delta_pkg {
+  size_t pos;
+  size_t first, n;
+};
+
+/* A delta read in memory */
+struct delta {
+  struct delta_entry *entries;
+  size_t nentries, ealloc;
+  struct delta_pkg *pkgs;
+  size_t npkgs, palloc;
+  /* the packages of the new database, in order, and sorted */
+  char *manifest;
+  char **packages;
+  size_t npackages, packages_alloc;
+  struct names sorted;
+  /* by position in packages */
+  char *in_delta, *written;
+};
+
+static void delta_free(struct delta *d) {
+  size_t i;
+
+  for(i = 0; i < d->nentries; i++) {
+    free(d->entries[i].dname);
+    free(d->entries[i].fname);
+    free(d->entries[i].data);
+  }
+  free(d->entries);
+  free(d->pkgs);
+  free(d->manifest);
+  free(d->packages);
+  names_free(&d->sorted);
+  free(d->in_delta);
+  free(d->written);
+}
+
+/* return the position of the package dname in the new database, -1 if it
+ * is not there */
+static ssize_t delta_pos(struct delta *d, const char *dname) {
+  char **name = names_find(&d->sorted, dname);
+  size_t lo = 0, hi = d->npackages, mid;
+
+  if(name == NULL)
+    return -1;
+  /* the sorted names point in the manifest, in the order of packages */
+  while(lo < hi) {
+    mid = lo + (hi - lo) / 2;
+    if(d->packages[mid] == *name)
+      return mid;
+    if(d->packages[mid] < *name)
+      lo = mid + 1;
+    else
+      hi = mid;
+  }
+  return -1;
+}
+
+static DeltaError parse_manifest(struct delta *d, size_t size) {
+  char *line, *next;
+  int in_packages = 0;
+  size_t i;
+
+  d->manifest[size] = '\0';
+  for(line = d->manifest; line != NULL; line = next) {
+    next = strchr(line, '\n');
+    if(next != NULL)
+      *next++ = '\0';
+    if(line[0] == '%') {
+      in_packages = strcmp(line, "%PACKAGES%") == 0;
+      continue;
+    }
+    if(!in_packages || line[0] == '\0')
+      continue;
+    if(grow_array((void**)&d->packages, &d->packages_alloc, d->npackages + 1, sizeof(char*)) == -1 ||
+        names_add(&d->sorted, line) == -1)
+      return DELTA_ENOMEM;
+    d->packages[d->npackages++] = line;
+  }
+  names_sort(&d->sorted);
+  for(i = 1; i < d->sorted.n; i++) {
+    if(strcmp(d->sorted.names[i - 1], d->sorted.names[i]) == 0)
+      return DELTA_EINVALID;
+  }
+  d->in_delta = calloc(d->npackages + 1, 1);
+  d->written = calloc(d->npackages + 1, 1);
+  if(d->in_delta == NULL || d->written == NULL)
+    return DELTA_ENOMEM;
+  return DELTA_OK;
+}
+
+static int cmp_delta_pkg(const void *x, const void *y) {
+  const struct delta_pkg *p = x, *q = y;
+
+  return (p->pos > q->pos) - (p->pos < q->pos);
+}
+
+/* group the entries by package and sort them in the order of the new
+ * database */
+static DeltaError group_packages(struct delta *d) {
+  struct delta_pkg *pkg;
+  ssize_t pos;
+  size_t i;
+
+  for(i = 0; i < d->nentries; i++) {
+    if(d->npkgs > 0 && strcmp(d->entries[i].dname, d->entries[d->pkgs[d->npkgs - 1].first].dname) == 0) {
+      d->pkgs[d->npkgs - 1].n++;
+      continue;
+    }
+    pos = delta_pos(d, d->entries[i].dname);
+    if(pos == -1 || d->in_delta[pos])
+      return DELTA_EINVALID;
+    d->in_delta[pos] = 1;
+    if(grow_array((void**)&d->pkgs, &d->palloc, d->npkgs + 1, sizeof(struct delta_pkg)) == -1)
+      return DELTA_ENOMEM;
+    pkg = &d->pkgs[d->npkgs++];
+    pkg->pos = pos;
+    pkg->first = i;
+    pkg->n = 1;
+  }
+  qsort(d->pkgs, d->npkgs, sizeof(struct delta_pkg), cmp_delta_pkg);
+  return DELTA_OK;
+}
+
+static DeltaError read_delta(struct delta *d, const char *deltafile) {
+  struct db_reader *db;
+  struct delta_entry *e;
+  const char *dname, *fname;
+  char *data;
+  size_t alloc, size, manifest_size = 0;
+  DeltaError ret = DELTA_OK;
+
+  db = db_open(deltafile);
+  if(db == NULL)
+    return DELTA_EINVALID;
+  while(ret == DELTA_OK && db_next(db, &dname, &fname)) {
+    data = NULL;
+    alloc = 0;
+    if(db_read_entry(db, &data, &alloc, &size) == -1) {
+      free(data);
+      ret = DELTA_EINVALID;
+      break;
+    }
+    if(strcmp(dname, ".") == 0) {
+      if(strcmp(fname, DELTA_MANIFEST) == 0 && d->manifest == NULL) {
+        d->manifest = data;
+        manifest_size = size;
+      } else {
+        free(data);
+      }
+      continue;
+    }
+    if(grow_array((void**)&d->entries, &d->ealloc, d->nentries + 1, sizeof(struct delta_entry)) == -1) {
+      free(data);
+      ret = DELTA_ENOMEM;
+      break;
+    }
+    e = &d->entries[d->nentries++];
+    e->dname = strdup(dname);
+    e->fname = strdup(fname);
+    e->mtime = db_entry_mtime(db);
+    e->data = data;
+    e->size = size;
+    if(e->dname == NULL || e->fname == NULL)
+      ret = DELTA_ENOMEM;
+  }
+  db_close(db);
+  if(ret != DELTA_OK)
+    return ret;
+  if(d->manifest == NULL)
+    return DELTA_EINVALID;
+  /* db_read_entry always leaves room for a NUL */
+  ret = parse_manifest(d, manifest_size);
+  if(ret == DELTA_OK)
+    ret = group_packages(d);
+  return ret;
+}
+
+static int write_delta_pkg(struct writer *w, struct delta *d, struct delta_pkg *pkg) {
+  struct delta_entry *e = &d->entries[pkg->first];
+  size_t i;
+
+  if(write_entry(w, e->dname, NULL, e->mtime, NULL, 0) == -1)
+    return -1;
+  for(i = 0; i < pkg->n; i++, e++) {
+    if(write_entry(w, e->dname, e->fname, e->mtime, e->data, e->size) == -1)
+      return -1;
+  }
+  d->written[pkg->pos] = 1;
+  return 0;
+}
+
+/* write the packages of filename kept by the delta and those of the delta,
+ * in the order of the new database */
+static DeltaError merge_delta(struct writer *w, struct delta *d, const char *filename) {
+  struct db_reader *db;
+  const char *dname, *fname;
+  char *cur = NULL, *data = NULL;
+  size_t alloc = 0, size, k = 0, i;
+  ssize_t pos = -1;
+  int keep = 0;
+  DeltaError ret = DELTA_OK;
+
+  db = db_open(filename);
+  if(db == NULL)
+    return DELTA_EREAD;
+  while(ret == DELTA_OK && db_next(db, &dname, &fname)) {
+    if(cur == NULL || strcmp(cur, dname) != 0) {
+      free(cur);
+      cur = strdup(dname);
+      if(cur == NULL) {
+        ret = DELTA_ENOMEM;
+        break;
+      }
+      pos = delta_pos(d, dname);
+      keep = pos != -1 && !d->in_delta[pos] && !d->written[pos];
+      if(keep) {
+        while(k < d->npkgs && d->pkgs[k].pos < (size_t)pos) {
+          if(write_delta_pkg(w, d, &d->pkgs[k++]) == -1) {
+            ret = DELTA_EWRITE;
+            break;
+          }
+        }
+        if(ret == DELTA_OK && write_entry(w, dname, NULL, db_entry_mtime(db), NULL, 0) == -1)
+          ret = DELTA_EWRITE;
+        d->written[pos] = 1;
+      }
+    }
+    if(ret != DELTA_OK)
+      break;
+    if(!keep) {
+      db_skip(db);
+      continue;
+    }
+    if(db_read_entry(db, &data, &alloc, &size) == -1)
+      ret = DELTA_EREAD;
+    else if(write_entry(w, dname, fname, db_entry_mtime(db), data, size) == -1)
+      ret = DELTA_EWRITE;
+  }
+  db_close(db);
+  free(cur);
+  free(data);
+  while(ret == DELTA_OK && k < d->npkgs) {
+    if(write_delta_pkg(w, d, &d->pkgs[k++]) == -1)
+      ret = DELTA_EWRITE;
+  }
+  /* every package of the new database is either kept or in the delta */
+  for(i = 0; ret == DELTA_OK && i < d->npackages; i++) {
+    if(!d->written[i])
+      ret = DELTA_EAPPLY;
+  }
+  return ret;
+}
+
+static DeltaError write_applied(const char *filename, const char *deltafile, const char *newfile) {
+  struct delta d;
+  struct writer w;
+  DeltaError ret;
+
+  memset(&d, 0, sizeof(struct delta));
+  ret = read_delta(&d, deltafile);
+  if(ret == DELTA_OK) {
+    if(writer_open(&w, newfile) == -1) {
+      ret = DELTA_EWRITE;
+    } else {
+      ret = merge_delta(&w, &d, filename);
+      if(writer_close(&w, ret == DELTA_OK) == -1 && ret == DELTA_OK)
+        ret = DELTA_EWRITE;
+    }
+  }
+  delta_free(&d);
+  return ret;
+}
+
+/* list the directory names of the packages of filename */
+static DeltaError read_names(struct names *s, const char *filename) {
+  struct db_reader *db;
+  const char *dname, *fname;
+  char *name;
+  DeltaError ret = DELTA_OK;
+
+  db = db_open(filename);
+  if(db == NULL)
+    return DELTA_EREAD;
+  while(db_next(db, &dname, &fname)) {
+    db_skip(db);
+    if(s->n > 0 && strcmp(s->names[s->n - 1], dname) == 0)
+      continue;
+    name = strdup(dname);
+    if(name == NULL || names_add(s, name) == -1) {
+      free(name);
+      ret = DELTA_ENOMEM;
+      break;
+    }
+  }
+  db_close(db);
+  names_sort(s);
+  return ret;
+}
+
+/* write to the delta the packages of newfile that are not in old, and the
+ * manifest listing all of them */
+static DeltaError write_new(struct writer *w, struct names *old, const char *newfile) {
+  struct db_reader *db;
+  const char *dname, *fname;
+  char *cur = NULL, *data = NULL, *manifest = NULL;
+  size_t alloc = 0, size, mlen, malloc_size = 0, len;
+  int added = 0;
+  DeltaError ret = DELTA_OK;
+
+  db = db_open(newfile);
+  if(db == NULL)
+    return DELTA_EREAD;
+  mlen = strlen("%PACKAGES%\n");
+  if(grow_array((void**)&manifest, &malloc_size, mlen + 1, 1) == -1) {
+    db_close(db);
+    return DELTA_ENOMEM;
+  }
+  strcpy(manifest, "%PACKAGES%\n");
+  while(ret == DELTA_OK && db_next(db, &dname, &fname)) {
+    if(cur == NULL || strcmp(cur, dname) != 0) {
+      free(cur);
+      cur = strdup(dname);
+      len = strlen(dname);
+      if(cur == NULL || grow_array((void**)&manifest, &malloc_size, mlen + len + 2, 1) == -1) {
+        ret = DELTA_ENOMEM;
+        break;
+      }
+      memcpy(manifest + mlen, dname, len);
+      manifest[mlen + len] = '\n';
+      mlen += len + 1;
+      added = names_find(old, dname) == NULL;
+      if(added && write_entry(w, dname, NULL, db_entry_mtime(db), NULL, 0) == -1)
+        ret = DELTA_EWRITE;
+    }
+    if(ret != DELTA_OK)
+      break;
+    if(!added) {
+      db_skip(db);
+      continue;
+    }
+    if(db_read_entry(db, &data, &alloc, &size) == -1)
+      ret = DELTA_EREAD;
+    else if(write_entry(w, dname, fname, db_entry_mtime(db), data, size) == -1)
+      ret = DELTA_EWRITE;
+  }
+  db_close(db);
+  if(ret == DELTA_OK && write_entry(w, NULL, DELTA_MANIFEST, time(NULL), manifest, mlen) == -1)
+    ret = DELTA_EWRITE;
+  free(cur);
+  free(data);
+  free(manifest);
+  return ret;
+}
+
+static DeltaError write_delta(const char *oldfile, const char *newfile, const char *deltafile,
+                              const char **failed) {
+  struct names old;
+  struct writer w;
+  DeltaError ret;
+  size_t i;
+
+  memset(&old, 0, sizeof(struct names));
+  *failed = oldfile;
+  ret = read_names(&old, oldfile);
+  if(ret == DELTA_OK) {
+    *failed = newfile;
+    if(writer_open(&w, deltafile) == -1) {
+      ret = DELTA_EWRITE;
+    } else {
+      ret = write_new(&w, &old, newfile);
+      if(writer_close(&w, ret == DELTA_OK) == -1 && ret == DELTA_OK)
+        ret = DELTA_EWRITE;
+    }
+  }
+  for(i = 0; i < old.n; i++)
+    free(old.names[i]);
+  names_free(&old);
+  return ret;
+}
+
+/* set the Python exception of a delta error */
+static void delta_error(DeltaError err, const char *filename, const char *deltafile, const char *outfile) {
+  switch(err) {
+    case DELTA_OK:
+      break;
+    case DELTA_EREAD:
+      PyErr_Format(PyExc_IOError, "Unable to read files tarball: %s", filename);
+      break;
+    case DELTA_EWRITE:
+      PyErr_SetFromErrnoWithFilename(PyExc_IOError, (char*)outfile);
+      break;
+    case DELTA_EINVALID:
+      PyErr_Format(PyExc_IOError, "Invalid files delta: %s", deltafile);
+      break;
+    case DELTA_EAPPLY:
+      PyErr_Format(PyExc_IOError, "Files delta %s does not apply to %s", deltafile, filename);
+      break;
+    default:
+      PyErr_NoMemory();
+      break;
+  }
+}
+
+static int check_db(const char *filename) {
+  struct stat st;
+
+  if(strlen(filename)<=0) {
+    PyErr_SetString(PyExc_ValueError, "Empty files tarball name given.");
+    return -1;
+  }
+  if(stat(filename, &st)==-1 || !(S_ISREG(st.st_mode) || S_ISDIR(st.st_mode))) {
+    PyErr_Format(PyExc_IOError, "File does not exist: %s\n", filename);
+    return -1;
+  }
+  return 0;
+}
+
+PyObject *apply_delta(PyObject *self, PyObject *args, PyObject *kw) {
+  const char *filename, *deltafile, *newfile;
+  static char *kwlist[] = {"filename", "deltafile", "newfile", NULL};
+  DeltaError ret;
+
+  if(!PyArg_ParseTupleAndKeywords(args, kw, "sss", kwlist, &filename, &deltafile, &newfile))
+    return NULL;
+  if(check_db(filename) == -1 || check_db(deltafile) == -1)
+    return NULL;
+
+  Py_BEGIN_ALLOW_THREADS
+  ret = write_applied(filename, deltafile, newfile);
+  Py_END_ALLOW_THREADS
+  if(ret != DELTA_OK) {
+    delta_error(ret, filename, deltafile, newfile);
+    return NULL;
+  }
+  Py_RETURN_NONE;
+}
+
+PyObject *make_delta(PyObject *self, PyObject *args, PyObject *kw) {
+  const char *oldfile, *newfile, *deltafile, *failed;
+  static char *kwlist[] = {"oldfile", "newfile", "deltafile", NULL};
+  DeltaError ret;
+
+  if(!PyArg_ParseTupleAndKeywords(args, kw, "sss", kwlist, &oldfile, &newfile, &deltafile))
+    return NULL;
+  if(check_db(oldfile) == -1 || check_db(newfile) == -1)
+    return NULL;
+
+  Py_BEGIN_ALLOW_THREADS
+  ret = write_delta(oldfile, newfile, deltafile, &failed);
+  Py_END_ALLOW_THREADS
+  if(ret != DELTA_OK) {
+    delta_error(ret, failed, deltafile, deltafile);
+    return NULL;
+  }
+  Py_RETURN_NONE;
+}
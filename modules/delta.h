@@ -0,0 +1,19 @@
+#ifndef DELTA_H
+#define DELTA_H
+
+#include <Python.h>
+
+/* A files delta is a files tarball holding the package directories that
+ * are not in the database it applies to, and a .DELTA entry at its root
+ * with the directory names of all the packages of the new database, in
+ * its order:
+ *   %PACKAGES%
+ *   acl-2.2.49-2
+ *   ...
+ * The packages of the old database that are not listed are removed. */
+#define DELTA_MANIFEST ".DELTA"
+
+PyObject *apply_delta(PyObject *self, PyObject *args, PyObject *kw);
+PyObject *make_delta(PyObject *self, PyObject *args, PyObject *kw);
+
+#endif /* DELTA_H */
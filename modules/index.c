@@ -0,0 +1,950 @@
+#include <Python.h>
+#include <structmember.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <errno.h>
+#include <fcntl.h>
+#include <unistd.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include "index.h"
+#include "search.h"
+#include "util.h"
+#include "db.h"
+#include "result.h"
+
+/* A mapped index file */
+struct index_map {
+  char *map;
+  size_t size;
+  time_t mtime;
+  const struct index_header *hdr;
+  const struct index_pkg *pkgs;
+  const uint32_t *files;
+  const struct index_path *paths;
+  const struct index_name *names;
+  const char *strings;
+};
+
+static int table_fits(size_t size, uint64_t off, uint64_t count, size_t elsize) {
+  return off <= size && count * elsize <= size - off;
+}
+
+/* map and validate indexfile; return -1 with errno set if it can not be
+ * read, -2 if it is not a valid index */
+static int map_index(struct index_map *m, const char *indexfile) {
+  const struct index_header *hdr;
+  struct stat st;
+  void *map;
+  int fd;
+
+  fd = open(indexfile, O_RDONLY);
+  if(fd == -1)
+    return -1;
+  if(fstat(fd, &st) == -1 || st.st_size < (off_t)sizeof(struct index_header)) {
+    close(fd);
+    return -2;
+  }
+  map = mmap(NULL, st.st_size, PROT_READ, MAP_SHARED, fd, 0);
+  close(fd);
+  if(map == MAP_FAILED)
+    return -1;
+
+  hdr = map;
+  if(memcmp(hdr->magic, INDEX_MAGIC, sizeof(INDEX_MAGIC)) != 0 ||
+      hdr->version != INDEX_VERSION ||
+      !table_fits(st.st_size, hdr->pkgs_off, hdr->npkgs, sizeof(struct index_pkg)) ||
+      !table_fits(st.st_size, hdr->files_off, hdr->nfiles, sizeof(uint32_t)) ||
+      !table_fits(st.st_size, hdr->paths_off, hdr->nfiles, sizeof(struct index_path)) ||
+      !table_fits(st.st_size, hdr->names_off, hdr->nnames, sizeof(struct index_name)) ||
+      !table_fits(st.st_size, hdr->strings_off, hdr->strings_len, 1) ||
+      (hdr->strings_len > 0 && ((char*)map)[hdr->strings_off + hdr->strings_len - 1] != '\0')) {
+    munmap(map, st.st_size);
+    return -2;
+  }
+
+  m->map = map;
+  m->size = st.st_size;
+  m->mtime = st.st_mtime;
+  m->hdr = hdr;
+  m->pkgs = (struct index_pkg*)(m->map + hdr->pkgs_off);
+  m->files = (uint32_t*)(m->map + hdr->files_off);
+  m->paths = (struct index_path*)(m->map + hdr->paths_off);
+  m->names = (struct index_name*)(m->map + hdr->names_off);
+  m->strings = m->map + hdr->strings_off;
+  return 0;
+}
+
+static void unmap_index(struct index_map *m) {
+  if(m->map != NULL)
+    munmap(m->map, m->size);
+  m->map = NULL;
+}
+
+static const char *index_string(const struct index_map *m, uint32_t off) {
+  if(off >= m->hdr->strings_len)
+    return "";
+  return m->strings + off;
+}
+
+static int fold_char(unsigned char c) {
+  return (c >= 'A' && c <= 'Z') ? c - 'A' + 'a' : c;
+}
+
+/* compare s1 and s2 ignoring the ASCII case, whatever the locale, so that
+ * the order of the tables does not depend on who built the index */
+static int fold_cmp(const char *s1, const char *s2) {
+  int c1, c2;
+
+  do {
+    c1 = fold_char(*s1++);
+    c2 = fold_char(*s2++);
+  } while(c1 == c2 && c1 != '\0');
+  return c1 - c2;
+}
+
+/* order of the keys of the tables: the folded strings first, so that the
+ * strings that only differ by their case are next to each other */
+static int key_cmp(const char *s1, const char *s2) {
+  int r = fold_cmp(s1, s2);
+
+  return r ? r : strcmp(s1, s2);
+}
+
+/* binary search of a package by name, NULL if not found or corrupted */
+static const struct index_pkg *find_pkg(const struct index_map *m, const char *name) {
+  const struct index_pkg *pkg;
+  size_t lo = 0, hi = m->hdr->npkgs, mid;
+  int r;
+
+  while(lo < hi) {
+    mid = lo + (hi - lo) / 2;
+    pkg = &m->pkgs[mid];
+    r = key_cmp(index_string(m, pkg->name), name);
+    if(r == 0) {
+      if((uint64_t)pkg->first_file + pkg->nfiles > m->hdr->nfiles)
+        return NULL;
+      return pkg;
+    }
+    if(r < 0)
+      lo = mid + 1;
+    else
+      hi = mid;
+  }
+  return NULL;
+}
+
+#define NO_PKG UINT32_MAX
+
+/* In-memory tables collected while reading a files tarball */
+struct builder {
+  char *strings;
+  size_t slen, salloc;
+  struct index_pkg *pkgs;
+  size_t npkgs, palloc;
+  uint32_t *files;
+  size_t nfiles, falloc;
+  /* package of the previous index each package was copied from, NO_PKG
+   * if it was read */
+  uint32_t *old_pkgs;
+  size_t oalloc;
+};
+
+static int add_string(struct builder *b, const char *s, uint32_t *off) {
+  size_t len = strlen(s) + 1;
+
+  if(b->slen + len > UINT32_MAX)
+    return -1;
+  if(grow_array((void**)&b->strings, &b->salloc, b->slen + len, 1) == -1)
+    return -1;
+  memcpy(b->strings + b->slen, s, len);
+  *off = b->slen;
+  b->slen += len;
+  return 0;
+}
+
+static void builder_free(struct builder *b) {
+  free(b->old_pkgs);
+  free(b->strings);
+  free(b->pkgs);
+  free(b->files);
+}
+
+/* copy the file list of pkg from a previous index, if it is still current */
+static int reuse_files(struct builder *b, struct index_pkg *pkg,
+                       const struct index_map *old, const char *name,
+                       const char *version, uint32_t *from) {
+  const struct index_pkg *opkg;
+  uint32_t i;
+
+  opkg = find_pkg(old, name);
+  if(opkg == NULL || strcmp(index_string(old, opkg->version), version))
+    return 0;
+  for(i = 0; i < opkg->nfiles; i++) {
+    if(grow_array((void**)&b->files, &b->falloc, b->nfiles + 1, sizeof(uint32_t)) == -1 ||
+        add_string(b, index_string(old, old->files[opkg->first_file + i]), &b->files[b->nfiles]) == -1)
+      return -1;
+    b->nfiles++;
+    pkg->nfiles++;
+  }
+  *from = opkg - old->pkgs;
+  return 1;
+}
+
+/* old, if not NULL, is the previous index of the database: the packages
+ * of a tarball with the same name and version in it, or those of a
+ * directory whose files entry was not modified since it was written, are
+ * taken from it instead of being read again */
+static int read_db(struct builder *b, const char *filename, const struct index_map *old) {
+  struct db_reader *db;
+  struct index_pkg *pkg;
+  const char *fname, *dname;
+  char *l, *pkgname, *pkgver;
+  size_t len;
+  int ret = 0, in_files, r;
+
+  db = db_open(filename);
+  if(db == NULL)
+    return -1;
+  while (db_next(db, &dname, &fname)) {
+    if(strcmp(fname, "files")) {
+      db_skip(db);
+      continue;
+    }
+    if (splitname(dname, &pkgname, &pkgver) == -1) {
+      db_skip(db);
+      continue;
+    }
+    if(grow_array((void**)&b->pkgs, &b->palloc, b->npkgs + 1, sizeof(struct index_pkg)) == -1 ||
+        grow_array((void**)&b->old_pkgs, &b->oalloc, b->npkgs + 1, sizeof(uint32_t)) == -1) {
+      free(pkgname);
+      free(pkgver);
+      ret = -1;
+      break;
+    }
+    pkg = &b->pkgs[b->npkgs];
+    ret = add_string(b, pkgname, &pkg->name);
+    if(ret == 0)
+      ret = add_string(b, pkgver, &pkg->version);
+    pkg->first_file = b->nfiles;
+    pkg->nfiles = 0;
+    b->old_pkgs[b->npkgs] = NO_PKG;
+    if(ret == 0 && old != NULL && (!db_is_dir(db) || db_entry_mtime(db) < old->mtime))
+      ret = reuse_files(b, pkg, old, pkgname, pkgver, &b->old_pkgs[b->npkgs]);
+    free(pkgname);
+    free(pkgver);
+    if(ret == -1)
+      break;
+    if(ret == 1) {
+      ret = 0;
+      b->npkgs++;
+      db_skip(db);
+      continue;
+    }
+
+    in_files = 1;
+    while((r = db_getline(db, &l, &len)) == 1) {
+      if(l[0] == '%') {
+        in_files = strcmp(l, "%FILES%") == 0;
+        continue;
+      }
+      if(!in_files || l[0] == '\0')
+        continue;
+      if(grow_array((void**)&b->files, &b->falloc, b->nfiles + 1, sizeof(uint32_t)) == -1 ||
+          add_string(b, l, &b->files[b->nfiles]) == -1) {
+        ret = -1;
+        break;
+      }
+      b->nfiles++;
+      pkg->nfiles++;
+    }
+    if(r == -1)
+      ret = -1;
+    if(ret == -1)
+      break;
+    b->npkgs++;
+  }
+  db_close(db);
+  return ret;
+}
+
+static int cmp_pkg(const void *x, const void *y, void *arg) {
+  const struct builder *b = arg;
+  const struct index_pkg *p = &b->pkgs[*(uint32_t*)x], *q = &b->pkgs[*(uint32_t*)y];
+  int r = key_cmp(b->strings + p->name, b->strings + q->name);
+
+  if(r)
+    return r;
+  return strcmp(b->strings + p->version, b->strings + q->version);
+}
+
+/* sort the packages by name, with the previous packages they come from */
+static int sort_pkgs(struct builder *b) {
+  struct index_pkg *pkgs;
+  uint32_t *order, *old_pkgs;
+  size_t i;
+
+  order = malloc((b->npkgs + 1) * sizeof(uint32_t));
+  pkgs = malloc((b->npkgs + 1) * sizeof(struct index_pkg));
+  old_pkgs = malloc((b->npkgs + 1) * sizeof(uint32_t));
+  if(order == NULL || pkgs == NULL || old_pkgs == NULL) {
+    free(order);
+    free(pkgs);
+    free(old_pkgs);
+    return -1;
+  }
+  for(i = 0; i < b->npkgs; i++)
+    order[i] = i;
+  qsort_r(order, b->npkgs, sizeof(uint32_t), cmp_pkg, b);
+  for(i = 0; i < b->npkgs; i++) {
+    pkgs[i] = b->pkgs[order[i]];
+    old_pkgs[i] = b->old_pkgs[order[i]];
+  }
+  free(order);
+  free(b->pkgs);
+  free(b->old_pkgs);
+  b->pkgs = pkgs;
+  b->old_pkgs = old_pkgs;
+  b->palloc = b->oalloc = b->npkgs + 1;
+  return 0;
+}
+
+/* paths and names are sorted by package among the strings equal but for
+ * their case, so that the files of a package are next to each other
+ * whether the case is ignored or not */
+static int cmp_path(const void *x, const void *y, void *s) {
+  const struct index_path *p = x, *q = y;
+  int r = fold_cmp((char*)s + p->path, (char*)s + q->path);
+
+  if(r)
+    return r;
+  if(p->pkg != q->pkg)
+    return (p->pkg > q->pkg) - (p->pkg < q->pkg);
+  return strcmp((char*)s + p->path, (char*)s + q->path);
+}
+
+static int cmp_name(const void *x, const void *y, void *s) {
+  const struct index_name *p = x, *q = y;
+  int r = fold_cmp((char*)s + p->name, (char*)s + q->name);
+
+  if(r)
+    return r;
+  if(p->pkg != q->pkg)
+    return (p->pkg > q->pkg) - (p->pkg < q->pkg);
+  return (p->path > q->path) - (p->path < q->path);
+}
+
+/* add the paths and names of the packages of b to the tables; only those
+ * that were read if copied is 0 */
+static void add_files(struct builder *b, struct index_path *paths, size_t *np,
+                      struct index_name *names, size_t *nn, int copied) {
+  size_t i, j;
+  uint32_t off;
+  char *base;
+
+  for(i = 0; i < b->npkgs; i++) {
+    if(!copied && b->old_pkgs[i] != NO_PKG)
+      continue;
+    for(j = 0; j < b->pkgs[i].nfiles; j++) {
+      off = b->files[b->pkgs[i].first_file + j];
+      paths[*np].path = off;
+      paths[*np].pkg = i;
+      (*np)++;
+      /* like the search of the tarball, only the paths in a directory
+       * have a file name */
+      base = strrchr(b->strings + off, '/');
+      if(base == NULL || *++base == '\0')
+        continue;
+      names[*nn].name = base - b->strings;
+      names[*nn].pkg = i;
+      names[*nn].path = off;
+      (*nn)++;
+    }
+  }
+}
+
+/* merge the sorted arrays x and y of n and m elements of size into out */
+static void merge(const void *x, size_t n, const void *y, size_t m, void *out, size_t size,
+                  int (*cmp)(const void *, const void *, void *), void *arg) {
+  const char *p = x, *q = y;
+  char *o = out;
+
+  while(n > 0 && m > 0) {
+    if(cmp(q, p, arg) < 0) {
+      memcpy(o, q, size);
+      q += size;
+      m--;
+    } else {
+      memcpy(o, p, size);
+      p += size;
+      n--;
+    }
+    o += size;
+  }
+  memcpy(o, p, n * size);
+  memcpy(o + n * size, q, m * size);
+}
+
+/* return the offset in b of the path at offset path of the package opkg of
+ * the previous index, copied to pkg; 0 if it is not one of its files */
+static uint32_t copied_path(struct builder *b, const struct index_map *old,
+                            const struct index_pkg *opkg, const struct index_pkg *pkg, uint32_t path) {
+  size_t lo = 0, hi = opkg->nfiles, mid;
+  uint32_t off;
+
+  /* the paths of a package follow each other in the strings */
+  while(lo < hi) {
+    mid = lo + (hi - lo) / 2;
+    off = old->files[opkg->first_file + mid];
+    if(off == path)
+      return mid < pkg->nfiles ? b->files[pkg->first_file + mid] : 0;
+    if(off < path)
+      lo = mid + 1;
+    else
+      hi = mid;
+  }
+  return 0;
+}
+
+/* The tables of the previous index are sorted already. The entries of the
+ * copied packages keep their order, as the packages do, so they are taken
+ * from there and merged with the sorted entries of the packages that were
+ * read. Return 1 if the previous index does not fit. */
+static int merge_tables(struct builder *b, const struct index_map *old,
+                        struct index_path *paths, size_t *np,
+                        struct index_name *names, size_t *nn) {
+  const struct index_pkg *opkg, *pkg;
+  struct index_path *opaths = NULL;
+  struct index_name *onames = NULL;
+  uint32_t *new_pkgs, path;
+  size_t i, nop = 0, non = 0, rnp = 0, rnn = 0, copied = b->nfiles;
+  int ret = -1;
+
+  new_pkgs = malloc((old->hdr->npkgs + 1) * sizeof(uint32_t));
+  opaths = malloc((b->nfiles + 1) * sizeof(struct index_path));
+  onames = malloc((b->nfiles + 1) * sizeof(struct index_name));
+  if(new_pkgs == NULL || opaths == NULL || onames == NULL)
+    goto cleanup;
+  for(i = 0; i < old->hdr->npkgs; i++)
+    new_pkgs[i] = NO_PKG;
+  for(i = 0; i < b->npkgs; i++) {
+    if(b->old_pkgs[i] != NO_PKG)
+      new_pkgs[b->old_pkgs[i]] = i;
+    else
+      copied -= b->pkgs[i].nfiles;
+  }
+
+  ret = 1;
+  for(i = 0; i < old->hdr->nfiles; i++) {
+    if(old->paths[i].pkg >= old->hdr->npkgs || new_pkgs[old->paths[i].pkg] == NO_PKG)
+      continue;
+    opkg = &old->pkgs[old->paths[i].pkg];
+    pkg = &b->pkgs[new_pkgs[old->paths[i].pkg]];
+    path = copied_path(b, old, opkg, pkg, old->paths[i].path);
+    if(path == 0 || nop >= copied)
+      goto cleanup;
+    opaths[nop].path = path;
+    opaths[nop].pkg = pkg - b->pkgs;
+    nop++;
+  }
+  for(i = 0; i < old->hdr->nnames; i++) {
+    if(old->names[i].pkg >= old->hdr->npkgs || new_pkgs[old->names[i].pkg] == NO_PKG)
+      continue;
+    opkg = &old->pkgs[old->names[i].pkg];
+    pkg = &b->pkgs[new_pkgs[old->names[i].pkg]];
+    path = copied_path(b, old, opkg, pkg, old->names[i].path);
+    if(path == 0 || old->names[i].name < old->names[i].path || non >= copied)
+      goto cleanup;
+    onames[non].name = path + (old->names[i].name - old->names[i].path);
+    onames[non].pkg = pkg - b->pkgs;
+    onames[non].path = path;
+    non++;
+  }
+
+  if(nop != copied)
+    goto cleanup;
+  /* the entries of the packages that were read are sorted after them */
+  add_files(b, paths + nop, &rnp, names + non, &rnn, 0);
+  qsort_r(paths + nop, rnp, sizeof(struct index_path), cmp_path, b->strings);
+  qsort_r(names + non, rnn, sizeof(struct index_name), cmp_name, b->strings);
+  /* the merge fills paths from the start, only reading the sorted entries
+   * after what it wrote, so they are moved to the end first */
+  memmove(paths + b->nfiles - rnp, paths + nop, rnp * sizeof(struct index_path));
+  memmove(names + b->nfiles - rnn, names + non, rnn * sizeof(struct index_name));
+  merge(opaths, nop, paths + b->nfiles - rnp, rnp, paths, sizeof(struct index_path), cmp_path, b->strings);
+  merge(onames, non, names + b->nfiles - rnn, rnn, names, sizeof(struct index_name), cmp_name, b->strings);
+  *np = nop + rnp;
+  *nn = non + rnn;
+  ret = 0;
+
+cleanup:
+  free(new_pkgs);
+  free(opaths);
+  free(onames);
+  return ret;
+}
+
+/* old, if not NULL, is the previous index the packages were copied from */
+static int write_index(struct builder *b, const char *indexfile, const struct stat *st,
+                       const struct index_map *old) {
+  struct index_header hdr;
+  struct index_path *paths;
+  struct index_name *names;
+  size_t np = 0, nn = 0;
+  char *tmp = NULL;
+  FILE *fp;
+  int fd, ret = -1, r = 1;
+
+  paths = malloc((b->nfiles + 1) * sizeof(struct index_path));
+  names = malloc((b->nfiles + 1) * sizeof(struct index_name));
+  if(paths == NULL || names == NULL || sort_pkgs(b) == -1)
+    goto cleanup;
+
+  if(old != NULL) {
+    r = merge_tables(b, old, paths, &np, names, &nn);
+    if(r == -1)
+      goto cleanup;
+  }
+  if(r == 1) {
+    np = nn = 0;
+    add_files(b, paths, &np, names, &nn, 1);
+    qsort_r(paths, np, sizeof(struct index_path), cmp_path, b->strings);
+    qsort_r(names, nn, sizeof(struct index_name), cmp_name, b->strings);
+  }
+
+  memset(&hdr, 0, sizeof(hdr));
+  strncpy(hdr.magic, INDEX_MAGIC, sizeof(hdr.magic));
+  hdr.version = INDEX_VERSION;
+  hdr.npkgs = b->npkgs;
+  hdr.nfiles = b->nfiles;
+  hdr.nnames = nn;
+  hdr.db_mtime = st->st_mtime;
+  hdr.db_size = st->st_size;
+  hdr.pkgs_off = sizeof(hdr);
+  hdr.files_off = hdr.pkgs_off + b->npkgs * sizeof(struct index_pkg);
+  hdr.paths_off = hdr.files_off + b->nfiles * sizeof(uint32_t);
+  hdr.names_off = hdr.paths_off + np * sizeof(struct index_path);
+  hdr.strings_off = hdr.names_off + nn * sizeof(struct index_name);
+  hdr.strings_len = b->slen;
+
+  /* write to a temporary file first so that readers never see a partial index */
+  fd = create_temp(indexfile, &tmp);
+  if(fd == -1)
+    goto cleanup;
+  fp = fdopen(fd, "wb");
+  if(fp == NULL) {
+    close(fd);
+    unlink(tmp);
+    goto cleanup;
+  }
+  if(fwrite(&hdr, sizeof(hdr), 1, fp) != 1 ||
+      fwrite(b->pkgs, sizeof(struct index_pkg), b->npkgs, fp) != b->npkgs ||
+      fwrite(b->files, sizeof(uint32_t), b->nfiles, fp) != b->nfiles ||
+      fwrite(paths, sizeof(struct index_path), np, fp) != np ||
+      fwrite(names, sizeof(struct index_name), nn, fp) != nn ||
+      fwrite(b->strings, 1, b->slen, fp) != b->slen ||
+      fflush(fp) != 0 || fsync(fileno(fp)) == -1) {
+    fclose(fp);
+    unlink(tmp);
+    goto cleanup;
+  }
+  if(fclose(fp) != 0 || rename(tmp, indexfile) == -1) {
+    unlink(tmp);
+    goto cleanup;
+  }
+  ret = 0;
+
+cleanup:
+  free(paths);
+  free(names);
+  free(tmp);
+  return ret;
+}
+
+PyObject *build_index(PyObject *self, PyObject *args, PyObject *kw) {
+  const char *filename, *indexfile;
+  static char *kwlist[] = {"filename", "indexfile", "update", NULL};
+  struct builder b;
+  struct index_map old;
+  struct stat st;
+  int ret, have_old = 0, update = 0;
+
+  if(!PyArg_ParseTupleAndKeywords(args, kw, "ss|i", kwlist, &filename, &indexfile, &update))
+    return NULL;
+  if(strlen(filename)<=0 || strlen(indexfile)<=0) {
+    PyErr_SetString(PyExc_ValueError, "Empty files tarball or index name given.");
+    return NULL;
+  }
+  if(stat(filename, &st)==-1 || !(S_ISREG(st.st_mode) || S_ISDIR(st.st_mode))) {
+    PyErr_Format(PyExc_IOError, "File does not exist: %s\n", filename);
+    return NULL;
+  }
+
+  memset(&b, 0, sizeof(b));
+  Py_BEGIN_ALLOW_THREADS
+  /* a database directory is updated package by package, a tarball only
+   * when asked to */
+  if(S_ISDIR(st.st_mode) || update)
+    have_old = map_index(&old, indexfile) == 0;
+  ret = read_db(&b, filename, have_old ? &old : NULL);
+  if(ret == 0)
+    ret = write_index(&b, indexfile, &st, have_old ? &old : NULL) == -1 ? -2 : 0;
+  if(have_old)
+    unmap_index(&old);
+  Py_END_ALLOW_THREADS
+  if(ret == -1) {
+    builder_free(&b);
+    PyErr_Format(PyExc_IOError, "Unable to read files tarball: %s", filename);
+    return NULL;
+  }
+  if(ret == -2) {
+    builder_free(&b);
+    PyErr_SetFromErrnoWithFilename(PyExc_IOError, (char*)indexfile);
+    return NULL;
+  }
+  builder_free(&b);
+  Py_RETURN_NONE;
+}
+
+typedef struct {
+  PyObject_HEAD
+  struct index_map m;
+  PY_LONG_LONG db_mtime;
+  PY_LONG_LONG db_size;
+} Index;
+
+static PyObject *Index_new(PyTypeObject *type, PyObject *args, PyObject *kwds) {
+  Index *self;
+
+  self = (Index*)type->tp_alloc(type, 0);
+  if (self != NULL)
+    memset(&self->m, 0, sizeof(self->m));
+  return (PyObject *)self;
+}
+
+static void Index_dealloc(Index* self) {
+  unmap_index(&self->m);
+  self->ob_type->tp_free((PyObject*)self);
+}
+
+static int Index_init(Index *self, PyObject *args, PyObject *kw) {
+  const char *indexfile;
+  static char *kwlist[] = {"indexfile", NULL};
+  int ret;
+
+  if(!PyArg_ParseTupleAndKeywords(args, kw, "s", kwlist, &indexfile))
+    return -1;
+  unmap_index(&self->m);
+
+  ret = map_index(&self->m, indexfile);
+  if(ret == -1) {
+    PyErr_SetFromErrnoWithFilename(PyExc_IOError, (char*)indexfile);
+    return -1;
+  }
+  if(ret == -2) {
+    PyErr_Format(PyExc_IOError, "Invalid index file: %s", indexfile);
+    return -1;
+  }
+  self->db_mtime = self->m.hdr->db_mtime;
+  self->db_size = self->m.hdr->db_size;
+  return 0;
+}
+
+static PyObject *make_match(Index *self, uint32_t pkg, PyObject *files) {
+  Py_INCREF(files);
+  return result_new_match(PyString_InternFromString(index_string(&self->m, self->m.pkgs[pkg].name)),
+                          PyString_FromString(index_string(&self->m, self->m.pkgs[pkg].version)), files);
+}
+
+/* append a match for pkg holding files to ret, stealing the files reference */
+static int append_match(Index *self, PyObject *ret, uint32_t pkg, PyObject *files) {
+  PyObject *match;
+
+  if(pkg >= self->m.hdr->npkgs) {
+    Py_DECREF(files);
+    PyErr_SetString(PyExc_IOError, "Corrupted index file.");
+    return -1;
+  }
+  match = make_match(self, pkg, files);
+  Py_DECREF(files);
+  if(match == NULL)
+    return -1;
+  PyList_Append(ret, match);
+  Py_DECREF(match);
+  return 0;
+}
+
+static int append_file(Index *self, PyObject *files, uint32_t path) {
+  PyObject *pystr;
+
+  pystr = result_path(index_string(&self->m, path));
+  if(pystr == NULL)
+    return -1;
+  PyList_Append(files, pystr);
+  Py_DECREF(pystr);
+  return 0;
+}
+
+static int append_package(Index *self, PyObject *ret, const struct index_pkg *pkg) {
+  PyObject *files;
+  uint32_t i;
+
+  if((uint64_t)pkg->first_file + pkg->nfiles > self->m.hdr->nfiles) {
+    PyErr_SetString(PyExc_IOError, "Corrupted index file.");
+    return -1;
+  }
+  files = PyList_New(0);
+  if(files == NULL)
+    return -1;
+  for(i = 0; i < pkg->nfiles; i++) {
+    if(append_file(self, files, self->m.files[pkg->first_file + i]) == -1) {
+      Py_DECREF(files);
+      return -1;
+    }
+  }
+  return append_match(self, ret, pkg - self->m.pkgs, files);
+}
+
+static PyObject *lookup_package(Index *self, const char *name, int flags) {
+  const struct index_pkg *pkg;
+  PyObject *ret;
+  size_t lo = 0, hi = self->m.hdr->npkgs, mid;
+
+  ret = PyList_New(0);
+  if(ret == NULL)
+    return NULL;
+  if(!(flags & MATCH_ICASE)) {
+    pkg = find_pkg(&self->m, name);
+    if(pkg != NULL && append_package(self, ret, pkg) == -1)
+      goto cleanup;
+    return ret;
+  }
+
+  while(lo < hi) {
+    mid = lo + (hi - lo) / 2;
+    if(fold_cmp(index_string(&self->m, self->m.pkgs[mid].name), name) < 0)
+      lo = mid + 1;
+    else
+      hi = mid;
+  }
+  for(; lo < self->m.hdr->npkgs && fold_cmp(index_string(&self->m, self->m.pkgs[lo].name), name) == 0; lo++) {
+    if(append_package(self, ret, &self->m.pkgs[lo]) == -1)
+      goto cleanup;
+  }
+  return ret;
+
+cleanup:
+  Py_DECREF(ret);
+  return NULL;
+}
+
+/* Collects the files found by lookup_path and lookup_filename into one match
+ * per package, the files of a package being next to each other in the
+ * tables */
+struct file_matches {
+  PyObject *ret;
+  PyObject *files;
+  uint32_t pkg;
+};
+
+static int add_file_match(Index *self, struct file_matches *fm, uint32_t pkg, uint32_t path) {
+  if(fm->files != NULL && pkg != fm->pkg) {
+    if(append_match(self, fm->ret, fm->pkg, fm->files) == -1) {
+      fm->files = NULL;
+      return -1;
+    }
+    fm->files = NULL;
+  }
+  if(fm->files == NULL) {
+    fm->pkg = pkg;
+    fm->files = PyList_New(0);
+    if(fm->files == NULL)
+      return -1;
+  }
+  return append_file(self, fm->files, path);
+}
+
+static PyObject *end_file_matches(Index *self, struct file_matches *fm, int error) {
+  if(!error && fm->files != NULL) {
+    error = append_match(self, fm->ret, fm->pkg, fm->files) == -1;
+    fm->files = NULL;
+  }
+  Py_XDECREF(fm->files);
+  if(error) {
+    Py_DECREF(fm->ret);
+    return NULL;
+  }
+  return fm->ret;
+}
+
+/* entries equal to the key but for their case are next to each other, so
+ * a lookup is a binary search whether the case is ignored or not; the
+ * entries that differ by their case are then skipped in the latter case */
+static PyObject *lookup_path(Index *self, const char *path, int flags) {
+  struct file_matches fm = {NULL, NULL, 0};
+  const char *s;
+  size_t lo = 0, hi = self->m.hdr->nfiles, mid;
+  int error = 0;
+
+  fm.ret = PyList_New(0);
+  if(fm.ret == NULL)
+    return NULL;
+  while(lo < hi) {
+    mid = lo + (hi - lo) / 2;
+    if(fold_cmp(index_string(&self->m, self->m.paths[mid].path), path) < 0)
+      lo = mid + 1;
+    else
+      hi = mid;
+  }
+  for(; lo < self->m.hdr->nfiles && fold_cmp(s = index_string(&self->m, self->m.paths[lo].path), path) == 0; lo++) {
+    if(!(flags & MATCH_ICASE) && strcmp(s, path) != 0)
+      continue;
+    if(add_file_match(self, &fm, self->m.paths[lo].pkg, self->m.paths[lo].path) == -1) {
+      error = 1;
+      break;
+    }
+  }
+  return end_file_matches(self, &fm, error);
+}
+
+static PyObject *lookup_filename(Index *self, const char *name, int flags) {
+  struct file_matches fm = {NULL, NULL, 0};
+  const char *s;
+  size_t lo = 0, hi = self->m.hdr->nnames, mid;
+  int error = 0;
+
+  fm.ret = PyList_New(0);
+  if(fm.ret == NULL)
+    return NULL;
+  while(lo < hi) {
+    mid = lo + (hi - lo) / 2;
+    if(fold_cmp(index_string(&self->m, self->m.names[mid].name), name) < 0)
+      lo = mid + 1;
+    else
+      hi = mid;
+  }
+  for(; lo < self->m.hdr->nnames && fold_cmp(s = index_string(&self->m, self->m.names[lo].name), name) == 0; lo++) {
+    if(!(flags & MATCH_ICASE) && strcmp(s, name) != 0)
+      continue;
+    if(add_file_match(self, &fm, self->m.names[lo].pkg, self->m.names[lo].path) == -1) {
+      error = 1;
+      break;
+    }
+  }
+  return end_file_matches(self, &fm, error);
+}
+
+static PyObject *Index_lookup(Index *self, PyObject *args, PyObject *kw) {
+  long st;
+  int flags = 0;
+  const char *name;
+  static char *kwlist[] = {"searchtype", "name", "flags", NULL};
+
+  if(!PyArg_ParseTupleAndKeywords(args, kw, "ls|i", kwlist, &st, &name, &flags))
+    return NULL;
+  if(self->m.map == NULL) {
+    PyErr_SetString(PyExc_RuntimeError, "Index is not opened.");
+    return NULL;
+  }
+  switch(st) {
+    case SEARCH_PACKAGE:
+      return lookup_package(self, name, flags);
+    case SEARCH_PATH:
+      return lookup_path(self, name, flags);
+    case SEARCH_FILENAME:
+      return lookup_filename(self, name, flags);
+    default:
+      PyErr_SetString(PyExc_ValueError, "Invalid search type given.");
+      return NULL;
+  }
+}
+
+static PyObject *Index_packages(Index *self) {
+  PyObject *ret, *match;
+  const struct index_pkg *pkg;
+  uint32_t i;
+
+  if(self->m.map == NULL) {
+    PyErr_SetString(PyExc_RuntimeError, "Index is not opened.");
+    return NULL;
+  }
+  ret = PyList_New(self->m.hdr->npkgs);
+  if(ret == NULL)
+    return NULL;
+  for(i = 0; i < self->m.hdr->npkgs; i++) {
+    pkg = &self->m.pkgs[i];
+    match = result_new_match(PyString_InternFromString(index_string(&self->m, pkg->name)),
+                             PyString_FromString(index_string(&self->m, pkg->version)), NULL);
+    if(match == NULL) {
+      Py_DECREF(ret);
+      return NULL;
+    }
+    PyList_SET_ITEM(ret, i, match);
+  }
+  return ret;
+}
+
+static PyMethodDef Index_methods[] = {
+  {"lookup", (PyCFunction)Index_lookup, METH_VARARGS | METH_KEYWORDS, "Return the matches of an exact name, like Search would do with MATCH_SIMPLE and the same flags."},
+  {"packages", (PyCFunction)Index_packages, METH_NOARGS, "Return the name and version of the packages of the index, like list_packages, sorted by name."},
+  {NULL, NULL, 0, NULL}
+};
+
+static PyMemberDef Index_members[] = {
+  {"db_mtime", T_LONGLONG, offsetof(Index, db_mtime), READONLY, "mtime of the files tarball the index was built from"},
+  {"db_size", T_LONGLONG, offsetof(Index, db_size), READONLY, "size of the files tarball the index was built from"},
+  {NULL, 0, 0, 0, NULL}
+};
+
+static PyTypeObject IndexPyType = {
+  PyObject_HEAD_INIT(NULL)
+  0,                          /*ob_size*/
+  "pkgfile.Index",            /*tp_name*/
+  sizeof(Index),              /*tp_basicsize*/
+  0,                          /*tp_itemsize*/
+  (destructor)Index_dealloc,  /*tp_dealloc*/
+  0,                          /*tp_print*/
+  0,                          /*tp_getattr*/
+  0,                          /*tp_setattr*/
+  0,                          /*tp_compare*/
+  0,                          /*tp_repr*/
+  0,                          /*tp_as_number*/
+  0,                          /*tp_as_sequence*/
+  0,                          /*tp_as_mapping*/
+  0,                          /*tp_hash */
+  0,                          /*tp_call*/
+  0,                          /*tp_str*/
+  0,                          /*tp_getattro*/
+  0,                          /*tp_setattro*/
+  0,                          /*tp_as_buffer*/
+  Py_TPFLAGS_DEFAULT,         /*tp_flags*/
+  "Index object",             /* tp_doc */
+  0,                          /* tp_traverse */
+  0,                          /* tp_clear */
+  0,                          /* tp_richcompare */
+  0,                          /* tp_weaklistoffset */
+  0,                          /* tp_iter */
+  0,                          /* tp_iternext */
+  Index_methods,              /* tp_methods */
+  Index_members,              /* tp_members */
+  0,                          /* tp_getset */
+  0,                          /* tp_base */
+  0,                          /* tp_dict */
+  0,                          /* tp_descr_get */
+  0,                          /* tp_descr_set */
+  0,                          /* tp_dictoffset */
+  (initproc)Index_init,       /* tp_init */
+  0,                          /* tp_alloc */
+  Index_new,                  /* tp_new */
+};
+
+void index_pyinit(PyObject *m) {
+  PyObject *to;
+
+  if (PyType_Ready(&IndexPyType) < 0)
+    return;
+  to = (PyObject*)&IndexPyType;
+  Py_INCREF(to);
+  PyModule_AddObject(m, "Index", (PyObject*)&IndexPyType);
+}
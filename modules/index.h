@@ -0,0 +1,59 @@
+#ifndef INDEX_H
+#define INDEX_H
+
+#include <stdint.h>
+#include <Python.h>
+
+#define INDEX_MAGIC "PKGFIDX"
+#define INDEX_VERSION 3
+
+/* On-disk layout of a *.files.idx file:
+ *   header
+ *   pkgs[npkgs]     sorted by package name
+ *   files[nfiles]   offsets of the paths of each package, in package order
+ *   paths[nfiles]   (path, pkg) sorted by path
+ *   names[nnames]   (basename, pkg, path) sorted by basename, for the paths
+ *                   with a / not at their end
+ *   strings         NUL terminated strings referenced by the tables above
+ * The names are sorted by their ASCII lowercase form first, so that the
+ * names differing only by their case are next to each other. All integers are stored in host byte order, offsets are relative to the
+ * start of the file except string offsets that are relative to strings_off.
+ */
+struct index_header {
+  char magic[8];
+  uint32_t version;
+  uint32_t npkgs;
+  uint32_t nfiles;
+  uint32_t nnames;
+  int64_t db_mtime;
+  int64_t db_size;
+  uint32_t pkgs_off;
+  uint32_t files_off;
+  uint32_t paths_off;
+  uint32_t names_off;
+  uint32_t strings_off;
+  uint32_t strings_len;
+};
+
+struct index_pkg {
+  uint32_t name;
+  uint32_t version;
+  uint32_t first_file;
+  uint32_t nfiles;
+};
+
+struct index_path {
+  uint32_t path;
+  uint32_t pkg;
+};
+
+struct index_name {
+  uint32_t name;
+  uint32_t pkg;
+  uint32_t path;
+};
+
+PyObject *build_index(PyObject *self, PyObject *args, PyObject *kw);
+void index_pyinit(PyObject *m);
+
+#endif /* INDEX_H */
@@ -1,19 +1,19 @@
 #include <Python.h>
 #include <archive.h>
 #include <archive_entry.h>
-#include <libgen.h>
+#include <sys/stat.h>
 #include "listpkg.h"
 #include "util.h"
-#define ABUFLEN 1024
+#include "db.h"
+#include "result.h"
 
 PyObject *list_packages(PyObject *self, PyObject *args, PyObject *kw) {
   const char *filename;
   static char *kwlist[] = {"filename", NULL};
-  struct archive *a;
-  struct archive_entry *entry;
-  struct stat st;
-  char pname[ABUFLEN], *fname, *dname, *pkgname, *pkgver;
-  PyObject *ret, *dict, *pystr;
+  struct db_reader *r;
+  const char *fname, *dname;
+  char *pkgname, *pkgver;
+  PyObject *ret, *match;
 
   if(!PyArg_ParseTupleAndKeywords(args, kw, "s", kwlist, &filename))
     return NULL;
@@ -22,8 +22,7 @@ PyObject *list_packages(PyObject *self, PyObject *args, PyObject *kw) {
     return NULL;
   }
 
-  pname[ABUFLEN-1]='\0';
-  if(stat(filename, &st)==-1 || !S_ISREG(st.st_mode)) {
+  if(!db_exists(filename)) {
     PyErr_Format(PyExc_IOError, "File does not exist: %s\n", filename);
     return NULL;
   }
@@ -31,53 +30,104 @@ PyObject *list_packages(PyObject *self, PyObject *args, PyObject *kw) {
   if(ret == NULL) {
     return NULL;
   }
-  a = archive_read_new();
-  archive_read_support_compression_all(a);
-  archive_read_support_format_all(a);
-  archive_read_open_filename(a, filename, 10240);
-  while (archive_read_next_header(a, &entry) == ARCHIVE_OK) {
-    if(!S_ISREG(archive_entry_filetype(entry))) {
-      archive_read_data_skip(a);
-      continue;
-    }
-    strncpy(pname, archive_entry_pathname(entry), ABUFLEN-1);
-    fname = basename(pname);
-    dname = dirname(pname);
+  r = db_open(filename);
+  if(r == NULL) {
+    Py_DECREF(ret);
+    PyErr_Format(PyExc_IOError, "Unable to open files database: %s", filename);
+    return NULL;
+  }
+  while (db_next(r, &dname, &fname)) {
     if(strcmp(fname, "files") == 0) {
       if (splitname(dname, &pkgname, &pkgver) == -1) {
-        archive_read_data_skip(a);
+        db_skip(r);
         continue;
       }
-      dict = PyDict_New();
-      if(dict == NULL) {
-        goto cleanup_nodict;
-      }
-      pystr = PyString_FromString(pkgname);
+      match = result_new_match(PyString_InternFromString(pkgname),
+                               PyString_FromString(pkgver), NULL);
       free(pkgname);
-      if(pystr == NULL) {
-        free(pkgver);
-        goto cleanup;
-      }
-      PyDict_SetItemString(dict, "name", pystr);
-      Py_DECREF(pystr);
-      pystr = PyString_FromString(pkgver);
       free(pkgver);
-      if(pystr == NULL)
+      if(match == NULL)
         goto cleanup;
-      PyDict_SetItemString(dict, "version", pystr);
-      Py_DECREF(pystr);
+      PyList_Append(ret, match);
+      Py_DECREF(match);
+    }
+    db_skip(r);
+  }
+  db_close(r);
+  return ret;
+
+cleanup:
+  db_close(r);
+  Py_DECREF(ret);
+  return NULL;
+}
+
+PyObject *archive_contents(PyObject *self, PyObject *args, PyObject *kw) {
+  const char *filename;
+  static char *kwlist[] = {"filename", NULL};
+  struct archive *a;
+  struct archive_entry *entry;
+  const char *path;
+  PyObject *ret, *pystr;
+  int r;
 
-      PyList_Append(ret, dict);
-      Py_DECREF(dict);
+  if(!PyArg_ParseTupleAndKeywords(args, kw, "s", kwlist, &filename))
+    return NULL;
+  if(!db_exists(filename)) {
+    PyErr_Format(PyExc_IOError, "File does not exist: %s\n", filename);
+    return NULL;
+  }
+  ret = PyList_New(0);
+  if(ret == NULL)
+    return NULL;
+
+  Py_BEGIN_ALLOW_THREADS
+  a = archive_read_new();
+  if(a != NULL) {
+    archive_read_support_compression_all(a);
+    archive_read_support_format_all(a);
+    if(archive_read_open_filename(a, filename, 10240) != ARCHIVE_OK) {
+      archive_read_finish(a);
+      a = NULL;
     }
-    archive_read_data_skip(a);
+  }
+  Py_END_ALLOW_THREADS
+  if(a == NULL) {
+    Py_DECREF(ret);
+    PyErr_Format(PyExc_IOError, "Unable to open archive: %s", filename);
+    return NULL;
+  }
+
+  /* only the headers are read, the data of the entries is skipped */
+  while(1) {
+    Py_BEGIN_ALLOW_THREADS
+    r = archive_read_next_header(a, &entry);
+    Py_END_ALLOW_THREADS
+    if(r != ARCHIVE_OK)
+      break;
+    path = archive_entry_pathname(entry);
+    if(path[0] == '.' && path[1] == '/')
+      path += 2;
+    if(path[0] == '\0')
+      continue;
+    /* directories end with a / like in the files databases */
+    if(S_ISDIR(archive_entry_filetype(entry)) && path[strlen(path) - 1] != '/')
+      pystr = PyString_FromFormat("%s/", path);
+    else
+      pystr = PyString_FromString(path);
+    if(pystr == NULL)
+      goto cleanup;
+    PyList_Append(ret, pystr);
+    Py_DECREF(pystr);
+  }
+  if(r != ARCHIVE_EOF) {
+    PyErr_Format(PyExc_IOError, "Unable to read archive %s: %s", filename, archive_error_string(a));
+    goto cleanup;
   }
   archive_read_finish(a);
   return ret;
 
 cleanup:
-  Py_DECREF(dict);
-cleanup_nodict:
   archive_read_finish(a);
   Py_DECREF(ret);
   return NULL;
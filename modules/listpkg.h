@@ -2,5 +2,6 @@
 #define LISTPKG_H
 
 PyObject *list_packages(PyObject *self, PyObject *args, PyObject *kw);
+PyObject *archive_contents(PyObject *self, PyObject *args, PyObject *kw);
 
 #endif /* LISTPKG_H */
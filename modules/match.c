@@ -3,58 +3,463 @@
 #include <regex.h>
 #include <pcre.h>
 #include <string.h>
+#include <ctype.h>
 #include "match.h"
 
 extern PyObject *RegexError;
 
-static int string_match(const char *f, void *d) {
-  if(f==NULL || strlen(f)<=0)
+/* A literal that any matching string contains, extracted from a pattern so
+ * that most strings can be rejected with memmem before the pattern is run */
+struct literal {
+  char *s;
+  size_t len;
+  int icase;
+};
+
+static int literal_init(struct literal *lit, const char *s, size_t len, int flags) {
+  lit->len = len;
+  lit->icase = flags & MATCH_ICASE;
+  lit->s = NULL;
+  if(len == 0)
     return 0;
-  return !strcmp(f, d);
+  lit->s = strndup(s, len);
+  return lit->s == NULL ? -1 : 0;
+}
+
+static int literal_found(const struct literal *lit, const char *f, size_t len) {
+  if(lit->len == 0)
+    return 1;
+  /* f is NUL terminated */
+  if(lit->icase)
+    return strcasestr(f, lit->s) != NULL;
+  return memmem(f, len, lit->s, lit->len) != NULL;
+}
+
+/* return the length of the bracket expression starting at p, 0 if it is
+ * not terminated */
+static size_t bracket_len(const char *p) {
+  char close[3] = {0, ']', '\0'};
+  const char *end;
+  size_t i = 1;
+
+  if(p[i] == '!' || p[i] == '^')
+    i++;
+  if(p[i] == ']')
+    i++;
+  for(; p[i] != '\0' && p[i] != ']'; i++) {
+    /* [:class:], [.coll.] and [=equiv=] may contain a ] */
+    if(p[i] == '[' && (p[i + 1] == ':' || p[i + 1] == '.' || p[i + 1] == '=')) {
+      close[0] = p[i + 1];
+      end = strstr(p + i + 2, close);
+      if(end == NULL)
+        return 0;
+      i = end + 1 - p;
+    }
+  }
+  return p[i] == ']' ? i + 1 : 0;
 }
 
-static int shell_match(const char *f, void *d) {
-  if(f==NULL || strlen(f)<=0)
+/* longest run of literal characters of a shell pattern */
+static void glob_literal(const char *p, const char **start, size_t *len) {
+  const char *run = p;
+  size_t n;
+
+  *start = p;
+  *len = 0;
+  while(1) {
+    if(*p == '\0' || strchr("*?[\\", *p) != NULL) {
+      if((size_t)(p - run) > *len) {
+        *start = run;
+        *len = p - run;
+      }
+      if(*p == '\0')
+        return;
+      if(*p == '[' && (n = bracket_len(p)) > 0)
+        p += n;
+      else if(*p == '\\' && p[1] != '\0')
+        p += 2;
+      else
+        p++;
+      run = p;
+      continue;
+    }
+    p++;
+  }
+}
+
+/* longest run of literal characters of an extended regex that a match must
+ * contain; none if the regex has alternatives or groups. An escaped
+ * punctuation character only ends a run: the other escapes of pcre, like
+ * \x2e, \0163, \pL, \cX or \Q...\E, are longer than two characters, so
+ * the runs after them are not looked at */
+static void regex_literal(const char *p, const char **start, size_t *len) {
+  const char *run = p, *end;
+  size_t n;
+
+  *start = p;
+  *len = 0;
+  if(strpbrk(p, "|()") != NULL)
+    return;
+  while(1) {
+    end = p;
+    /* a quantified character may be absent */
+    if(*p == '*' || *p == '?' || *p == '{' || *p == '+') {
+      if(p > run)
+        end = p - 1;
+    }
+    if(*p == '\0' || strchr(".[]{}*+?^$\\", *p) != NULL) {
+      if((size_t)(end - run) > *len) {
+        *start = run;
+        *len = end - run;
+      }
+      if(*p == '\0')
+        return;
+      if(*p == '[' && (n = bracket_len(p)) > 0) {
+        p += n;
+      } else if(*p == '{') {
+        end = strchr(p, '}');
+        p = end ? end + 1 : p + 1;
+      } else if(*p == '\\' && ispunct((unsigned char)p[1])) {
+        p += 2;
+      } else if(*p == '\\') {
+        return;
+      } else {
+        p++;
+      }
+      run = p;
+      continue;
+    }
+    p++;
+  }
+}
+
+struct simple_data {
+  char *pattern;
+  size_t len;
+};
+
+static int string_match(const char *f, size_t len, void *d) {
+  struct simple_data *sd = d;
+
+  return len == sd->len && memcmp(f, sd->pattern, len) == 0;
+}
+
+static int string_casematch(const char *f, size_t len, void *d) {
+  struct simple_data *sd = d;
+
+  return len == sd->len && strcasecmp(f, sd->pattern) == 0;
+}
+
+struct shell_data {
+  char *pattern;
+  int fnm_flags;
+  struct literal literal;
+};
+
+static int shell_match(const char *f, size_t len, void *d) {
+  struct shell_data *sd = d;
+
+  if(len == 0 || !literal_found(&sd->literal, f, len))
     return 0;
-  return !fnmatch(d, f, 0);
+  return !fnmatch(sd->pattern, f, sd->fnm_flags);
 }
 
-static int regex_match(const char *f, void *d) {
-  if(f==NULL || strlen(f)<=0)
+struct regex_data {
+  regex_t re;
+  struct literal literal;
+};
+
+static int regex_match(const char *f, size_t len, void *d) {
+  struct regex_data *rd = d;
+
+  if(len == 0 || !literal_found(&rd->literal, f, len))
     return 0;
-  return !regexec((regex_t*)d, f, (size_t)0, NULL, 0);
+  return !regexec(&rd->re, f, (size_t)0, NULL, 0);
 }
 
 struct my_pcredata {
   pcre *re;
   pcre_extra *re_extra;
+  struct literal literal;
+};
+
+static int pcre_match(const char *f, size_t len, void *d) {
+  struct my_pcredata *pd = d;
+
+  if(len == 0 || !literal_found(&pd->literal, f, len))
+    return 0;
+  return pcre_exec(pd->re, pd->re_extra, f, len, 0, 0, NULL, 0) >= 0;
+}
+
+/* Open addressing hash set of strings, used for MATCH_SET */
+struct string_set {
+  size_t mask;
+  char **slots;
+  int icase;
+};
+
+static size_t hash_string(const char *s, int icase) {
+  /* FNV-1a */
+  size_t h = 2166136261u;
+
+  for(; *s; s++) {
+    h ^= icase ? (unsigned char)tolower((unsigned char)*s) : (unsigned char)*s;
+    h *= 16777619u;
+  }
+  return h;
+}
+
+static int set_strcmp(const struct string_set *set, const char *s1, const char *s2) {
+  return set->icase ? strcasecmp(s1, s2) : strcmp(s1, s2);
+}
+
+static int set_contains(struct string_set *set, const char *f) {
+  size_t i;
+
+  for(i = hash_string(f, set->icase) & set->mask; set->slots[i] != NULL; i = (i + 1) & set->mask) {
+    if(set_strcmp(set, set->slots[i], f) == 0)
+      return 1;
+  }
+  return 0;
+}
+
+static void set_free(struct string_set *set) {
+  size_t i;
+
+  if(set == NULL)
+    return;
+  for(i = 0; i <= set->mask; i++)
+    free(set->slots[i]);
+  free(set->slots);
+  free(set);
+}
+
+static struct string_set *set_new(size_t n, int flags) {
+  struct string_set *set;
+  size_t size = 16;
+
+  while(size < 2 * n)
+    size *= 2;
+  set = malloc(sizeof(struct string_set));
+  if(set == NULL)
+    return NULL;
+  set->mask = size - 1;
+  set->icase = flags & MATCH_ICASE;
+  set->slots = calloc(size, sizeof(char*));
+  if(set->slots == NULL) {
+    free(set);
+    return NULL;
+  }
+  return set;
+}
+
+static int set_add(struct string_set *set, const char *s) {
+  size_t i;
+
+  for(i = hash_string(s, set->icase) & set->mask; set->slots[i] != NULL; i = (i + 1) & set->mask) {
+    if(set_strcmp(set, set->slots[i], s) == 0)
+      return 0;
+  }
+  set->slots[i] = strdup(s);
+  return set->slots[i] == NULL ? -1 : 0;
+}
+
+static int set_match(const char *f, size_t len, void *d) {
+  if(len == 0)
+    return 0;
+  return set_contains((struct string_set*)d, f);
+}
+
+/* MATCH_MULTI_SHELL: the globs are stored in a trie of their literal prefix,
+ * so that a line is only tested against the globs whose prefix it starts
+ * with. Those must then end with the literal suffix of the glob before
+ * fnmatch is called. Patterns without any wildcard go in a hash set. When
+ * the case is ignored, the trie is built from the lowercase prefixes. */
+struct glob {
+  char *pattern;
+  const char *suffix;
+  size_t suffix_len;
+  struct glob *next;
+};
+
+struct trie_node {
+  unsigned char c;
+  struct trie_node *child;
+  struct trie_node *sibling;
+  struct glob *globs;
+};
+
+struct multi_shell {
+  struct string_set *exact;
+  struct trie_node root;
+  struct glob *globs;
+  size_t nglobs;
+  int fnm_flags;
 };
 
-static int pcre_match(const char *f, void *d) {
-  if(f==NULL || strlen(f)<=0)
+#define GLOB_SPECIAL "*?[]\\"
+
+static void trie_free(struct trie_node *node) {
+  struct trie_node *child, *next;
+
+  for(child = node->child; child != NULL; child = next) {
+    next = child->sibling;
+    trie_free(child);
+    free(child);
+  }
+}
+
+static void multi_shell_free(struct multi_shell *ms) {
+  size_t i;
+
+  if(ms == NULL)
+    return;
+  set_free(ms->exact);
+  trie_free(&ms->root);
+  for(i = 0; i < ms->nglobs; i++)
+    free(ms->globs[i].pattern);
+  free(ms->globs);
+  free(ms);
+}
+
+static unsigned char trie_char(const struct multi_shell *ms, char c) {
+  if(ms->fnm_flags & FNM_CASEFOLD)
+    return tolower((unsigned char)c);
+  return c;
+}
+
+static int multi_shell_add(struct multi_shell *ms, const char *pattern) {
+  struct trie_node *node = &ms->root, *child;
+  struct glob *g;
+  size_t len = strlen(pattern), prefix_len, i;
+  unsigned char c;
+
+  prefix_len = strcspn(pattern, GLOB_SPECIAL);
+  if(prefix_len == len)
+    return set_add(ms->exact, pattern);
+
+  g = &ms->globs[ms->nglobs];
+  g->pattern = strdup(pattern);
+  if(g->pattern == NULL)
+    return -1;
+  for(g->suffix_len = 0; g->suffix_len < len && strchr(GLOB_SPECIAL, pattern[len - g->suffix_len - 1]) == NULL; g->suffix_len++);
+  g->suffix = g->pattern + len - g->suffix_len;
+  ms->nglobs++;
+
+  for(i = 0; i < prefix_len; i++) {
+    c = trie_char(ms, pattern[i]);
+    for(child = node->child; child != NULL && child->c != c; child = child->sibling);
+    if(child == NULL) {
+      child = calloc(1, sizeof(struct trie_node));
+      if(child == NULL)
+        return -1;
+      child->c = c;
+      child->sibling = node->child;
+      node->child = child;
+    }
+    node = child;
+  }
+  g->next = node->globs;
+  node->globs = g;
+  return 0;
+}
+
+static int multi_shell_match(const char *f, size_t len, void *d) {
+  struct multi_shell *ms = d;
+  struct trie_node *node = &ms->root;
+  struct glob *g;
+  const char *p;
+  unsigned char c;
+
+  if(len == 0)
     return 0;
-  return pcre_exec(((struct my_pcredata*)d)->re, ((struct my_pcredata*)d)->re_extra, f, strlen(f), 0, 0, NULL, 0) >= 0;
+  if(set_contains(ms->exact, f))
+    return 1;
+  for(p = f; node != NULL; p++) {
+    for(g = node->globs; g != NULL; g = g->next) {
+      if(g->suffix_len > len)
+        continue;
+      if(ms->fnm_flags & FNM_CASEFOLD) {
+        if(strncasecmp(f + len - g->suffix_len, g->suffix, g->suffix_len) != 0)
+          continue;
+      } else if(memcmp(f + len - g->suffix_len, g->suffix, g->suffix_len) != 0) {
+        continue;
+      }
+      if(!fnmatch(g->pattern, f, ms->fnm_flags))
+        return 1;
+    }
+    if(*p == '\0')
+      break;
+    c = trie_char(ms, *p);
+    for(node = node->child; node != NULL && node->c != c; node = node->sibling);
+  }
+  return 0;
+}
+
+/* return a new reference to a fast sequence of the strings of pattern */
+static PyObject *pattern_list(PyObject *pattern) {
+  PyObject *seq;
+  Py_ssize_t i;
+
+  if(PyString_Check(pattern)) {
+    PyErr_SetString(PyExc_TypeError, "A list of patterns is expected.");
+    return NULL;
+  }
+  seq = PySequence_Fast(pattern, "A list of patterns is expected.");
+  if(seq == NULL)
+    return NULL;
+  for(i = 0; i < PySequence_Fast_GET_SIZE(seq); i++) {
+    if(!PyString_Check(PySequence_Fast_GET_ITEM(seq, i)) || PyString_GET_SIZE(PySequence_Fast_GET_ITEM(seq, i)) <= 0) {
+      PyErr_SetString(PyExc_ValueError, "Patterns must be non empty strings.");
+      Py_DECREF(seq);
+      return NULL;
+    }
+  }
+  return seq;
 }
 
 void match_reset(MatchType* match_type, MatchFunc* match_func, void **data) {
+  struct simple_data *simple;
+  struct shell_data *shell;
+  struct regex_data *rd;
   /* For PCRE only */
   struct my_pcredata *pd;
 
   switch(*match_type) {
     case MATCH_SIMPLE:
+      simple = *data;
+      free(simple->pattern);
+      free(simple);
+      break;
     case MATCH_SHELL:
-      free(*data);
+      shell = *data;
+      free(shell->pattern);
+      free(shell->literal.s);
+      free(shell);
       break;
     case MATCH_REGEX:
-      regfree(*data);
-      free(*data);
+      rd = *data;
+      regfree(&rd->re);
+      free(rd->literal.s);
+      free(rd);
       break;
     case MATCH_PCRE:
       pd = (struct my_pcredata*)*data;
       pcre_free(pd->re);
+#ifdef PCRE_STUDY_JIT_COMPILE
+      pcre_free_study(pd->re_extra);
+#else
       pcre_free(pd->re_extra);
+#endif
+      free(pd->literal.s);
       free(*data);
       break;
+    case MATCH_SET:
+      set_free(*data);
+      break;
+    case MATCH_MULTI_SHELL:
+      multi_shell_free(*data);
+      break;
     case MATCH_NONE:
       break;
   }
@@ -63,17 +468,43 @@ void match_reset(MatchType* match_type, MatchFunc* match_func, void **data) {
   *data = NULL;
 }
 
-int match_init(MatchType arg_type, const char *pattern, MatchType* match_type, MatchFunc* match_func, void **data) {
+int match_init(MatchType arg_type, PyObject *pypattern, int flags, MatchType* match_type, MatchFunc* match_func, void **data) {
+  struct simple_data *simple;
+  struct shell_data *shell;
+  struct regex_data *rd;
+  const char *lit;
+  size_t lit_len;
+  MatchType match_type_reset;
   /* For PCRE only */
   struct my_pcredata *pd;
   const char *error;
   int erroffset;
+  /* For MATCH_SET and MATCH_MULTI_SHELL */
+  struct multi_shell *ms;
+  PyObject *seq;
+  Py_ssize_t i, n;
+  const char *pattern = NULL;
+
+  if(arg_type != MATCH_SET && arg_type != MATCH_MULTI_SHELL) {
+    pattern = PyString_AsString(pypattern);
+    if(pattern == NULL)
+      return -1;
+  }
 
   switch(arg_type) {
     case MATCH_SIMPLE:
       if(pattern != NULL && strlen(pattern)>0) {
-        *match_func = &string_match;
-        *data = (void*)strdup(pattern);
+        *match_func = (flags & MATCH_ICASE) ? &string_casematch : &string_match;
+        simple = malloc(sizeof(struct simple_data));
+        *data = simple;
+        if(simple == NULL)
+          goto nomem_pattern;
+        simple->len = strlen(pattern);
+        simple->pattern = strdup(pattern);
+        if(simple->pattern == NULL) {
+          free(simple);
+          goto nomem_pattern;
+        }
       } else {
         PyErr_SetString(PyExc_ValueError, "Empty pattern given.");
         return -1;
@@ -82,7 +513,18 @@ int match_init(MatchType arg_type, const char *pattern, MatchType* match_type, M
     case MATCH_SHELL:
       if(pattern != NULL && strlen(pattern)>0) {
         *match_func = &shell_match;
-        *data = (void*)strdup(pattern);
+        shell = calloc(1, sizeof(struct shell_data));
+        *data = shell;
+        if(shell == NULL)
+          goto nomem_pattern;
+        shell->pattern = strdup(pattern);
+        shell->fnm_flags = (flags & MATCH_ICASE) ? FNM_CASEFOLD : 0;
+        glob_literal(pattern, &lit, &lit_len);
+        if(shell->pattern == NULL || literal_init(&shell->literal, lit, lit_len, flags) == -1) {
+          free(shell->pattern);
+          free(shell);
+          goto nomem_pattern;
+        }
       } else {
         PyErr_SetString(PyExc_ValueError, "Empty pattern given.");
         return -1;
@@ -90,39 +532,97 @@ int match_init(MatchType arg_type, const char *pattern, MatchType* match_type, M
       break;
     case MATCH_REGEX:
       *match_func = &regex_match;
-      *data = malloc(sizeof(regex_t));
-      if(*data == NULL) {
-        PyErr_SetString(PyExc_MemoryError, "Unable to allocate memory.");
-        return -1;
-      }
-      if(regcomp(*data, pattern, REG_EXTENDED | REG_NOSUB) != 0) {
+      rd = calloc(1, sizeof(struct regex_data));
+      *data = rd;
+      if(rd == NULL)
+        goto nomem_pattern;
+      if(regcomp(&rd->re, pattern, REG_EXTENDED | REG_NOSUB | ((flags & MATCH_ICASE) ? REG_ICASE : 0)) != 0) {
         PyErr_SetString(RegexError, "Could not compile regex.");
-        free(*data);
+        free(rd);
         return -1;
       }
+      regex_literal(pattern, &lit, &lit_len);
+      if(literal_init(&rd->literal, lit, lit_len, flags) == -1) {
+        regfree(&rd->re);
+        free(rd);
+        goto nomem_pattern;
+      }
       break;
     case MATCH_PCRE:
       *match_func = &pcre_match;
-      *data = malloc(sizeof(struct my_pcredata));
+      *data = calloc(1, sizeof(struct my_pcredata));
       if(*data == NULL) {
         PyErr_SetString(PyExc_MemoryError, "Unable to allocate memory.");
         return -1;
       }
       pd = (struct my_pcredata*)*data;
 
-      pd->re = pcre_compile(pattern, 0, &error, &erroffset, NULL);
+      pd->re = pcre_compile(pattern, (flags & MATCH_ICASE) ? PCRE_CASELESS : 0, &error, &erroffset, NULL);
       if(pd->re == NULL) {
         PyErr_Format(RegexError, "Could not compile regex at %d: %s", erroffset, error);
         free(*data);
         return -1;
       }
+#ifdef PCRE_STUDY_JIT_COMPILE
+      /* the regex is compiled to machine code where pcre supports it */
+      pd->re_extra = pcre_study(pd->re, PCRE_STUDY_JIT_COMPILE, &error);
+#else
       pd->re_extra = pcre_study(pd->re, 0, &error);
+#endif
       if(error != NULL) {
         PyErr_Format(RegexError, "Could not study regex: %s", error);
         pcre_free(pd->re);
         free(*data);
         return -1;
       }
+      regex_literal(pattern, &lit, &lit_len);
+      if(literal_init(&pd->literal, lit, lit_len, flags) == -1) {
+        match_type_reset = MATCH_PCRE;
+        match_reset(&match_type_reset, match_func, data);
+        goto nomem_pattern;
+      }
+      break;
+    case MATCH_SET:
+      seq = pattern_list(pypattern);
+      if(seq == NULL)
+        return -1;
+      n = PySequence_Fast_GET_SIZE(seq);
+      *match_func = &set_match;
+      *data = set_new(n, flags);
+      if(*data == NULL)
+        goto nomem;
+      for(i = 0; i < n; i++) {
+        if(set_add(*data, PyString_AS_STRING(PySequence_Fast_GET_ITEM(seq, i))) == -1) {
+          set_free(*data);
+          goto nomem;
+        }
+      }
+      Py_DECREF(seq);
+      break;
+    case MATCH_MULTI_SHELL:
+      seq = pattern_list(pypattern);
+      if(seq == NULL)
+        return -1;
+      n = PySequence_Fast_GET_SIZE(seq);
+      *match_func = &multi_shell_match;
+      ms = calloc(1, sizeof(struct multi_shell));
+      *data = ms;
+      if(ms == NULL)
+        goto nomem;
+      ms->exact = set_new(n, flags);
+      ms->fnm_flags = (flags & MATCH_ICASE) ? FNM_CASEFOLD : 0;
+      ms->globs = calloc(n + 1, sizeof(struct glob));
+      if(ms->exact == NULL || ms->globs == NULL) {
+        multi_shell_free(ms);
+        goto nomem;
+      }
+      for(i = 0; i < n; i++) {
+        if(multi_shell_add(ms, PyString_AS_STRING(PySequence_Fast_GET_ITEM(seq, i))) == -1) {
+          multi_shell_free(ms);
+          goto nomem;
+        }
+      }
+      Py_DECREF(seq);
       break;
     default:
       PyErr_SetString(PyExc_ValueError, "Invalid matching method given.");
@@ -130,6 +630,14 @@ int match_init(MatchType arg_type, const char *pattern, MatchType* match_type, M
   }
   *match_type = arg_type;
   return 0;
+
+nomem:
+  Py_DECREF(seq);
+nomem_pattern:
+  *match_func = NULL;
+  *data = NULL;
+  PyErr_SetString(PyExc_MemoryError, "Unable to allocate memory.");
+  return -1;
 }
 
 void match_pyinit(PyObject *m) {
@@ -137,4 +645,7 @@ void match_pyinit(PyObject *m) {
   PyModule_AddIntConstant(m, "MATCH_SHELL", MATCH_SHELL);
   PyModule_AddIntConstant(m, "MATCH_REGEX", MATCH_REGEX);
   PyModule_AddIntConstant(m, "MATCH_PCRE", MATCH_PCRE);
+  PyModule_AddIntConstant(m, "MATCH_SET", MATCH_SET);
+  PyModule_AddIntConstant(m, "MATCH_MULTI_SHELL", MATCH_MULTI_SHELL);
+  PyModule_AddIntConstant(m, "MATCH_ICASE", MATCH_ICASE);
 }
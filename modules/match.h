@@ -6,13 +6,19 @@ typedef enum {
   MATCH_SIMPLE,
   MATCH_SHELL,
   MATCH_REGEX,
-  MATCH_PCRE
+  MATCH_PCRE,
+  MATCH_SET,
+  MATCH_MULTI_SHELL
 } MatchType;
 
-typedef int (*MatchFunc)(const char*, void*);
+/* flags of match_init */
+#define MATCH_ICASE 1
+
+/* match a string of the given length, that is also NUL terminated */
+typedef int (*MatchFunc)(const char*, size_t, void*);
 
 void match_reset(MatchType* match_type, MatchFunc* match_func, void **data);
-int match_init(MatchType arg_type, const char *pattern, MatchType* match_type, MatchFunc* match_func, void **data);
+int match_init(MatchType arg_type, PyObject *pattern, int flags, MatchType* match_type, MatchFunc* match_func, void **data);
 void match_pyinit(PyObject *m);
 
 #endif /* MATCH_H */
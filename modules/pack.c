@@ -0,0 +1,409 @@
+#include <Python.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <fcntl.h>
+#include <unistd.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <zlib.h>
+#include "pack.h"
+#include "util.h"
+#include "db.h"
+
+static int table_fits(size_t size, uint64_t off, uint64_t count, size_t elsize) {
+  return off <= size && count * elsize <= size - off;
+}
+
+static int check_tables(struct pack_map *m) {
+  const struct pack_header *hdr = m->hdr;
+  uint64_t n = 0;
+  uint32_t i;
+
+  if(hdr->version != PACK_VERSION ||
+      !table_fits(m->size, hdr->pkgs_off, hdr->npkgs, sizeof(struct pack_pkg)) ||
+      !table_fits(m->size, hdr->entries_off, hdr->nentries, sizeof(struct pack_entry)) ||
+      !table_fits(m->size, hdr->strings_off, hdr->strings_len, 1) ||
+      (hdr->strings_len > 0 && m->map[hdr->strings_off + hdr->strings_len - 1] != '\0'))
+    return -1;
+  m->pkgs = (struct pack_pkg*)(m->map + hdr->pkgs_off);
+  m->entries = (struct pack_entry*)(m->map + hdr->entries_off);
+  m->strings = m->map + hdr->strings_off;
+  /* the entries of the packages follow each other */
+  for(i = 0; i < hdr->npkgs; i++) {
+    if(m->pkgs[i].first_entry != n || m->pkgs[i].dname >= hdr->strings_len)
+      return -1;
+    n += m->pkgs[i].nentries;
+  }
+  if(n != hdr->nentries)
+    return -1;
+  for(i = 0; i < hdr->nentries; i++) {
+    if(m->entries[i].name >= hdr->strings_len ||
+        !table_fits(m->size, m->entries[i].offset, m->entries[i].csize, 1))
+      return -1;
+  }
+  return 0;
+}
+
+/* map a pack and check its tables; return 1 if path is not a pack, -1 if
+ * it can not be read or is an invalid one */
+int pack_map(struct pack_map *m, const char *path) {
+  struct stat st;
+  char magic[sizeof(m->hdr->magic)];
+  void *map;
+  int fd;
+
+  memset(m, 0, sizeof(struct pack_map));
+  fd = open(path, O_RDONLY);
+  if(fd == -1)
+    return -1;
+  if(read(fd, magic, sizeof(magic)) != sizeof(magic) ||
+      memcmp(magic, PACK_MAGIC, sizeof(PACK_MAGIC)) != 0) {
+    close(fd);
+    return 1;
+  }
+  if(fstat(fd, &st) == -1 || st.st_size < (off_t)sizeof(struct pack_header)) {
+    close(fd);
+    return -1;
+  }
+  map = mmap(NULL, st.st_size, PROT_READ, MAP_SHARED, fd, 0);
+  close(fd);
+  if(map == MAP_FAILED)
+    return -1;
+  m->map = map;
+  m->size = st.st_size;
+  m->hdr = map;
+  if(check_tables(m) == -1) {
+    pack_unmap(m);
+    return -1;
+  }
+  return 0;
+}
+
+void pack_unmap(struct pack_map *m) {
+  if(m->map != NULL)
+    munmap(m->map, m->size);
+  memset(m, 0, sizeof(struct pack_map));
+}
+
+/* Tables collected while writing a pack, the data is written as it is
+ * read */
+struct packer {
+  FILE *fp;
+  uint64_t offset;
+  char *strings;
+  size_t slen, salloc;
+  struct pack_pkg *pkgs;
+  size_t npkgs, palloc;
+  struct pack_entry *entries;
+  size_t nentries, ealloc;
+  /* data of the current entry, and its compressed form */
+  char *data;
+  size_t dalloc;
+  Bytef *zdata;
+  size_t zalloc;
+  /* previous pack, whose packages are copied when they did not change,
+   * sorted by directory name */
+  const struct pack_map *old;
+  uint32_t *old_pkgs;
+};
+
+static int add_string(struct packer *p, const char *s, uint32_t *off) {
+  size_t len = strlen(s) + 1;
+
+  if(p->slen + len > UINT32_MAX)
+    return -1;
+  if(grow_array((void**)&p->strings, &p->salloc, p->slen + len, 1) == -1)
+    return -1;
+  memcpy(p->strings + p->slen, s, len);
+  *off = p->slen;
+  p->slen += len;
+  return 0;
+}
+
+/* the entry names are the same in every package, they are stored once */
+static int add_entry_name(struct packer *p, const char *s, uint32_t *off) {
+  size_t i;
+
+  for(i = p->nentries < 8 ? 0 : p->nentries - 8; i < p->nentries; i++) {
+    if(strcmp(p->strings + p->entries[i].name, s) == 0) {
+      *off = p->entries[i].name;
+      return 0;
+    }
+  }
+  return add_string(p, s, off);
+}
+
+static void packer_free(struct packer *p) {
+  free(p->old_pkgs);
+  free(p->strings);
+  free(p->pkgs);
+  free(p->entries);
+  free(p->data);
+  free(p->zdata);
+}
+
+/* add an entry of csize bytes of data to the tables and write it */
+static int add_entry(struct packer *p, const char *fname, time_t mtime,
+                     const void *data, size_t csize, size_t size) {
+  struct pack_entry *e;
+
+  if(p->nentries >= UINT32_MAX)
+    return -1;
+  if(grow_array((void**)&p->entries, &p->ealloc, p->nentries + 1, sizeof(struct pack_entry)) == -1)
+    return -1;
+  e = &p->entries[p->nentries];
+  memset(e, 0, sizeof(struct pack_entry));
+  if(add_entry_name(p, fname, &e->name) == -1)
+    return -1;
+  e->offset = p->offset;
+  e->mtime = mtime;
+  e->csize = csize;
+  e->size = size;
+  if(fwrite(data, 1, csize, p->fp) != csize)
+    return -2;
+  p->offset += csize;
+  p->nentries++;
+  p->pkgs[p->npkgs - 1].nentries++;
+  return 0;
+}
+
+/* compress and write the entry read in p->data */
+static int write_entry(struct packer *p, const char *fname, time_t mtime, size_t size) {
+  const void *out = p->data;
+  uLongf zlen;
+
+  if(size > UINT32_MAX)
+    return -1;
+  zlen = compressBound(size);
+  if(grow_array((void**)&p->zdata, &p->zalloc, zlen, 1) == -1)
+    return -1;
+  if(compress2(p->zdata, &zlen, (Bytef*)p->data, size, Z_BEST_COMPRESSION) != Z_OK)
+    return -1;
+  /* a compressed entry is always smaller than its data */
+  if(zlen < size)
+    out = p->zdata;
+  else
+    zlen = size;
+  return add_entry(p, fname, mtime, out, zlen, size);
+}
+
+static int cmp_old_pkg(const void *x, const void *y, void *m) {
+  const struct pack_map *old = m;
+
+  return strcmp(old->strings + old->pkgs[*(uint32_t*)x].dname,
+                old->strings + old->pkgs[*(uint32_t*)y].dname);
+}
+
+static int sort_old_pkgs(struct packer *p) {
+  uint32_t i, n = p->old->hdr->npkgs;
+
+  p->old_pkgs = malloc((n + 1) * sizeof(uint32_t));
+  if(p->old_pkgs == NULL)
+    return -1;
+  for(i = 0; i < n; i++)
+    p->old_pkgs[i] = i;
+  qsort_r(p->old_pkgs, n, sizeof(uint32_t), cmp_old_pkg, (void*)p->old);
+  return 0;
+}
+
+/* return the entry fname of the package dname of the previous pack, NULL if
+ * there is none; the directory name of a package has its version, so it
+ * holds the same data */
+static const struct pack_entry *find_old_entry(struct packer *p, const char *dname, const char *fname) {
+  const struct pack_map *old = p->old;
+  const struct pack_pkg *pkg;
+  size_t lo = 0, hi, mid;
+  uint32_t i;
+  int r;
+
+  if(old == NULL)
+    return NULL;
+  hi = old->hdr->npkgs;
+  while(lo < hi) {
+    mid = lo + (hi - lo) / 2;
+    pkg = &old->pkgs[p->old_pkgs[mid]];
+    r = strcmp(dname, old->strings + pkg->dname);
+    if(r == 0) {
+      for(i = 0; i < pkg->nentries; i++) {
+        if(strcmp(fname, old->strings + old->entries[pkg->first_entry + i].name) == 0)
+          return &old->entries[pkg->first_entry + i];
+      }
+      return NULL;
+    }
+    if(r < 0)
+      hi = mid;
+    else
+      lo = mid + 1;
+  }
+  return NULL;
+}
+
+/* write the entries of filename, one package after the other; return -1
+ * if it can not be read, -2 if the pack can not be written */
+static int pack_db(struct packer *p, const char *filename) {
+  struct db_reader *db;
+  struct pack_pkg *pkg;
+  const struct pack_entry *e;
+  const char *fname, *dname;
+  size_t size;
+  int ret = 0;
+
+  db = db_open(filename);
+  if(db == NULL)
+    return -1;
+  while(db_next(db, &dname, &fname)) {
+    if(p->npkgs == 0 || strcmp(p->strings + p->pkgs[p->npkgs - 1].dname, dname) != 0) {
+      if(p->npkgs >= UINT32_MAX ||
+          grow_array((void**)&p->pkgs, &p->palloc, p->npkgs + 1, sizeof(struct pack_pkg)) == -1) {
+        ret = -1;
+        break;
+      }
+      pkg = &p->pkgs[p->npkgs];
+      if(add_string(p, dname, &pkg->dname) == -1) {
+        ret = -1;
+        break;
+      }
+      pkg->first_entry = p->nentries;
+      pkg->nentries = 0;
+      p->npkgs++;
+    }
+    e = find_old_entry(p, dname, fname);
+    if(e != NULL) {
+      db_skip(db);
+      ret = add_entry(p, fname, db_entry_mtime(db), p->old->map + e->offset, e->csize, e->size);
+    } else {
+      ret = db_read_entry(db, &p->data, &p->dalloc, &size);
+      if(ret == 0)
+        ret = write_entry(p, fname, db_entry_mtime(db), size);
+    }
+    if(ret != 0)
+      break;
+  }
+  db_close(db);
+  return ret;
+}
+
+static int write_tables(struct packer *p, const struct stat *st) {
+  struct pack_header hdr;
+
+  memset(&hdr, 0, sizeof(hdr));
+  strncpy(hdr.magic, PACK_MAGIC, sizeof(hdr.magic));
+  hdr.version = PACK_VERSION;
+  hdr.npkgs = p->npkgs;
+  hdr.nentries = p->nentries;
+  hdr.strings_len = p->slen;
+  hdr.db_mtime = st->st_mtime;
+  hdr.db_size = st->st_size;
+  hdr.pkgs_off = p->offset;
+  hdr.entries_off = hdr.pkgs_off + p->npkgs * sizeof(struct pack_pkg);
+  hdr.strings_off = hdr.entries_off + p->nentries * sizeof(struct pack_entry);
+
+  if(fwrite(p->pkgs, sizeof(struct pack_pkg), p->npkgs, p->fp) != p->npkgs ||
+      fwrite(p->entries, sizeof(struct pack_entry), p->nentries, p->fp) != p->nentries ||
+      fwrite(p->strings, 1, p->slen, p->fp) != p->slen)
+    return -1;
+  /* the header is written last, over the one written first */
+  if(fseek(p->fp, 0, SEEK_SET) == -1 || fwrite(&hdr, sizeof(hdr), 1, p->fp) != 1)
+    return -1;
+  return 0;
+}
+
+/* return -1 if filename can not be read, -2 if packfile can not be written */
+static int write_pack(struct packer *p, const char *filename, const char *packfile, const struct stat *st) {
+  struct pack_header hdr;
+  char *tmp;
+  int fd, ret;
+
+  /* write to a temporary file first so that readers never see a partial pack */
+  fd = create_temp(packfile, &tmp);
+  if(fd == -1)
+    return -2;
+  p->fp = fdopen(fd, "wb");
+  if(p->fp == NULL) {
+    close(fd);
+    unlink(tmp);
+    free(tmp);
+    return -2;
+  }
+  memset(&hdr, 0, sizeof(hdr));
+  ret = fwrite(&hdr, sizeof(hdr), 1, p->fp) == 1 ? 0 : -2;
+  p->offset = sizeof(hdr);
+  if(ret == 0)
+    ret = pack_db(p, filename);
+  if(ret == 0 && (write_tables(p, st) == -1 || fflush(p->fp) != 0 || fsync(fileno(p->fp)) == -1))
+    ret = -2;
+  if(fclose(p->fp) != 0 && ret == 0)
+    ret = -2;
+  if(ret == 0 && rename(tmp, packfile) == -1)
+    ret = -2;
+  if(ret != 0)
+    unlink(tmp);
+  free(tmp);
+  return ret;
+}
+
+PyObject *build_pack(PyObject *self, PyObject *args, PyObject *kw) {
+  const char *filename, *packfile;
+  static char *kwlist[] = {"filename", "packfile", "update", NULL};
+  struct packer p;
+  struct pack_map old;
+  struct stat st;
+  int ret, update = 0;
+
+  if(!PyArg_ParseTupleAndKeywords(args, kw, "ss|i", kwlist, &filename, &packfile, &update))
+    return NULL;
+  if(strlen(filename)<=0 || strlen(packfile)<=0) {
+    PyErr_SetString(PyExc_ValueError, "Empty files tarball or pack name given.");
+    return NULL;
+  }
+  if(stat(filename, &st)==-1 || !(S_ISREG(st.st_mode) || S_ISDIR(st.st_mode))) {
+    PyErr_Format(PyExc_IOError, "File does not exist: %s\n", filename);
+    return NULL;
+  }
+
+  memset(&p, 0, sizeof(p));
+  Py_BEGIN_ALLOW_THREADS
+  /* the packages already in the previous pack are not compressed again */
+  if(update && pack_map(&old, packfile) == 0) {
+    p.old = &old;
+    if(sort_old_pkgs(&p) == -1) {
+      pack_unmap(&old);
+      p.old = NULL;
+    }
+  }
+  ret = write_pack(&p, filename, packfile, &st);
+  if(p.old != NULL)
+    pack_unmap(&old);
+  Py_END_ALLOW_THREADS
+  packer_free(&p);
+  if(ret == -1) {
+    PyErr_Format(PyExc_IOError, "Unable to read files tarball: %s", filename);
+    return NULL;
+  }
+  if(ret == -2) {
+    PyErr_SetFromErrnoWithFilename(PyExc_IOError, (char*)packfile);
+    return NULL;
+  }
+  Py_RETURN_NONE;
+}
+
+PyObject *pack_stat(PyObject *self, PyObject *args) {
+  const char *packfile;
+  struct pack_header hdr;
+  FILE *fp;
+  size_t n;
+
+  if(!PyArg_ParseTuple(args, "s", &packfile))
+    return NULL;
+  fp = fopen(packfile, "rb");
+  if(fp == NULL)
+    return PyErr_SetFromErrnoWithFilename(PyExc_IOError, (char*)packfile);
+  n = fread(&hdr, sizeof(hdr), 1, fp);
+  fclose(fp);
+  if(n != 1 || memcmp(hdr.magic, PACK_MAGIC, sizeof(PACK_MAGIC)) != 0 || hdr.version != PACK_VERSION) {
+    PyErr_Format(PyExc_IOError, "Not a files pack: %s", packfile);
+    return NULL;
+  }
+  return Py_BuildValue("(LL)", (PY_LONG_LONG)hdr.db_mtime, (PY_LONG_LONG)hdr.db_size);
+}
@@ -0,0 +1,68 @@
+#ifndef PACK_H
+#define PACK_H
+
+#include <stddef.h>
+#include <stdint.h>
+
+#define PACK_MAGIC "PKGFPAK"
+#define PACK_VERSION 1
+
+/* On-disk layout of a *.files.pack file, a files database recompressed so
+ * that its entries can be read one by one:
+ *   header
+ *   data               the data of each entry, compressed on its own with
+ *                      zlib, or stored as is if that is not smaller
+ *   pkgs[npkgs]        in the order of the database
+ *   entries[nentries]  in package order
+ *   strings            NUL terminated package directory and entry names
+ * All integers are stored in host byte order, offsets are relative to the
+ * start of the file except string offsets that are relative to strings_off.
+ */
+struct pack_header {
+  char magic[8];
+  uint32_t version;
+  uint32_t npkgs;
+  uint32_t nentries;
+  uint32_t strings_len;
+  int64_t db_mtime;
+  int64_t db_size;
+  uint64_t pkgs_off;
+  uint64_t entries_off;
+  uint64_t strings_off;
+};
+
+struct pack_pkg {
+  uint32_t dname;
+  uint32_t first_entry;
+  uint32_t nentries;
+};
+
+struct pack_entry {
+  uint64_t offset;
+  int64_t mtime;
+  uint32_t name;
+  uint32_t csize;
+  uint32_t size;
+  uint32_t reserved;
+};
+
+/* A mapped pack, whose tables were checked */
+struct pack_map {
+  char *map;
+  size_t size;
+  const struct pack_header *hdr;
+  const struct pack_pkg *pkgs;
+  const struct pack_entry *entries;
+  const char *strings;
+};
+
+int pack_map(struct pack_map *m, const char *path);
+void pack_unmap(struct pack_map *m);
+
+/* db.c reads packs without Python */
+#ifdef Py_PYTHON_H
+PyObject *build_pack(PyObject *self, PyObject *args, PyObject *kw);
+PyObject *pack_stat(PyObject *self, PyObject *args);
+#endif
+
+#endif /* PACK_H */
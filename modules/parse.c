@@ -5,13 +5,10 @@
 #include <stdlib.h>
 #include <locale.h>
 #include <time.h>
-#include <archive.h>
-#include <archive_entry.h>
 #include <ctype.h>
-#include <libgen.h>
 #include "search.h"
 #include "util.h"
-#define ABUFLEN 1024
+#include "db.h"
 
 #define STRDUP(r, s, action) do { if(s != NULL) { r = strdup(s); if(r == NULL) { ALLOC_FAIL(strlen(s)); action; } } else { r = NULL; } } while(0)
 
@@ -298,19 +295,29 @@ error:
 	return -1;
 }
 
+/* append pkg to ret if its desc was read, and release it */
+static int flush_pkg(PyObject *ret, PyObject **ppkg, int *have_desc) {
+	int r = 0;
+
+	if (*ppkg != NULL && *have_desc)
+		r = PyList_Append(ret, *ppkg);
+	Py_XDECREF(*ppkg);
+	*ppkg = NULL;
+	*have_desc = 0;
+	return r;
+}
+
 PyObject *pkg_info(PyObject *self, PyObject *args) {
 	/* collect package info of packages listed in given .files.tar.gz files
+	 * or database directory, or of all its packages if None is given
 	 * return a list of dict */
-	int found, existing;
-	char *l = NULL, *p, *v;
-	char pname[ABUFLEN], *fname, *dname;
-	const char *filename=NULL, *pkgname;
-	struct stat st;
-	struct archive *a;
-	struct archive_entry *entry;
+	int found = 0, have_desc = 0, r;
+	char *p, *v, *cur = NULL;
+	const char *filename=NULL, *fname, *dname;
+	struct db_reader *db = NULL;
 	FILE *stream = NULL;
-	PyObject *ret=NULL, *pkgnames_list=NULL, *pkg=NULL, *waiting_dict=NULL;
-	Py_ssize_t lp, i;
+	PyObject *ret=NULL, *pkgnames_list=NULL, *pkg=NULL, *names=NULL, *pystr;
+	Py_ssize_t remaining = -1;
 
 	if (!PyArg_ParseTuple(args, "sO", &filename, &pkgnames_list)) {
 		PyErr_SetString(PyExc_ValueError, "pkg_info() has invalid arguments");
@@ -321,129 +328,332 @@ PyObject *pkg_info(PyObject *self, PyObject *args) {
 		return NULL;
 	}
 
-	if (!PyList_Check(pkgnames_list)) {
-		PyErr_SetString(PyExc_ValueError, "pkg_info() 2nd argument must be a list");
-		return NULL;
-	}
-	lp = PyList_Size(pkgnames_list);
-	if ( lp == 0) {
-		return PyList_New(0);
+	if (pkgnames_list != Py_None) {
+		if (!PyList_Check(pkgnames_list)) {
+			PyErr_SetString(PyExc_ValueError, "pkg_info() 2nd argument must be a list or None");
+			return NULL;
+		}
+		if (PyList_Size(pkgnames_list) == 0) {
+			return PyList_New(0);
+		}
+		/* all the names are looked up in a single pass */
+		names = PyFrozenSet_New(pkgnames_list);
+		if (names == NULL) {
+			return NULL;
+		}
+		remaining = PySet_Size(names);
 	}
 
-	pname[ABUFLEN-1]='\0';
-	if(stat(filename, &st)==-1 || !S_ISREG(st.st_mode)) {
+	if(!db_exists(filename)) {
 		PyErr_Format(PyExc_IOError, "File does not exist: %s\n", filename);
-		return NULL;
+		goto error;
 	}
 	ret = PyList_New(0);
 	if (ret == NULL) {
 		goto error;
 	}
-	waiting_dict = PyDict_New();
-	if (waiting_dict == NULL) {
+
+	db = db_open(filename);
+	if (db == NULL) {
+		PyErr_Format(PyExc_IOError, "Unable to open files database: %s", filename);
 		goto error;
 	}
-
-	a = archive_read_new();
-	archive_read_support_compression_all(a);
-	archive_read_support_format_all(a);
-	archive_read_open_filename(a, filename, 10240);
-	l = NULL;
-	while (archive_read_next_header(a, &entry) == ARCHIVE_OK) {
-		if(!S_ISREG(archive_entry_filetype(entry))) {
-			archive_read_data_skip(a);
-			continue;
-		}
-		strncpy(pname, archive_entry_pathname(entry), ABUFLEN-1);
-		fname = basename(pname);
-		dname = dirname(pname);
-		if (splitname(dname, &p, &v) == -1) {
-			archive_read_data_skip(a);
-			continue;
-		}
-		found = 0;
-		for (i=0; i<lp; i++) {
-			pkgname = PyString_AsString(PyList_GetItem(pkgnames_list, i));
-			if (pkgname == NULL) {
+	/* the entries of a package are contiguous: the package is complete
+	 * when the next one starts */
+	while (db_next(db, &dname, &fname)) {
+		if (cur == NULL || strcmp(cur, dname) != 0) {
+			if (flush_pkg(ret, &pkg, &have_desc) == -1)
 				goto error;
-			}
-			if (strcmp(p, pkgname) == 0) {
-				found = 1;
+			/* stop once all the given packages were read */
+			if (remaining == 0)
 				break;
+			free(cur);
+			cur = strdup(dname);
+			if (cur == NULL) {
+				PyErr_NoMemory();
+				goto error;
+			}
+			found = 0;
+			if (splitname(dname, &p, &v) == 0) {
+				if (names == NULL) {
+					found = 1;
+				} else {
+					pystr = PyString_FromString(p);
+					found = pystr == NULL ? -1 : PySet_Contains(names, pystr);
+					Py_XDECREF(pystr);
+				}
+				free(p);
+				free(v);
+				if (found == -1)
+					goto error;
+				if (found)
+					remaining--;
 			}
 		}
-		free(p);
-		free(v);
-
-		if (!found) {
-			archive_read_data_skip(a);
+		if (!found || (strcmp(fname, "desc") != 0 && strcmp(fname, "depends") != 0)) {
+			db_skip(db);
 			continue;
 		}
-
-		pkg = PyDict_GetItemString(waiting_dict, pkgname);
-		existing = 1;
 		if (pkg == NULL) {
-			existing = 0;
 			pkg = PyDict_New();
 			if (pkg == NULL) {
 				goto error;
 			}
 		}
 
-		if(strcmp(fname, "desc") == 0) {
-			stream = open_archive_stream(a);
-			if (!stream) {
-				PyErr_SetString(PyExc_IOError, "Unable to open archive stream.");
-				goto error;
-			}
+		stream = db_stream(db);
+		if (!stream) {
+			PyErr_SetString(PyExc_IOError, "Unable to open archive stream.");
+			goto error;
+		}
+		if (strcmp(fname, "desc") == 0) {
+			r = parse_desc(stream, &pkg);
+			if (r == 0)
+				have_desc = 1;
+		} else {
+			r = parse_depends(stream, &pkg);
+		}
+		fclose(stream);
+		if (r == -1) {
+			/* discard the package */
+			found = 0;
+			Py_CLEAR(pkg);
+			have_desc = 0;
+		}
+	}
+	if (flush_pkg(ret, &pkg, &have_desc) == -1)
+		goto error;
+	free(cur);
+	db_close(db);
+	Py_XDECREF(names);
+
+	return ret;
+
+error:
+	free(cur);
+	db_close(db);
+	Py_XDECREF(names);
+	Py_XDECREF(ret);
+	Py_XDECREF(pkg);
+	return NULL;
+}
+
+/* the package being read by reverse_deps */
+struct deps_pkg {
+	PyObject *name;
+	PyObject *depends;
+	PyObject *provides;
+	long reason;
+};
+
+/* read the dependencies, provisions and install reason of a package from
+ * its desc or depends entry, without their version constraints; newer
+ * local databases keep them all in desc. The lines are read whole,
+ * whatever their length */
+static int parse_deps(struct db_reader *db, struct deps_pkg *pkg) {
+	PyObject *list = NULL, *s;
+	char *line;
+	size_t len;
+	int r, reason = 0;
 
-			if (parse_desc(stream, &pkg) == -1) {
-				fclose(stream);
-				if (!existing) Py_DECREF(pkg);
+	while ((r = db_getline(db, &line, &len)) == 1) {
+		strtrim(line);
+		if (reason) {
+			pkg->reason = atol(line);
+			reason = 0;
+		} else if (list != NULL) {
+			if (line[0] == '\0') {
+				list = NULL;
 				continue;
 			}
-			fclose(stream);
-		} else if (strcmp(fname, "depends") == 0) {
-			stream = open_archive_stream(a);
-			if (!stream) {
-				PyErr_SetString(PyExc_IOError, "Unable to open archive stream.");
-				goto error;
+			line[strcspn(line, "<>=")] = '\0';
+			s = PyString_FromString(line);
+			if (s == NULL || PyList_Append(list, s) == -1) {
+				Py_XDECREF(s);
+				return -1;
 			}
+			Py_DECREF(s);
+		} else if (strcmp(line, "%DEPENDS%") == 0) {
+			list = pkg->depends;
+		} else if (strcmp(line, "%PROVIDES%") == 0) {
+			list = pkg->provides;
+		} else if (strcmp(line, "%REASON%") == 0) {
+			reason = 1;
+		}
+	}
+	if (r == -1) {
+		PyErr_SetString(PyExc_IOError, "Unable to read files database entry.");
+		return -1;
+	}
+	return 0;
+}
+
+static int add_provider(PyObject *providers, PyObject *target, PyObject *name) {
+	PyObject *list = PyDict_GetItem(providers, target);
+
+	if (list == NULL) {
+		list = PyList_New(0);
+		if (list == NULL || PyDict_SetItem(providers, target, list) == -1) {
+			Py_XDECREF(list);
+			return -1;
+		}
+		Py_DECREF(list);
+	}
+	return PyList_Append(list, name);
+}
+
+/* record the package read so far in the dicts of reverse_deps, and
+ * release it */
+static int flush_deps(struct deps_pkg *pkg, PyObject *reasons, PyObject *depends, PyObject *providers) {
+	PyObject *reason = NULL;
+	Py_ssize_t i;
+	int r = -1;
+
+	if (pkg->name == NULL)
+		return 0;
+	reason = PyInt_FromLong(pkg->reason);
+	if (reason == NULL || PyDict_SetItem(reasons, pkg->name, reason) == -1 ||
+			PyDict_SetItem(depends, pkg->name, pkg->depends) == -1 ||
+			add_provider(providers, pkg->name, pkg->name) == -1)
+		goto cleanup;
+	for (i = 0; i < PyList_GET_SIZE(pkg->provides); i++) {
+		if (add_provider(providers, PyList_GET_ITEM(pkg->provides, i), pkg->name) == -1)
+			goto cleanup;
+	}
+	r = 0;
 
-			if (parse_depends(stream, &pkg) == -1) {
-				fclose(stream);
-				if (!existing) Py_DECREF(pkg);
+cleanup:
+	Py_XDECREF(reason);
+	Py_CLEAR(pkg->name);
+	Py_CLEAR(pkg->depends);
+	Py_CLEAR(pkg->provides);
+	return r;
+}
+
+/* add the packages to the required by list of the providers of their
+ * dependencies */
+static int link_deps(PyObject *ret, PyObject *depends, PyObject *providers) {
+	PyObject *name, *deps, *found, *target, *required_by;
+	Py_ssize_t pos = 0, i, j;
+	int r;
+
+	while (PyDict_Next(depends, &pos, &name, &deps)) {
+		for (i = 0; i < PyList_GET_SIZE(deps); i++) {
+			found = PyDict_GetItem(providers, PyList_GET_ITEM(deps, i));
+			if (found == NULL)
 				continue;
+			for (j = 0; j < PyList_GET_SIZE(found); j++) {
+				target = PyList_GET_ITEM(found, j);
+				if (strcmp(PyString_AS_STRING(target), PyString_AS_STRING(name)) == 0)
+					continue;
+				required_by = PyTuple_GET_ITEM(PyDict_GetItem(ret, target), 1);
+				/* a package may depend on several provisions of another */
+				r = PySequence_Contains(required_by, name);
+				if (r == -1 || (r == 0 && PyList_Append(required_by, name) == -1))
+					return -1;
 			}
-			fclose(stream);
-		} else {
-			archive_read_data_skip(a);
-			continue;
 		}
+	}
+	return 0;
+}
 
-		if (existing) {
-			PyList_Append(ret, pkg);
-			PyDict_DelItemString(waiting_dict, pkgname);
-			pkg = NULL;
-		} else {
-			PyDict_SetItemString(waiting_dict, pkgname, pkg);
-			Py_DECREF(pkg);
-		}
+PyObject *reverse_deps(PyObject *self, PyObject *args) {
+	/* read the dependencies of all the packages of a files.tar.gz file or
+	 * database directory in one pass, and return a dict mapping each
+	 * package name to a tuple of its install reason and the sorted list
+	 * of the packages depending on it, directly or through a provision */
+	const char *filename = NULL, *fname, *dname;
+	char *cur = NULL, *p, *v;
+	struct db_reader *db = NULL;
+	struct deps_pkg pkg = {NULL, NULL, NULL, 0};
+	PyObject *ret = NULL, *reasons = NULL, *depends = NULL, *providers = NULL;
+	PyObject *name, *reason, *entry;
+	Py_ssize_t pos = 0;
+
+	if (!PyArg_ParseTuple(args, "s", &filename))
+		return NULL;
+	if (!db_exists(filename)) {
+		PyErr_Format(PyExc_IOError, "File does not exist: %s\n", filename);
+		return NULL;
 	}
-	if(l)
-		free(l);
+	reasons = PyDict_New();
+	depends = PyDict_New();
+	providers = PyDict_New();
+	if (reasons == NULL || depends == NULL || providers == NULL)
+		goto error;
 
-	archive_read_finish(a);
+	db = db_open(filename);
+	if (db == NULL) {
+		PyErr_Format(PyExc_IOError, "Unable to open files database: %s", filename);
+		goto error;
+	}
+	while (db_next(db, &dname, &fname)) {
+		if (cur == NULL || strcmp(cur, dname) != 0) {
+			if (flush_deps(&pkg, reasons, depends, providers) == -1)
+				goto error;
+			free(cur);
+			cur = strdup(dname);
+			if (cur == NULL) {
+				PyErr_NoMemory();
+				goto error;
+			}
+			if (splitname(dname, &p, &v) == 0) {
+				pkg.name = PyString_FromString(p);
+				pkg.depends = PyList_New(0);
+				pkg.provides = PyList_New(0);
+				/* packages without a reason were explicitly installed */
+				pkg.reason = 0;
+				free(p);
+				free(v);
+				if (pkg.name == NULL || pkg.depends == NULL || pkg.provides == NULL)
+					goto error;
+			}
+		}
+		if (pkg.name == NULL || (strcmp(fname, "desc") != 0 && strcmp(fname, "depends") != 0)) {
+			db_skip(db);
+			continue;
+		}
+		if (parse_deps(db, &pkg) == -1)
+			goto error;
+	}
+	if (flush_deps(&pkg, reasons, depends, providers) == -1)
+		goto error;
 
-	/* we discard element still present in waiting_dict because they miss either the desc
-	 * or depends values */
-	Py_DECREF(waiting_dict);
+	ret = PyDict_New();
+	if (ret == NULL)
+		goto error;
+	while (PyDict_Next(reasons, &pos, &name, &reason)) {
+		entry = Py_BuildValue("(O[])", reason);
+		if (entry == NULL || PyDict_SetItem(ret, name, entry) == -1) {
+			Py_XDECREF(entry);
+			goto error;
+		}
+		Py_DECREF(entry);
+	}
+	if (link_deps(ret, depends, providers) == -1)
+		goto error;
+	pos = 0;
+	while (PyDict_Next(ret, &pos, &name, &entry)) {
+		if (PyList_Sort(PyTuple_GET_ITEM(entry, 1)) == -1)
+			goto error;
+	}
 
+	free(cur);
+	db_close(db);
+	Py_DECREF(reasons);
+	Py_DECREF(depends);
+	Py_DECREF(providers);
 	return ret;
 
 error:
+	free(cur);
+	db_close(db);
+	Py_XDECREF(pkg.name);
+	Py_XDECREF(pkg.depends);
+	Py_XDECREF(pkg.provides);
+	Py_XDECREF(reasons);
+	Py_XDECREF(depends);
+	Py_XDECREF(providers);
 	Py_XDECREF(ret);
-	Py_XDECREF(waiting_dict);
-	Py_XDECREF(pkg);
 	return NULL;
 }
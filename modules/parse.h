@@ -7,4 +7,5 @@
 int parse_depends(FILE *stream, PyObject **ppkg);
 int parse_desc(FILE *stream, PyObject **ppkg);
 PyObject *pkg_info(PyObject *self, PyObject *args);
+PyObject *reverse_deps(PyObject *self, PyObject *args);
 #endif /* PARSE_H */
@@ -3,12 +3,26 @@
 #include "search.h"
 #include "listpkg.h"
 #include "parse.h"
+#include "index.h"
+#include "result.h"
+#include "stats.h"
+#include "pack.h"
+#include "delta.h"
 
 PyObject *RegexError;
 
 static PyMethodDef PkgfileMethods[] = {
   {"list_packages", (PyCFunction)&list_packages, METH_VARARGS | METH_KEYWORDS, "List the packages of a file list tarball."},
+  {"archive_contents", (PyCFunction)&archive_contents, METH_VARARGS | METH_KEYWORDS, "List the entries of a package archive, in any compression."},
   {"pkg_info", (PyCFunction)&pkg_info, METH_VARARGS, "Return info about a package in a file list tarball."},
+  {"reverse_deps", (PyCFunction)&reverse_deps, METH_VARARGS, "Map the packages of a file list tarball to their install reason and the packages depending on them."},
+  {"build_index", (PyCFunction)&build_index, METH_VARARGS | METH_KEYWORDS, "Build a sorted index of a file list tarball."},
+  {"build_pack", (PyCFunction)&build_pack, METH_VARARGS | METH_KEYWORDS, "Recompress a file list tarball into a pack whose entries can be read one by one."},
+  {"pack_stat", (PyCFunction)&pack_stat, METH_VARARGS, "Return the mtime and size of the file list tarball a pack was made from."},
+  {"apply_delta", (PyCFunction)&apply_delta, METH_VARARGS | METH_KEYWORDS, "Write the file list tarball made of a file list tarball and a delta from it."},
+  {"make_delta", (PyCFunction)&make_delta, METH_VARARGS | METH_KEYWORDS, "Write the delta between two file list tarballs."},
+  {"stats", (PyCFunction)&stats, METH_NOARGS, "Return the counters of the searches, by database."},
+  {"enable_stats", (PyCFunction)&enable_stats, METH_VARARGS | METH_KEYWORDS, "Enable or disable the counters of the searches, and clear them."},
   {NULL, NULL, 0, NULL}
 };
 
@@ -25,4 +39,6 @@ PyMODINIT_FUNC initpkgfile(void) {
 
   search_pyinit(m);
   match_pyinit(m);
+  index_pyinit(m);
+  result_pyinit(m);
 }
@@ -0,0 +1,443 @@
+#include <Python.h>
+#include <structmember.h>
+#include <stdlib.h>
+#include <string.h>
+#include "result.h"
+#include "util.h"
+
+int result_add_string(struct search_result *res, const char *s, size_t *off) {
+  size_t len = strlen(s) + 1;
+
+  if(grow_array((void**)&res->strings, &res->salloc, res->slen + len, 1) == -1)
+    return -1;
+  memcpy(res->strings + res->slen, s, len);
+  *off = res->slen;
+  res->slen += len;
+  return 0;
+}
+
+int result_add_file(struct search_result *res, size_t off) {
+  if(grow_array((void**)&res->files, &res->falloc, res->nfiles + 1, sizeof(size_t)) == -1)
+    return -1;
+  res->files[res->nfiles++] = off;
+  return 0;
+}
+
+int result_add_pkg(struct search_result *res, const char *pkgname, const char *pkgver,
+                   size_t first_file, size_t nfiles, size_t target) {
+  struct pkg_result *pkg;
+
+  if(grow_array((void**)&res->pkgs, &res->palloc, res->npkgs + 1, sizeof(struct pkg_result)) == -1)
+    return -1;
+  pkg = &res->pkgs[res->npkgs];
+  if(result_add_string(res, pkgname, &pkg->name) == -1 ||
+      result_add_string(res, pkgver, &pkg->version) == -1)
+    return -1;
+  pkg->first_file = first_file;
+  pkg->nfiles = nfiles;
+  pkg->target = target;
+  res->npkgs++;
+  return 0;
+}
+
+/* forget the matches but keep the buffers for the next ones */
+void result_clear(struct search_result *res) {
+  res->slen = 0;
+  res->nfiles = 0;
+  res->npkgs = 0;
+}
+
+void result_free(struct search_result *res) {
+  free(res->strings);
+  free(res->files);
+  free(res->pkgs);
+}
+
+/* Match: the name, version and files of a package matching a search. It
+ * takes much less memory than a dict, and can still be read like one. */
+typedef struct {
+  PyObject_HEAD
+  PyObject *name;
+  PyObject *version;
+  PyObject *files;
+} Match;
+
+/* interned field names, also returned by keys() */
+static PyObject *match_keys[3];
+static const char *match_key_names[3] = {"name", "version", "files"};
+
+static void Match_dealloc(Match *self) {
+  Py_XDECREF(self->name);
+  Py_XDECREF(self->version);
+  Py_XDECREF(self->files);
+  self->ob_type->tp_free((PyObject*)self);
+}
+
+static PyObject **Match_field(Match *self, int i) {
+  switch(i) {
+    case 0:
+      return &self->name;
+    case 1:
+      return &self->version;
+    default:
+      return &self->files;
+  }
+}
+
+/* return the index of the field named key, -1 if there is none */
+static int Match_key(Match *self, PyObject *key) {
+  const char *k;
+  int i;
+
+  if(!PyString_Check(key))
+    return -1;
+  for(i = 0; i < 3; i++) {
+    if(key == match_keys[i])
+      break;
+  }
+  if(i == 3) {
+    k = PyString_AS_STRING(key);
+    for(i = 0; i < 3 && strcmp(k, match_key_names[i]); i++);
+  }
+  if(i == 3 || *Match_field(self, i) == NULL)
+    return -1;
+  return i;
+}
+
+static PyObject *Match_subscript(Match *self, PyObject *key) {
+  PyObject *v;
+  int i = Match_key(self, key);
+
+  if(i == -1) {
+    PyErr_SetObject(PyExc_KeyError, key);
+    return NULL;
+  }
+  v = *Match_field(self, i);
+  Py_INCREF(v);
+  return v;
+}
+
+static Py_ssize_t Match_length(Match *self) {
+  return self->files == NULL ? 2 : 3;
+}
+
+static int Match_contains(Match *self, PyObject *key) {
+  return Match_key(self, key) != -1;
+}
+
+static PyObject *Match_get(Match *self, PyObject *args) {
+  PyObject *key, *def = Py_None, *v;
+  int i;
+
+  if(!PyArg_UnpackTuple(args, "get", 1, 2, &key, &def))
+    return NULL;
+  i = Match_key(self, key);
+  v = (i == -1) ? def : *Match_field(self, i);
+  Py_INCREF(v);
+  return v;
+}
+
+static PyObject *Match_keys(Match *self) {
+  PyObject *ret;
+  Py_ssize_t i, n = Match_length(self);
+
+  ret = PyList_New(n);
+  if(ret == NULL)
+    return NULL;
+  for(i = 0; i < n; i++) {
+    Py_INCREF(match_keys[i]);
+    PyList_SET_ITEM(ret, i, match_keys[i]);
+  }
+  return ret;
+}
+
+static PyObject *Match_tuple(Match *self) {
+  if(self->files == NULL)
+    return PyTuple_Pack(2, self->name, self->version);
+  return PyTuple_Pack(3, self->name, self->version, self->files);
+}
+
+static PyObject *Match_richcompare(PyObject *x, PyObject *y, int op) {
+  PyObject *tx, *ty, *ret;
+
+  if(!PyObject_TypeCheck(x, &MatchPyType) || !PyObject_TypeCheck(y, &MatchPyType)) {
+    Py_INCREF(Py_NotImplemented);
+    return Py_NotImplemented;
+  }
+  tx = Match_tuple((Match*)x);
+  ty = Match_tuple((Match*)y);
+  ret = (tx == NULL || ty == NULL) ? NULL : PyObject_RichCompare(tx, ty, op);
+  Py_XDECREF(tx);
+  Py_XDECREF(ty);
+  return ret;
+}
+
+static PyObject *Match_repr(Match *self) {
+  PyObject *ret, *fmt, *args;
+
+  args = Match_tuple(self);
+  if(args == NULL)
+    return NULL;
+  if(self->files == NULL)
+    fmt = PyString_FromString("Match(name=%r, version=%r)");
+  else
+    fmt = PyString_FromString("Match(name=%r, version=%r, files=%r)");
+  if(fmt == NULL) {
+    Py_DECREF(args);
+    return NULL;
+  }
+  ret = PyString_Format(fmt, args);
+  Py_DECREF(fmt);
+  Py_DECREF(args);
+  return ret;
+}
+
+static PyMappingMethods Match_as_mapping = {
+  (lenfunc)Match_length,          /* mp_length */
+  (binaryfunc)Match_subscript,    /* mp_subscript */
+  0,                              /* mp_ass_subscript */
+};
+
+static PySequenceMethods Match_as_sequence = {
+  0,                              /* sq_length */
+  0,                              /* sq_concat */
+  0,                              /* sq_repeat */
+  0,                              /* sq_item */
+  0,                              /* sq_slice */
+  0,                              /* sq_ass_item */
+  0,                              /* sq_ass_slice */
+  (objobjproc)Match_contains,     /* sq_contains */
+};
+
+static PyMethodDef Match_methods[] = {
+  {"get", (PyCFunction)Match_get, METH_VARARGS, "Return the field named key, like dict.get."},
+  {"keys", (PyCFunction)Match_keys, METH_NOARGS, "Return the names of the fields, like dict.keys."},
+  {NULL, NULL, 0, NULL}
+};
+
+static PyMemberDef Match_members[] = {
+  {"name", T_OBJECT, offsetof(Match, name), READONLY, "package name"},
+  {"version", T_OBJECT, offsetof(Match, version), READONLY, "package version"},
+  {"files", T_OBJECT, offsetof(Match, files), READONLY, "matching files, None if not searched"},
+  {NULL, 0, 0, 0, NULL}
+};
+
+PyTypeObject MatchPyType = {
+  PyObject_HEAD_INIT(NULL)
+  0,                          /*ob_size*/
+  "pkgfile.Match",            /*tp_name*/
+  sizeof(Match),              /*tp_basicsize*/
+  0,                          /*tp_itemsize*/
+  (destructor)Match_dealloc,  /*tp_dealloc*/
+  0,                          /*tp_print*/
+  0,                          /*tp_getattr*/
+  0,                          /*tp_setattr*/
+  0,                          /*tp_compare*/
+  (reprfunc)Match_repr,       /*tp_repr*/
+  0,                          /*tp_as_number*/
+  &Match_as_sequence,         /*tp_as_sequence*/
+  &Match_as_mapping,          /*tp_as_mapping*/
+  PyObject_HashNotImplemented, /*tp_hash */
+  0,                          /*tp_call*/
+  0,                          /*tp_str*/
+  0,                          /*tp_getattro*/
+  0,                          /*tp_setattro*/
+  0,                          /*tp_as_buffer*/
+  Py_TPFLAGS_DEFAULT | Py_TPFLAGS_HAVE_RICHCOMPARE, /*tp_flags*/
+  "Match object",             /* tp_doc */
+  0,                          /* tp_traverse */
+  0,                          /* tp_clear */
+  Match_richcompare,          /* tp_richcompare */
+  0,                          /* tp_weaklistoffset */
+  0,                          /* tp_iter */
+  0,                          /* tp_iternext */
+  Match_methods,              /* tp_methods */
+  Match_members,              /* tp_members */
+};
+
+/* return a new Match, stealing the references to its fields; files may
+ * be NULL when the files were not read */
+PyObject *result_new_match(PyObject *name, PyObject *version, PyObject *files) {
+  Match *self;
+
+  if(name == NULL || version == NULL)
+    goto error;
+  self = PyObject_New(Match, &MatchPyType);
+  if(self == NULL)
+    goto error;
+  self->name = name;
+  self->version = version;
+  self->files = files;
+  return (PyObject*)self;
+
+error:
+  Py_XDECREF(name);
+  Py_XDECREF(version);
+  Py_XDECREF(files);
+  return NULL;
+}
+
+/* return a new string of path, shared with the other occurrences when it is
+ * a directory, as directories are listed by most packages */
+PyObject *result_path(const char *path) {
+  size_t len = strlen(path);
+
+  if(len > 0 && path[len - 1] == '/')
+    return PyString_InternFromString(path);
+  return PyString_FromStringAndSize(path, len);
+}
+
+int pool_init(struct string_pool *pool) {
+  pool->mask = 1023;
+  pool->n = 0;
+  pool->hashes = malloc((pool->mask + 1) * sizeof(size_t));
+  pool->slots = calloc(pool->mask + 1, sizeof(PyObject*));
+  if(pool->hashes == NULL || pool->slots == NULL) {
+    free(pool->hashes);
+    free(pool->slots);
+    PyErr_NoMemory();
+    return -1;
+  }
+  return 0;
+}
+
+void pool_free(struct string_pool *pool) {
+  size_t i;
+
+  for(i = 0; i <= pool->mask; i++)
+    Py_XDECREF(pool->slots[i]);
+  free(pool->hashes);
+  free(pool->slots);
+}
+
+static size_t pool_hash(const char *s) {
+  /* FNV-1a */
+  size_t h = 2166136261u;
+
+  for(; *s; s++) {
+    h ^= (unsigned char)*s;
+    h *= 16777619u;
+  }
+  return h;
+}
+
+/* double the size of the pool once it is half full */
+static int pool_grow(struct string_pool *pool) {
+  size_t i, j, mask = pool->mask * 2 + 1;
+  size_t *hashes;
+  PyObject **slots;
+
+  hashes = malloc((mask + 1) * sizeof(size_t));
+  slots = calloc(mask + 1, sizeof(PyObject*));
+  if(hashes == NULL || slots == NULL) {
+    free(hashes);
+    free(slots);
+    PyErr_NoMemory();
+    return -1;
+  }
+  for(i = 0; i <= pool->mask; i++) {
+    if(pool->slots[i] == NULL)
+      continue;
+    for(j = pool->hashes[i] & mask; slots[j] != NULL; j = (j + 1) & mask);
+    hashes[j] = pool->hashes[i];
+    slots[j] = pool->slots[i];
+  }
+  free(pool->hashes);
+  free(pool->slots);
+  pool->hashes = hashes;
+  pool->slots = slots;
+  pool->mask = mask;
+  return 0;
+}
+
+/* return a new reference to the string s of pool, made by make if it is
+ * not there yet */
+static PyObject *pool_string(struct string_pool *pool, const char *s, PyObject *(*make)(const char *)) {
+  size_t i, h = pool_hash(s);
+  PyObject *str;
+
+  for(i = h & pool->mask; pool->slots[i] != NULL; i = (i + 1) & pool->mask) {
+    if(pool->hashes[i] == h && strcmp(PyString_AS_STRING(pool->slots[i]), s) == 0) {
+      Py_INCREF(pool->slots[i]);
+      return pool->slots[i];
+    }
+  }
+  str = make(s);
+  if(str == NULL)
+    return NULL;
+  Py_INCREF(str);
+  pool->hashes[i] = h;
+  pool->slots[i] = str;
+  if(++pool->n * 2 > pool->mask && pool_grow(pool) == -1) {
+    Py_DECREF(str);
+    return NULL;
+  }
+  return str;
+}
+
+static PyObject *make_string(struct string_pool *pool, const char *s, PyObject *(*make)(const char *)) {
+  if(pool == NULL)
+    return make(s);
+  return pool_string(pool, s, make);
+}
+
+/* build the Match of pkg, taking its strings from pool if it is not NULL */
+PyObject *result_pool_match(struct search_result *res, struct pkg_result *pkg, struct string_pool *pool) {
+  PyObject *pystr, *files;
+  size_t j;
+
+  files = PyList_New(pkg->nfiles);
+  if(files == NULL)
+    return NULL;
+  for(j = 0; j < pkg->nfiles; j++) {
+    pystr = make_string(pool, res->strings + res->files[pkg->first_file + j], result_path);
+    if(pystr == NULL) {
+      Py_DECREF(files);
+      return NULL;
+    }
+    PyList_SET_ITEM(files, j, pystr);
+  }
+  return result_new_match(make_string(pool, res->strings + pkg->name, PyString_InternFromString),
+                          make_string(pool, res->strings + pkg->version, PyString_FromString), files);
+}
+
+/* build the Match of pkg */
+PyObject *result_match(struct search_result *res, struct pkg_result *pkg) {
+  return result_pool_match(res, pkg, NULL);
+}
+
+PyObject *result_to_list(struct search_result *res) {
+  PyObject *ret, *match;
+  size_t i;
+
+  ret = PyList_New(0);
+  if(ret == NULL)
+    return NULL;
+
+  for(i = 0; i < res->npkgs; i++) {
+    match = result_match(res, &res->pkgs[i]);
+    if(match == NULL) {
+      Py_DECREF(ret);
+      return NULL;
+    }
+    PyList_Append(ret, match);
+    Py_DECREF(match);
+  }
+  return ret;
+}
+
+void result_pyinit(PyObject *m) {
+  PyObject *to;
+  int i;
+
+  for(i = 0; i < 3; i++) {
+    match_keys[i] = PyString_InternFromString(match_key_names[i]);
+    if(match_keys[i] == NULL)
+      return;
+  }
+  if (PyType_Ready(&MatchPyType) < 0)
+    return;
+  to = (PyObject*)&MatchPyType;
+  Py_INCREF(to);
+  PyModule_AddObject(m, "Match", (PyObject*)&MatchPyType);
+}
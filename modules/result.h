@@ -0,0 +1,53 @@
+#ifndef RESULT_H
+#define RESULT_H
+
+#include <Python.h>
+
+/* Matches collected while reading a tarball, without touching any Python
+ * object, so that the tarball can be read with the GIL released. Strings
+ * are stored once in a single buffer and referenced by offset. */
+struct pkg_result {
+  size_t name;
+  size_t version;
+  size_t first_file;
+  size_t nfiles;
+  size_t target;
+};
+
+struct search_result {
+  char *strings;
+  size_t slen, salloc;
+  size_t *files;
+  size_t nfiles, falloc;
+  struct pkg_result *pkgs;
+  size_t npkgs, palloc;
+};
+
+/* Python strings made for the matches of several results, so that a
+ * version or a file found again in another database is not made again */
+struct string_pool {
+  size_t mask;
+  size_t n;
+  size_t *hashes;
+  PyObject **slots;
+};
+
+int result_add_string(struct search_result *res, const char *s, size_t *off);
+int result_add_file(struct search_result *res, size_t off);
+int result_add_pkg(struct search_result *res, const char *pkgname, const char *pkgver,
+                   size_t first_file, size_t nfiles, size_t target);
+extern PyTypeObject MatchPyType;
+
+void result_clear(struct search_result *res);
+void result_free(struct search_result *res);
+PyObject *result_new_match(PyObject *name, PyObject *version, PyObject *files);
+PyObject *result_path(const char *path);
+PyObject *result_match(struct search_result *res, struct pkg_result *pkg);
+PyObject *result_pool_match(struct search_result *res, struct pkg_result *pkg, struct string_pool *pool);
+int pool_init(struct string_pool *pool);
+void pool_free(struct string_pool *pool);
+PyObject *result_to_list(struct search_result *res);
+
+void result_pyinit(PyObject *m);
+
+#endif /* RESULT_H */
@@ -1,241 +1,688 @@
 #include <Python.h>
-#define _GNU_SOURCE 1
-#include <archive.h>
-#include <archive_entry.h>
+#include <pthread.h>
 #include <stdio.h>
 #include <stdlib.h>
-#include <strings.h>
-#include <libgen.h>
+#include <string.h>
 #include "search.h"
 #include "match.h"
 #include "util.h"
-#define ABUFLEN 1024
+#include "result.h"
+#include "db.h"
+#include "stats.h"
 
-static cookie_io_functions_t archive_stream_funcs = {
-.read = (cookie_read_function_t*)archive_read_data,
-.write = NULL,
-.seek = NULL,
-.close = NULL
+typedef enum {
+  SCAN_OK,
+  SCAN_ENOMEM,
+  SCAN_EOPEN,
+  SCAN_ESTREAM
+} ScanError;
+
+/* target of the files kept for the SEARCH_PACKAGE patterns */
+#define PACKAGE_TARGET ((size_t)-1)
+
+struct file_target {
+  size_t target;
+  size_t seq;
+  size_t file;
 };
 
-FILE *open_archive_stream(struct archive *archive) {
-  return fopencookie(archive, "r", archive_stream_funcs);
+static int cmp_file_target(const void *x, const void *y) {
+  const struct file_target *p = x, *q = y;
+
+  if(p->target != q->target)
+    return (p->target > q->target) - (p->target < q->target);
+  return (p->seq > q->seq) - (p->seq < q->seq);
 }
 
-typedef enum {
-  SEARCH_NONE,
-  SEARCH_PATH,
-  SEARCH_FILENAME,
-  SEARCH_PACKAGE
-} SearchType;
-
-static PyObject *search_file(const char *filename,
-                             MatchFunc match_func,
-                             SearchType search_type,
-                             void *data) {
-  struct archive *a;
-  struct archive_entry *entry;
-  struct stat st;
-  char pname[ABUFLEN], *fname, *dname;
-  char *l = NULL, *m, *pkgname, *pkgver;
-  FILE *stream = NULL;
-  size_t n = 0;
-  int nread;
-  PyObject *ret, *dict, *pystr, *pystrname, *pystrver, *files;
-
-  pname[ABUFLEN-1]='\0';
-  if(stat(filename, &st)==-1 || !S_ISREG(st.st_mode)) {
-    PyErr_Format(PyExc_IOError, "File does not exist: %s\n", filename);
-    return NULL;
+/* add to res the files of a package grouped by the pattern they matched */
+static int add_package(struct search_result *res, const char *pkgname, const char *pkgver,
+                       struct file_target *ft, size_t nft,
+                       size_t *pkg_targets, size_t npkg_targets, int sorted) {
+  size_t i, j, k, first;
+
+  if(!sorted)
+    qsort(ft, nft, sizeof(struct file_target), cmp_file_target);
+  for(i = 0; i < nft; i = j) {
+    first = res->nfiles;
+    for(j = i; j < nft && ft[j].target == ft[i].target; j++) {
+      if(result_add_file(res, ft[j].file) == -1)
+        return -1;
+    }
+    if(ft[i].target != PACKAGE_TARGET) {
+      if(result_add_pkg(res, pkgname, pkgver, first, j - i, ft[i].target) == -1)
+        return -1;
+      continue;
+    }
+    for(k = 0; k < npkg_targets; k++) {
+      if(result_add_pkg(res, pkgname, pkgver, first, j - i, pkg_targets[k]) == -1)
+        return -1;
+    }
+    npkg_targets = 0;
   }
-  ret = PyList_New(0);
-  if(ret == NULL) {
-    return NULL;
+  /* a package matching by name is returned even if it has no file */
+  for(k = 0; k < npkg_targets; k++) {
+    if(result_add_pkg(res, pkgname, pkgver, res->nfiles, 0, pkg_targets[k]) == -1)
+      return -1;
   }
+  return 0;
+}
 
-  files = PyList_New(0);
-  if(files == NULL) {
-    Py_DECREF(ret);
-    return NULL;
+/* State of a scan of a files database, read one package at a time */
+struct scan {
+  struct db_reader *r;
+  struct pattern *patterns;
+  size_t npatterns;
+  int line_patterns;
+  size_t *pkg_targets;
+  struct file_target *ft;
+  size_t ftalloc;
+  struct db_stats *stats;
+};
+
+static void scan_close(struct scan *s) {
+  db_close(s->r);
+  free(s->pkg_targets);
+  free(s->ft);
+  memset(s, 0, sizeof(struct scan));
+}
+
+/* The scan functions must not call the Python API: they run without
+ * holding the GIL */
+static ScanError scan_open(struct scan *s, const char *filename,
+                           struct pattern *patterns, size_t npatterns,
+                           struct db_stats *stats) {
+  size_t i;
+
+  memset(s, 0, sizeof(struct scan));
+  s->stats = stats;
+  s->patterns = patterns;
+  s->npatterns = npatterns;
+  s->pkg_targets = malloc((npatterns + 1) * sizeof(size_t));
+  if(s->pkg_targets == NULL)
+    return SCAN_ENOMEM;
+  for(i = 0; i < npatterns; i++) {
+    if(patterns[i].search_type != SEARCH_PACKAGE)
+      s->line_patterns = 1;
   }
+  s->r = db_open(filename);
+  if(s->r == NULL) {
+    scan_close(s);
+    return SCAN_EOPEN;
+  }
+  if(stats_enabled)
+    db_set_stats(s->r, stats);
+  return SCAN_OK;
+}
 
-  a = archive_read_new();
-  archive_read_support_compression_all(a);
-  archive_read_support_format_all(a);
-  archive_read_open_filename(a, filename, 10240);
-  l = NULL;
-  while (archive_read_next_header(a, &entry) == ARCHIVE_OK) {
-    if(!S_ISREG(archive_entry_filetype(entry))) {
-      archive_read_data_skip(a);
-      continue;
+/* read packages until one of them matches and is added to res; *done is set
+ * when the end of the database is reached */
+static ScanError scan_next(struct scan *s, struct search_result *res, int *done) {
+  struct pattern *p;
+  const char *fname, *dname;
+  char *l, *m, *base, *pkgname, *pkgver;
+  size_t i, nft, off, npkg_targets, npkgs = res->npkgs, len, base_len, m_len;
+  int have_off, in_files, r, timed = stats_enabled;
+  double start = timed ? db_clock() : 0;
+  ScanError ret = SCAN_OK;
+
+  *done = 0;
+  while (res->npkgs == npkgs) {
+    if(!db_next(s->r, &dname, &fname)) {
+      *done = 1;
+      break;
     }
-    strncpy(pname, archive_entry_pathname(entry), ABUFLEN-1);
-    fname = basename(pname);
-    dname = dirname(pname);
     if(strcmp(fname, "files")) {
-      archive_read_data_skip(a);
+      db_skip(s->r);
       continue;
     }
     if (splitname(dname, &pkgname, &pkgver) == -1) {
-      archive_read_data_skip(a);
+      db_skip(s->r);
       continue;
     }
-    if(search_type == SEARCH_PACKAGE) {
-      if(!match_func(pkgname, data)) {
-        free(pkgname);
-        free(pkgver);
-        archive_read_data_skip(a);
+    s->stats->packages++;
+    npkg_targets = 0;
+    len = strlen(pkgname);
+    for(i = 0; i < s->npatterns; i++) {
+      p = &s->patterns[i];
+      if(p->search_type != SEARCH_PACKAGE)
         continue;
-      }
+      s->stats->match_calls++;
+      if(p->match_func(pkgname, len, p->data))
+        s->pkg_targets[npkg_targets++] = i;
     }
-
-    stream = open_archive_stream(a);
-    if (!stream) {
-      PyErr_SetString(PyExc_IOError, "Unable to open archive stream.");
-      goto cleanup;
+    s->stats->matches += npkg_targets;
+    if(!s->line_patterns && npkg_targets == 0) {
+      free(pkgname);
+      free(pkgver);
+      db_skip(s->r);
+      continue;
     }
 
-    while((nread = getline(&l, &n, stream)) != -1) {
-      /* Note: getline returns -1 on both EOF and error. */
-      /* So I'm assuming that nread > 0. */
-      if(l[nread - 1] == '\n')
-        l[nread - 1] = '\0';  /* Clobber trailing newline. */
-      if(strcmp(l, "%FILES%") == 0)
+    nft = 0;
+    in_files = 1;
+    /* lines are split in the decompressed blocks, without copying them */
+    while((r = db_getline(s->r, &l, &len)) == 1) {
+      if(l[0] == '%') {
+        /* the local database also has a %BACKUP% section */
+        in_files = strcmp(l, "%FILES%") == 0;
         continue;
-      if(search_type == SEARCH_FILENAME) {
-        m = rindex(l, '/');
-        if(m == NULL || strlen(m) == 0 || strlen(++m) == 0)
-          continue;
-      } else {
-        m = l;
       }
-      if(search_type == SEARCH_PACKAGE || match_func(m, data)) {
-        pystr = PyString_FromString(l);
-        if(pystr == NULL)
-          goto cleanup;
-        PyList_Append(files, pystr);
-        Py_DECREF(pystr);
+      if(!in_files || l[0] == '\0')
+        continue;
+      s->stats->lines++;
+      base = memrchr(l, '/', len);
+      base = (base != NULL && base[1] != '\0') ? base + 1 : NULL;
+      base_len = base ? len - (base - l) : 0;
+      have_off = 0;
+      for(i = 0; i <= s->npatterns; i++) {
+        if(i == s->npatterns) {
+          /* files are kept once for all the matching SEARCH_PACKAGE patterns */
+          if(npkg_targets == 0)
+            break;
+        } else {
+          p = &s->patterns[i];
+          if(p->search_type == SEARCH_PACKAGE)
+            continue;
+          if(p->search_type == SEARCH_FILENAME) {
+            m = base;
+            m_len = base_len;
+          } else {
+            m = l;
+            m_len = len;
+          }
+          if(m == NULL)
+            continue;
+          s->stats->match_calls++;
+          if(!p->match_func(m, m_len, p->data))
+            continue;
+          s->stats->matches++;
+        }
+        if(!have_off) {
+          if(result_add_string(res, l, &off) == -1) {
+            ret = SCAN_ENOMEM;
+            break;
+          }
+          have_off = 1;
+        }
+        if(grow_array((void**)&s->ft, &s->ftalloc, nft + 1, sizeof(struct file_target)) == -1) {
+          ret = SCAN_ENOMEM;
+          break;
+        }
+        s->ft[nft].target = (i == s->npatterns) ? PACKAGE_TARGET : i;
+        s->ft[nft].seq = nft;
+        s->ft[nft].file = off;
+        nft++;
       }
+      if(ret != SCAN_OK)
+        break;
     }
+    if(r == -1 && ret == SCAN_OK)
+      ret = SCAN_ESTREAM;
 
-    if(search_type == SEARCH_PACKAGE || PyList_Size(files) > 0) {
-      pystrname = PyString_FromString(pkgname);
-      free(pkgname);
-      if(pystrname == NULL) {
-        free(pkgver);
-        goto cleanup;
-      }
-      pystrver = PyString_FromString(pkgver);
-      free(pkgver);
-      if(pystrver == NULL)
-        goto cleanup;
-
-      dict = PyDict_New();
-      if(dict == NULL) {
-        Py_DECREF(pystrname);
-        Py_DECREF(pystrver);
-        goto cleanup;
-      }
-      PyDict_SetItemString(dict, "name", pystrname);
-      Py_DECREF(pystrname);
-      PyDict_SetItemString(dict, "version", pystrver);
-      Py_DECREF(pystrver);
-      PyDict_SetItemString(dict, "files", files);
-      Py_DECREF(files);
-
-      PyList_Append(ret, dict);
-      Py_DECREF(dict);
-
-      files = PyList_New(0);
-      if(files == NULL)
-        goto cleanup_nofiles;
-    }
-    fclose(stream);
+    if(ret == SCAN_OK && add_package(res, pkgname, pkgver, s->ft, nft,
+          s->pkg_targets, npkg_targets, s->npatterns == 1) == -1)
+      ret = SCAN_ENOMEM;
+    free(pkgname);
+    free(pkgver);
+    if(ret != SCAN_OK)
+      break;
   }
+  if(timed)
+    s->stats->scan_time += db_clock() - start;
+  return ret;
+}
 
-  Py_DECREF(files);
-  if(l)
-    free(l);
+static ScanError scan_archive(const char *filename,
+                              struct pattern *patterns,
+                              size_t npatterns,
+                              struct search_result *res,
+                              struct db_stats *stats) {
+  struct scan s;
+  ScanError ret;
+  int done = 0;
 
-  archive_read_finish(a);
+  ret = scan_open(&s, filename, patterns, npatterns, stats);
+  if(ret != SCAN_OK)
+    return ret;
+  while(ret == SCAN_OK && !done)
+    ret = scan_next(&s, res, &done);
+  scan_close(&s);
   return ret;
+}
 
-cleanup:
-  Py_DECREF(files);
-cleanup_nofiles:
-  if(l)
-    free(l);
-  archive_read_finish(a);
-  Py_DECREF(ret);
-  return NULL;
+/* set the Python exception of a scan error */
+static void scan_error(ScanError err, const char *filename) {
+  switch(err) {
+    case SCAN_OK:
+      break;
+    case SCAN_EOPEN:
+      PyErr_Format(PyExc_IOError, "Unable to open files database: %s", filename);
+      break;
+    case SCAN_ESTREAM:
+      PyErr_Format(PyExc_IOError, "Unable to read files database: %s", filename);
+      break;
+    default:
+      PyErr_NoMemory();
+      break;
+  }
+}
+
+static int check_filename(const char *filename) {
+  if(filename == NULL || strlen(filename)<=0) {
+    PyErr_SetString(PyExc_ValueError, "Empty files tarball name given.");
+    return -1;
+  }
+  if(!db_exists(filename)) {
+    PyErr_Format(PyExc_IOError, "File does not exist: %s\n", filename);
+    return -1;
+  }
+  return 0;
+}
+
+/* read filename with the GIL released, setting a Python exception on error */
+static int search_file(const char *filename,
+                       struct pattern *patterns,
+                       size_t npatterns,
+                       struct search_result *res,
+                       struct db_stats *stats) {
+  ScanError err;
+
+  memset(res, 0, sizeof(struct search_result));
+  memset(stats, 0, sizeof(struct db_stats));
+  if(check_filename(filename) == -1)
+    return -1;
+
+  Py_BEGIN_ALLOW_THREADS
+  err = scan_archive(filename, patterns, npatterns, res, stats);
+  Py_END_ALLOW_THREADS
+
+  if(err == SCAN_OK)
+    return 0;
+  scan_error(err, filename);
+  result_free(res);
+  return -1;
+}
+
+/* A database read by search_many, and the matches found in it */
+struct many_db {
+  const char *filename;
+  struct search_result res;
+  struct db_stats stats;
+  ScanError err;
+};
+
+/* The databases of a search_many call, taken in turn by its threads */
+struct many_scan {
+  struct pattern *patterns;
+  size_t npatterns;
+  struct many_db *dbs;
+  size_t ndbs, next;
+  pthread_mutex_t lock;
+};
+
+static void *scan_many_worker(void *arg) {
+  struct many_scan *m = arg;
+  struct many_db *db;
+
+  for(;;) {
+    pthread_mutex_lock(&m->lock);
+    db = m->next < m->ndbs ? &m->dbs[m->next++] : NULL;
+    pthread_mutex_unlock(&m->lock);
+    if(db == NULL)
+      return NULL;
+    db->err = scan_archive(db->filename, m->patterns, m->npatterns, &db->res, &db->stats);
+  }
+}
+
+/* read all the databases of m, with up to nthreads threads counting the
+ * calling one; like the other scan functions it runs without the GIL */
+static void scan_many(struct many_scan *m, int nthreads) {
+  pthread_t *threads = NULL;
+  int i, n = 0;
+
+  if((size_t)nthreads > m->ndbs)
+    nthreads = m->ndbs;
+  if(nthreads > 1)
+    threads = malloc((nthreads - 1) * sizeof(pthread_t));
+  /* the databases left by threads that could not be started are read by
+   * the calling thread */
+  for(i = 0; threads != NULL && i < nthreads - 1; i++) {
+    if(pthread_create(&threads[n], NULL, scan_many_worker, m) == 0)
+      n++;
+  }
+  scan_many_worker(m);
+  for(i = 0; i < n; i++)
+    pthread_join(threads[i], NULL);
+  free(threads);
+}
+
+/* count the objects made for the match of pkg: the Match and its files */
+static void count_objects(struct db_stats *stats, struct pkg_result *pkg) {
+  stats->objects += 1 + pkg->nfiles;
+}
+
+static int init_search_type(long st) {
+  switch(st) {
+    case SEARCH_PATH:
+    case SEARCH_PACKAGE:
+    case SEARCH_FILENAME:
+      return 0;
+    default:
+      PyErr_SetString(PyExc_ValueError, "Invalid search type given.");
+      return -1;
+  }
 }
 
 typedef struct {
   PyObject_HEAD
-  MatchType match_type;
-  MatchFunc match_func;
-  SearchType search_type;
-  void *data;
+  struct pattern pattern;
 } Search;
 
+/* Iterator over the matches of a Search, reading the database one package
+ * at a time */
+typedef struct {
+  PyObject_HEAD
+  PyObject *search;
+  char *filename;
+  struct scan scan;
+  struct search_result res;
+  size_t pos;
+  int done;
+  int busy;
+  struct db_stats stats;
+  int reported;
+} SearchIter;
+
+/* add the counters of the iterator to pkgfile.stats() once */
+static int SearchIter_report(SearchIter *self) {
+  if(self->reported)
+    return 0;
+  self->reported = 1;
+  return stats_add(self->filename, &self->stats);
+}
+
+static void SearchIter_dealloc(SearchIter *self) {
+  /* an iterator that was not exhausted reports what it read */
+  if(self->filename != NULL && SearchIter_report(self) == -1)
+    PyErr_Clear();
+  scan_close(&self->scan);
+  result_free(&self->res);
+  free(self->filename);
+  Py_XDECREF(self->search);
+  PyObject_Del(self);
+}
+
+static PyObject *SearchIter_next(SearchIter *self) {
+  struct pkg_result *pkg;
+  PyObject *match;
+  ScanError err;
+  double start;
+  int done;
+
+  /* the database is read without the GIL, another thread must not use it */
+  if(self->busy) {
+    PyErr_SetString(PyExc_ValueError, "Search iterator already executing.");
+    return NULL;
+  }
+  while(self->pos >= self->res.npkgs) {
+    if(self->done) {
+      SearchIter_report(self);
+      return NULL;
+    }
+    result_clear(&self->res);
+    self->pos = 0;
+    self->busy = 1;
+    Py_BEGIN_ALLOW_THREADS
+    err = scan_next(&self->scan, &self->res, &done);
+    Py_END_ALLOW_THREADS
+    self->busy = 0;
+    if(err != SCAN_OK || done) {
+      self->done = 1;
+      scan_close(&self->scan);
+    }
+    if(err != SCAN_OK) {
+      scan_error(err, self->filename);
+      return NULL;
+    }
+  }
+  pkg = &self->res.pkgs[self->pos++];
+  if(!stats_enabled)
+    return result_match(&self->res, pkg);
+  start = db_clock();
+  match = result_match(&self->res, pkg);
+  count_objects(&self->stats, pkg);
+  self->stats.objects_time += db_clock() - start;
+  return match;
+}
+
+static PyTypeObject SearchIterPyType = {
+  PyObject_HEAD_INIT(NULL)
+  0,                          /*ob_size*/
+  "pkgfile.SearchIterator",   /*tp_name*/
+  sizeof(SearchIter),         /*tp_basicsize*/
+  0,                          /*tp_itemsize*/
+  (destructor)SearchIter_dealloc, /*tp_dealloc*/
+  0,                          /*tp_print*/
+  0,                          /*tp_getattr*/
+  0,                          /*tp_setattr*/
+  0,                          /*tp_compare*/
+  0,                          /*tp_repr*/
+  0,                          /*tp_as_number*/
+  0,                          /*tp_as_sequence*/
+  0,                          /*tp_as_mapping*/
+  0,                          /*tp_hash */
+  0,                          /*tp_call*/
+  0,                          /*tp_str*/
+  0,                          /*tp_getattro*/
+  0,                          /*tp_setattro*/
+  0,                          /*tp_as_buffer*/
+  Py_TPFLAGS_DEFAULT,         /*tp_flags*/
+  "Iterator over the matches of a Search", /* tp_doc */
+  0,                          /* tp_traverse */
+  0,                          /* tp_clear */
+  0,                          /* tp_richcompare */
+  0,                          /* tp_weaklistoffset */
+  PyObject_SelfIter,          /* tp_iter */
+  (iternextfunc)SearchIter_next, /* tp_iternext */
+};
+
 static PyObject *Search_new(PyTypeObject *type, PyObject *args, PyObject *kwds) {
   Search *self;
 
   self = (Search*)type->tp_alloc(type, 0);
   if (self != NULL) {
-    self->match_type = MATCH_NONE;
-    self->match_func = NULL;
-    self->search_type = SEARCH_NONE;
-    self->data = NULL;
+    self->pattern.match_type = MATCH_NONE;
+    self->pattern.match_func = NULL;
+    self->pattern.search_type = SEARCH_NONE;
+    self->pattern.data = NULL;
   }
 
   return (PyObject *)self;
 }
 
 static void Search_dealloc(Search* self) {
-  match_reset(&(self->match_type), &(self->match_func), &(self->data));
+  match_reset(&(self->pattern.match_type), &(self->pattern.match_func), &(self->pattern.data));
   self->ob_type->tp_free((PyObject*)self);
 }
 
 static int Search_init(Search *self, PyObject *args, PyObject *kw) {
   long mt, st;
-  const char *pattern;
-  static char *kwlist[] = {"matchtype", "searchtype", "pattern", NULL};
+  int flags = 0;
+  PyObject *pattern;
+  static char *kwlist[] = {"matchtype", "searchtype", "pattern", "flags", NULL};
 
-  match_reset(&(self->match_type), &(self->match_func), &(self->data));
-  self->search_type = SEARCH_NONE;
-  if(!PyArg_ParseTupleAndKeywords(args, kw, "lls", kwlist, &mt, &st, &pattern))
+  match_reset(&(self->pattern.match_type), &(self->pattern.match_func), &(self->pattern.data));
+  self->pattern.search_type = SEARCH_NONE;
+  if(!PyArg_ParseTupleAndKeywords(args, kw, "llO|i", kwlist, &mt, &st, &pattern, &flags))
     return -1;
-  switch(st) {
-    case SEARCH_PATH:
-    case SEARCH_PACKAGE:
-    case SEARCH_FILENAME:
-      break;
-    default:
-      PyErr_SetString(PyExc_ValueError, "Invalid search type given.");
-      return -1;
-  }
-  self->search_type = st;
-  return match_init(mt, pattern, &(self->match_type), &(self->match_func), &(self->data));
+  if(init_search_type(st) == -1)
+    return -1;
+  self->pattern.search_type = st;
+  return match_init(mt, pattern, flags, &(self->pattern.match_type), &(self->pattern.match_func), &(self->pattern.data));
 }
 
 static PyObject *Search_call(Search *self, PyObject *args, PyObject *kw) {
   const char *filename;
   static char *kwlist[] = {"filename", NULL};
+  struct search_result res;
+  struct db_stats stats;
+  PyObject *ret;
+  double start;
+  size_t i;
 
   if(!PyArg_ParseTupleAndKeywords(args, kw, "s", kwlist, &filename))
     return NULL;
-  if(filename == NULL || strlen(filename)<=0) {
-    PyErr_SetString(PyExc_ValueError, "Empty files tarball name given.");
+  if(self->pattern.match_type == MATCH_NONE || self->pattern.match_func == NULL || self->pattern.search_type == SEARCH_NONE) {
+    PyErr_SetString(PyExc_RuntimeError, "Invalid matching function or search type.");
+    return NULL;
+  }
+  if(search_file(filename, &self->pattern, 1, &res, &stats) == -1)
+    return NULL;
+  start = stats_enabled ? db_clock() : 0;
+  ret = result_to_list(&res);
+  if(ret != NULL && stats_enabled) {
+    for(i = 0; i < res.npkgs; i++)
+      count_objects(&stats, &res.pkgs[i]);
+    stats.objects_time = db_clock() - start;
+    if(stats_add(filename, &stats) == -1)
+      Py_CLEAR(ret);
+  }
+  result_free(&res);
+  return ret;
+}
+
+static PyObject *Search_iter(Search *self, PyObject *args, PyObject *kw) {
+  const char *filename;
+  static char *kwlist[] = {"filename", NULL};
+  SearchIter *it;
+  ScanError err;
+
+  if(!PyArg_ParseTupleAndKeywords(args, kw, "s", kwlist, &filename))
+    return NULL;
+  if(self->pattern.match_type == MATCH_NONE || self->pattern.match_func == NULL || self->pattern.search_type == SEARCH_NONE) {
+    PyErr_SetString(PyExc_RuntimeError, "Invalid matching function or search type.");
     return NULL;
   }
-  if(self->match_type == MATCH_NONE || self->match_func == NULL || self->search_type == SEARCH_NONE) {
+  if(check_filename(filename) == -1)
+    return NULL;
+
+  it = PyObject_New(SearchIter, &SearchIterPyType);
+  if(it == NULL)
+    return NULL;
+  memset(&it->scan, 0, sizeof(struct scan));
+  memset(&it->res, 0, sizeof(struct search_result));
+  memset(&it->stats, 0, sizeof(struct db_stats));
+  it->pos = 0;
+  it->done = 0;
+  it->busy = 0;
+  it->reported = 0;
+  /* the iterator uses the pattern of the Search */
+  Py_INCREF(self);
+  it->search = (PyObject*)self;
+  it->filename = strdup(filename);
+  if(it->filename == NULL) {
+    Py_DECREF(it);
+    return PyErr_NoMemory();
+  }
+
+  err = scan_open(&it->scan, filename, &self->pattern, 1, &it->stats);
+  if(err != SCAN_OK) {
+    scan_error(err, filename);
+    it->reported = 1;
+    Py_DECREF(it);
+    return NULL;
+  }
+  return (PyObject*)it;
+}
+
+static PyObject *Search_search_many(Search *self, PyObject *args, PyObject *kw) {
+  PyObject *filenames, *seq, *item, *match, *tuple, *ret = NULL;
+  static char *kwlist[] = {"filenames", "threads", NULL};
+  struct many_scan m;
+  struct string_pool pool;
+  struct many_db *db;
+  int threads = 1;
+  double start;
+  Py_ssize_t i, n;
+  size_t j;
+
+  if(!PyArg_ParseTupleAndKeywords(args, kw, "O|i", kwlist, &filenames, &threads))
+    return NULL;
+  if(self->pattern.match_type == MATCH_NONE || self->pattern.match_func == NULL || self->pattern.search_type == SEARCH_NONE) {
     PyErr_SetString(PyExc_RuntimeError, "Invalid matching function or search type.");
     return NULL;
   }
-  return search_file(filename, self->match_func, self->search_type, self->data);
+  seq = PySequence_Fast(filenames, "filenames must be a sequence");
+  if(seq == NULL)
+    return NULL;
+  n = PySequence_Fast_GET_SIZE(seq);
+  memset(&m, 0, sizeof(struct many_scan));
+  m.patterns = &self->pattern;
+  m.npatterns = 1;
+  m.dbs = calloc(n + 1, sizeof(struct many_db));
+  if(m.dbs == NULL) {
+    Py_DECREF(seq);
+    return PyErr_NoMemory();
+  }
+  for(i = 0; i < n; i++) {
+    m.dbs[i].filename = PyString_AsString(PySequence_Fast_GET_ITEM(seq, i));
+    if(m.dbs[i].filename == NULL || check_filename(m.dbs[i].filename) == -1)
+      goto cleanup;
+  }
+  m.ndbs = n;
+  pthread_mutex_init(&m.lock, NULL);
+  Py_BEGIN_ALLOW_THREADS
+  scan_many(&m, threads);
+  Py_END_ALLOW_THREADS
+  pthread_mutex_destroy(&m.lock);
+
+  for(i = 0; i < n; i++) {
+    if(m.dbs[i].err != SCAN_OK) {
+      scan_error(m.dbs[i].err, m.dbs[i].filename);
+      goto cleanup;
+    }
+  }
+  if(pool_init(&pool) == -1)
+    goto cleanup;
+  ret = PyList_New(0);
+  for(i = 0; ret != NULL && i < n; i++) {
+    db = &m.dbs[i];
+    item = PySequence_Fast_GET_ITEM(seq, i);
+    start = stats_enabled ? db_clock() : 0;
+    for(j = 0; j < db->res.npkgs; j++) {
+      match = result_pool_match(&db->res, &db->res.pkgs[j], &pool);
+      tuple = match == NULL ? NULL : Py_BuildValue("(ON)", item, match);
+      if(tuple == NULL || PyList_Append(ret, tuple) == -1) {
+        Py_XDECREF(tuple);
+        Py_CLEAR(ret);
+        break;
+      }
+      Py_DECREF(tuple);
+    }
+    if(ret != NULL && stats_enabled) {
+      for(j = 0; j < db->res.npkgs; j++)
+        count_objects(&db->stats, &db->res.pkgs[j]);
+      db->stats.objects_time = db_clock() - start;
+      if(stats_add(db->filename, &db->stats) == -1)
+        Py_CLEAR(ret);
+    }
+  }
+  pool_free(&pool);
+
+cleanup:
+  for(i = 0; i < n; i++)
+    result_free(&m.dbs[i].res);
+  free(m.dbs);
+  Py_DECREF(seq);
+  return ret;
 }
 
+static PyMethodDef Search_methods[] = {
+  {"iter", (PyCFunction)Search_iter, METH_VARARGS | METH_KEYWORDS, "Return an iterator over the matches in a files tarball, read one package at a time."},
+  {"search_many", (PyCFunction)Search_search_many, METH_VARARGS | METH_KEYWORDS, "Return the (filename, match) pairs of several files tarballs, read by up to threads threads."},
+  {NULL, NULL, 0, NULL}
+};
+
 static PyTypeObject SearchPyType = {
   PyObject_HEAD_INIT(NULL)
   0,                          /*ob_size*/
@@ -265,7 +712,7 @@ static PyTypeObject SearchPyType = {
   0,                          /* tp_weaklistoffset */
   0,                          /* tp_iter */
   0,                          /* tp_iternext */
-  0,                          /* tp_methods */
+  Search_methods,             /* tp_methods */
   0,                          /* tp_members */
   0,                          /* tp_getset */
   0,                          /* tp_base */
@@ -278,14 +725,192 @@ static PyTypeObject SearchPyType = {
   Search_new,                 /* tp_new */
 };
 
+typedef struct {
+  PyObject_HEAD
+  struct pattern *patterns;
+  size_t npatterns;
+} MultiSearch;
+
+static PyObject *MultiSearch_new(PyTypeObject *type, PyObject *args, PyObject *kwds) {
+  MultiSearch *self;
+
+  self = (MultiSearch*)type->tp_alloc(type, 0);
+  if (self != NULL) {
+    self->patterns = NULL;
+    self->npatterns = 0;
+  }
+
+  return (PyObject *)self;
+}
+
+static void MultiSearch_reset(MultiSearch *self) {
+  size_t i;
+
+  for(i = 0; i < self->npatterns; i++)
+    match_reset(&(self->patterns[i].match_type), &(self->patterns[i].match_func), &(self->patterns[i].data));
+  free(self->patterns);
+  self->patterns = NULL;
+  self->npatterns = 0;
+}
+
+static void MultiSearch_dealloc(MultiSearch* self) {
+  MultiSearch_reset(self);
+  self->ob_type->tp_free((PyObject*)self);
+}
+
+static int MultiSearch_init(MultiSearch *self, PyObject *args, PyObject *kw) {
+  long mt, st, item_st;
+  int flags = 0;
+  PyObject *patterns, *seq, *item, *pattern;
+  struct pattern *p;
+  Py_ssize_t i, n;
+  static char *kwlist[] = {"matchtype", "searchtype", "patterns", "flags", NULL};
+
+  MultiSearch_reset(self);
+  if(!PyArg_ParseTupleAndKeywords(args, kw, "llO|i", kwlist, &mt, &st, &patterns, &flags))
+    return -1;
+  if(init_search_type(st) == -1)
+    return -1;
+  seq = PySequence_Fast(patterns, "patterns must be a sequence");
+  if(seq == NULL)
+    return -1;
+  n = PySequence_Fast_GET_SIZE(seq);
+  self->patterns = calloc(n + 1, sizeof(struct pattern));
+  if(self->patterns == NULL) {
+    Py_DECREF(seq);
+    PyErr_NoMemory();
+    return -1;
+  }
+
+  for(i = 0; i < n; i++) {
+    item = PySequence_Fast_GET_ITEM(seq, i);
+    /* a pattern may be given as a (searchtype, pattern) tuple */
+    item_st = st;
+    pattern = item;
+    if(PyTuple_Check(item) && PyTuple_GET_SIZE(item) == 2 && PyInt_Check(PyTuple_GET_ITEM(item, 0))) {
+      if(!PyArg_ParseTuple(item, "lO", &item_st, &pattern) || init_search_type(item_st) == -1)
+        goto error;
+    }
+    p = &self->patterns[i];
+    if(match_init(mt, pattern, flags, &(p->match_type), &(p->match_func), &(p->data)) == -1)
+      goto error;
+    p->search_type = item_st;
+    self->npatterns++;
+  }
+  Py_DECREF(seq);
+  return 0;
+
+error:
+  Py_DECREF(seq);
+  MultiSearch_reset(self);
+  return -1;
+}
+
+static PyObject *MultiSearch_call(MultiSearch *self, PyObject *args, PyObject *kw) {
+  const char *filename;
+  static char *kwlist[] = {"filename", NULL};
+  struct search_result res;
+  struct db_stats stats;
+  PyObject *ret, *match, *tuple;
+  double start;
+  size_t i;
+
+  if(!PyArg_ParseTupleAndKeywords(args, kw, "s", kwlist, &filename))
+    return NULL;
+  if(search_file(filename, self->patterns, self->npatterns, &res, &stats) == -1)
+    return NULL;
+  start = stats_enabled ? db_clock() : 0;
+
+  ret = PyList_New(0);
+  if(ret == NULL)
+    goto cleanup;
+  for(i = 0; i < res.npkgs; i++) {
+    match = result_match(&res, &res.pkgs[i]);
+    if(match == NULL)
+      goto error;
+    tuple = Py_BuildValue("(nN)", (Py_ssize_t)res.pkgs[i].target, match);
+    if(tuple == NULL)
+      goto error;
+    PyList_Append(ret, tuple);
+    Py_DECREF(tuple);
+  }
+  if(stats_enabled) {
+    for(i = 0; i < res.npkgs; i++)
+      count_objects(&stats, &res.pkgs[i]);
+    stats.objects_time = db_clock() - start;
+    if(stats_add(filename, &stats) == -1)
+      Py_CLEAR(ret);
+  }
+  result_free(&res);
+  return ret;
+
+error:
+  Py_DECREF(ret);
+cleanup:
+  result_free(&res);
+  return NULL;
+}
+
+static PyTypeObject MultiSearchPyType = {
+  PyObject_HEAD_INIT(NULL)
+  0,                          /*ob_size*/
+  "pkgfile.MultiSearch",      /*tp_name*/
+  sizeof(MultiSearch),        /*tp_basicsize*/
+  0,                          /*tp_itemsize*/
+  (destructor)MultiSearch_dealloc, /*tp_dealloc*/
+  0,                          /*tp_print*/
+  0,                          /*tp_getattr*/
+  0,                          /*tp_setattr*/
+  0,                          /*tp_compare*/
+  0,                          /*tp_repr*/
+  0,                          /*tp_as_number*/
+  0,                          /*tp_as_sequence*/
+  0,                          /*tp_as_mapping*/
+  0,                          /*tp_hash */
+  (ternaryfunc)MultiSearch_call, /*tp_call*/
+  0,                          /*tp_str*/
+  0,                          /*tp_getattro*/
+  0,                          /*tp_setattro*/
+  0,                          /*tp_as_buffer*/
+  Py_TPFLAGS_DEFAULT,         /*tp_flags*/
+  "MultiSearch object",       /* tp_doc */
+  0,                          /* tp_traverse */
+  0,                          /* tp_clear */
+  0,                          /* tp_richcompare */
+  0,                          /* tp_weaklistoffset */
+  0,                          /* tp_iter */
+  0,                          /* tp_iternext */
+  0,                          /* tp_methods */
+  0,                          /* tp_members */
+  0,                          /* tp_getset */
+  0,                          /* tp_base */
+  0,                          /* tp_dict */
+  0,                          /* tp_descr_get */
+  0,                          /* tp_descr_set */
+  0,                          /* tp_dictoffset */
+  (initproc)MultiSearch_init, /* tp_init */
+  0,                          /* tp_alloc */
+  MultiSearch_new,            /* tp_new */
+};
+
 void search_pyinit(PyObject *m) {
   PyObject *to;
 
+  if (PyType_Ready(&SearchIterPyType) < 0)
+    return;
+
   if (PyType_Ready(&SearchPyType) < 0)
     return;
   to = (PyObject*)&SearchPyType;
   Py_INCREF(to);
   PyModule_AddObject(m, "Search", (PyObject*)&SearchPyType);
+
+  if (PyType_Ready(&MultiSearchPyType) < 0)
+    return;
+  to = (PyObject*)&MultiSearchPyType;
+  Py_INCREF(to);
+  PyModule_AddObject(m, "MultiSearch", (PyObject*)&MultiSearchPyType);
+
   PyModule_AddIntConstant(m, "SEARCH_PATH", SEARCH_PATH);
   PyModule_AddIntConstant(m, "SEARCH_FILENAME", SEARCH_FILENAME);
   PyModule_AddIntConstant(m, "SEARCH_PACKAGE", SEARCH_PACKAGE);
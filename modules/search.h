@@ -1,9 +1,22 @@
 #ifndef SEARCH_H
 #define SEARCH_H
 
-#include <archive.h>
+#include "match.h"
+
+typedef enum {
+  SEARCH_NONE,
+  SEARCH_PATH,
+  SEARCH_FILENAME,
+  SEARCH_PACKAGE
+} SearchType;
+
+struct pattern {
+  MatchType match_type;
+  MatchFunc match_func;
+  SearchType search_type;
+  void *data;
+};
 
-FILE *open_archive_stream(struct archive *archive);
 void search_pyinit(PyObject *m);
 
 #endif /* SEARCH_H */
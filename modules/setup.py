@@ -4,7 +4,7 @@ from distutils.core import setup, Extension
 setup(name='pkgfile',
       version='0.1',
       ext_modules=[Extension('pkgfile',
-          ['pkgfile2.c', 'match.c', 'search.c', 'listpkg.c', 'util.c', 'parse.c'],
-          libraries=['archive', 'pcre'],
+          ['pkgfile2.c', 'match.c', 'search.c', 'db.c', 'listpkg.c', 'util.c', 'parse.c', 'index.c', 'result.c', 'stats.c', 'pack.c', 'delta.c'],
+          libraries=['archive', 'pcre', 'z', 'pthread'],
           extra_compile_args=['-Wall'])],
       )
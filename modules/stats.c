@@ -0,0 +1,97 @@
+#include <Python.h>
+#include "stats.h"
+
+int stats_enabled = 0;
+
+/* counters of each database, by file name */
+static PyObject *stats_table = NULL;
+
+static int add_counter(PyObject *counters, const char *key, PyObject *value) {
+  PyObject *old, *sum;
+  int ret;
+
+  if(value == NULL)
+    return -1;
+  old = PyDict_GetItemString(counters, key);
+  if(old == NULL) {
+    ret = PyDict_SetItemString(counters, key, value);
+    Py_DECREF(value);
+    return ret;
+  }
+  sum = PyNumber_Add(old, value);
+  Py_DECREF(value);
+  if(sum == NULL)
+    return -1;
+  ret = PyDict_SetItemString(counters, key, sum);
+  Py_DECREF(sum);
+  return ret;
+}
+
+/* add the counters of a search of filename to the table; must be called
+ * with the GIL held */
+int stats_add(const char *filename, const struct db_stats *st) {
+  PyObject *counters;
+
+  if(!stats_enabled)
+    return 0;
+  if(stats_table == NULL) {
+    stats_table = PyDict_New();
+    if(stats_table == NULL)
+      return -1;
+  }
+  counters = PyDict_GetItemString(stats_table, filename);
+  if(counters == NULL) {
+    counters = PyDict_New();
+    if(counters == NULL || PyDict_SetItemString(stats_table, filename, counters) == -1) {
+      Py_XDECREF(counters);
+      return -1;
+    }
+    Py_DECREF(counters);
+  }
+  if(add_counter(counters, "searches", PyInt_FromLong(1)) == -1 ||
+      add_counter(counters, "bytes", PyLong_FromUnsignedLongLong(st->bytes)) == -1 ||
+      add_counter(counters, "packages", PyLong_FromUnsignedLongLong(st->packages)) == -1 ||
+      add_counter(counters, "lines", PyLong_FromUnsignedLongLong(st->lines)) == -1 ||
+      add_counter(counters, "match_calls", PyLong_FromUnsignedLongLong(st->match_calls)) == -1 ||
+      add_counter(counters, "matches", PyLong_FromUnsignedLongLong(st->matches)) == -1 ||
+      add_counter(counters, "objects", PyLong_FromUnsignedLongLong(st->objects)) == -1 ||
+      add_counter(counters, "read_time", PyFloat_FromDouble(st->read_time)) == -1 ||
+      add_counter(counters, "match_time", PyFloat_FromDouble(st->scan_time - st->read_time)) == -1 ||
+      add_counter(counters, "objects_time", PyFloat_FromDouble(st->objects_time)) == -1)
+    return -1;
+  return 0;
+}
+
+PyObject *stats(PyObject *self, PyObject *args) {
+  PyObject *ret, *key, *value, *copy;
+  Py_ssize_t pos = 0;
+
+  ret = PyDict_New();
+  if(ret == NULL || stats_table == NULL)
+    return ret;
+  while(PyDict_Next(stats_table, &pos, &key, &value)) {
+    copy = PyDict_Copy(value);
+    if(copy == NULL || PyDict_SetItem(ret, key, copy) == -1) {
+      Py_XDECREF(copy);
+      Py_DECREF(ret);
+      return NULL;
+    }
+    Py_DECREF(copy);
+  }
+  return ret;
+}
+
+PyObject *enable_stats(PyObject *self, PyObject *args, PyObject *kw) {
+  PyObject *enabled = Py_True;
+  static char *kwlist[] = {"enabled", NULL};
+  int r;
+
+  if(!PyArg_ParseTupleAndKeywords(args, kw, "|O", kwlist, &enabled))
+    return NULL;
+  r = PyObject_IsTrue(enabled);
+  if(r == -1)
+    return NULL;
+  stats_enabled = r;
+  Py_CLEAR(stats_table);
+  Py_RETURN_NONE;
+}
@@ -0,0 +1,17 @@
+#ifndef STATS_H
+#define STATS_H
+
+#include <Python.h>
+#include "db.h"
+
+/* The counters of the searches are kept in their own struct db_stats while
+ * the database is read without the GIL, then added to the table returned by
+ * pkgfile.stats(), by database. Nothing is timed unless the statistics
+ * were enabled with pkgfile.enable_stats(). */
+extern int stats_enabled;
+
+int stats_add(const char *filename, const struct db_stats *st);
+PyObject *stats(PyObject *self, PyObject *args);
+PyObject *enable_stats(PyObject *self, PyObject *args, PyObject *kw);
+
+#endif /* STATS_H */
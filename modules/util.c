@@ -1,5 +1,8 @@
+#include <stdio.h>
 #include <stdlib.h>
 #include <string.h>
+#include <unistd.h>
+#include <sys/stat.h>
 
 /* from pacman/lib/libalpm/be_files.c */
 
@@ -34,3 +37,52 @@ int splitname(const char *target, char **pkgname, char **pkgver) {
 	return(0);
 }
 
+
+/* make sure *ptr can hold needed elements of size bytes, doubling its
+ * allocation when it is too small */
+int grow_array(void **ptr, size_t *alloc, size_t needed, size_t size) {
+	size_t n;
+	void *p;
+
+	if(needed <= *alloc) {
+		return(0);
+	}
+	n = *alloc ? *alloc : 64;
+	while(n < needed) {
+		n *= 2;
+	}
+	p = realloc(*ptr, n * size);
+	if(p == NULL) {
+		return(-1);
+	}
+	*ptr = p;
+	*alloc = n;
+	return(0);
+}
+
+/* create a temporary file of a name of its own beside path, to be renamed
+ * over it; return its descriptor, or -1, and set *tmp to its name */
+int create_temp(const char *path, char **tmp) {
+	int fd;
+
+	*tmp = malloc(strlen(path) + 8);
+	if(*tmp == NULL) {
+		return(-1);
+	}
+	sprintf(*tmp, "%s.XXXXXX", path);
+	fd = mkstemp(*tmp);
+	if(fd == -1) {
+		free(*tmp);
+		*tmp = NULL;
+		return(-1);
+	}
+	/* mkstemp creates it readable by its owner only */
+	if(fchmod(fd, 0644) == -1) {
+		close(fd);
+		unlink(*tmp);
+		free(*tmp);
+		*tmp = NULL;
+		return(-1);
+	}
+	return(fd);
+}
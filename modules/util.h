@@ -1,6 +1,10 @@
 #ifndef UTIL_H
 #define UTIL_H
 
+#include <stddef.h>
+
 int splitname(const char *target, char **pkgname, char **pkgver);
+int grow_array(void **ptr, size_t *alloc, size_t needed, size_t size);
+int create_temp(const char *path, char **tmp);
 
 #endif /* UTIL_H */
@@ -1,7 +1,12 @@
 #!/bin/bash
 command_not_found_handle () {
 	local command="$1"
-	local pkgs="$(pkgfile -b -v "$command")"
+	local pkgs
+	pkgs="$(pkgfile-client -b -c -v "$command" 2>/dev/null)"
+	if [ $? -ge 2 ]; then
+		# neither pkgfile --daemon nor the indexes could answer
+		pkgs="$(pkgfile -b -c -v "$command")"
+	fi
 	if [ ! -z "$pkgs" ]; then
 		echo -e "\n$command may be found in the following packages:\n$pkgs"
 		return 0
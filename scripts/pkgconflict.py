@@ -24,8 +24,9 @@
 
 import os
 import sys
-import tarfile
+import glob
 import subprocess
+import pkgfile
 
 def chomp(x): return x[0:-1]
 def isfilename(x): return not x.endswith('/')
@@ -49,46 +50,93 @@ def get_lists_base(configfile):
   else:
     return None
 
+def open_index(dbfile):
+  """Return the pkgfile.Index of a files database, building it if it is
+  missing or stale. Return None if it can not be built."""
+  indexfile = dbfile.replace('.files.tar.gz', '.files.idx')
+  st = os.stat(dbfile)
+  try:
+    index = pkgfile.Index(indexfile)
+    if index.db_mtime == int(st.st_mtime) and index.db_size == st.st_size:
+      return index
+  except IOError:
+    pass
+  try:
+    pkgfile.build_index(dbfile, indexfile)
+    return pkgfile.Index(indexfile)
+  except IOError:
+    return None
+
 def read_file_lists(list_base):
-  """Snarf filelists into memory; return hash mapping filenames to
-  (repo, package) tuples."""
-  known_files = {}
-  repos = os.listdir(list_base)
-  for repo in repos:
-    repopath = os.path.join(FILELIST_DIR, repo)
-    packages = os.listdir(repopath)
-    for package in packages:
-      listfile = open(os.path.join(repopath, package, 'files'))
-      listfile.readline() # discard the %files% line
-      for entry in filter(isfilename, map(chomp, listfile.readlines())):
-        known_files[entry] = (repo, package)
-      listfile.close()
-  return known_files
+  """Return a list of (repo, lookup) for the files databases found in
+  list_base. lookup takes a list of paths and returns a dict mapping the
+  known ones to the (repo, package) tuples providing them."""
+  repos = []
+  local_db = os.path.join(list_base, 'local.files.tar.gz')
+  for dbfile in sorted(glob.glob(os.path.join(list_base, '*.files.tar.gz'))):
+    if dbfile == local_db:
+      continue
+    repo = os.path.basename(dbfile).replace('.files.tar.gz', '')
+    repos.append((repo, make_lookup(repo, dbfile)))
+  return repos
+
+def make_lookup(repo, dbfile):
+  index = open_index(dbfile)
+  def lookup(paths):
+    found = {}
+    if index is not None:
+      # binary search of each path in the mapped index
+      for path in paths:
+        for match in index.lookup(pkgfile.SEARCH_PATH, path):
+          found.setdefault(path, (repo, match['name']))
+    else:
+      # without an index, all the paths are matched in one pass
+      search = pkgfile.Search(pkgfile.MATCH_SET, pkgfile.SEARCH_PATH, list(paths))
+      for match in search(dbfile):
+        for path in match['files']:
+          found.setdefault(path, (repo, match['name']))
+    return found
+  return lookup
 
 def list_package_contents(package):
-  """Return a list containing the names of the files in the tarball.
-  Removes the entries .INSTALL and .PKGINFO."""
-  tarball = tarfile.open(package, 'r:gz')
-  names = tarball.getnames()
-  tarball.close()
-  try:
-    del names[names.index('.PKGINFO')]
-    del names[names.index('.INSTALL')]
-  except ValueError:
-    pass
-  return names
+  """Return a list containing the names of the files in the package.
+  Removes the metadata entries like .INSTALL and .PKGINFO."""
+  return [name for name in pkgfile.archive_contents(package)
+          if not (name.startswith('.') and '/' not in name)]
 
 HOME = os.environ['HOME']
 CONFIG_DIR='/etc/pkgtools'
 FILELIST_DIR =(get_lists_base(os.path.join(HOME, '.pkgtools', 'pkgfile.conf'))
                or get_lists_base(os.path.join(CONFIG_DIR, 'pkgfile.conf'))
                or '/var/cache/pkgtools/lists')
-if len(sys.argv) != 2:
-  sys.stderr.write('Usage: %s <PACKAGEFILE>\n' % (sys.argv[0], ))
+if len(sys.argv) < 2:
+  sys.stderr.write('Usage: %s <PACKAGEFILE>...\n' % (sys.argv[0], ))
   sys.exit(1)
-known_files = read_file_lists(FILELIST_DIR)
-pkg_contents = list_package_contents(sys.argv[1])
-for file in pkg_contents:
-  if file in known_files:
-    (repo, package) = known_files[file]
-    print "%s already provided by the %s package from [%s]" % (file, package, repo)
+
+contents = {}
+for package in sys.argv[1:]:
+  try:
+    contents[package] = filter(isfilename, list_package_contents(package))
+  except IOError, e:
+    sys.stderr.write('%s\n' % (str(e).rstrip(), ))
+    sys.exit(1)
+all_files = set()
+for files in contents.values():
+  all_files.update(files)
+
+known_files = {}
+for repo, lookup in read_file_lists(FILELIST_DIR):
+  for file, owner in lookup(all_files).iteritems():
+    known_files.setdefault(file, owner)
+
+# the packages checked together must not conflict with each other either
+providers = {}
+for package in sys.argv[1:]:
+  prefix = '%s: ' % (package, ) if len(sys.argv) > 2 else ''
+  for file in contents[package]:
+    if file in known_files:
+      (repo, owner) = known_files[file]
+      print "%s%s already provided by the %s package from [%s]" % (prefix, file, owner, repo)
+    if file in providers and providers[file] != package:
+      print "%s%s already provided by %s" % (prefix, file, providers[file])
+    providers.setdefault(file, package)
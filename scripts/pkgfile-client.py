@@ -0,0 +1,183 @@
+#!/usr/bin/python2
+###
+# pkgfile-client.py -- query a running pkgfile --daemon, or the indexes
+# This program is a part of pkgtools
+#
+# Copyright (C) 2010 solsTiCe d'Hiver <solstice.dhiver@gmail.com>
+#
+# Pkgtools is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# Pkgtools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+##
+
+# Takes the same arguments as a pkgfile query. This is kept as small as
+# possible because it runs from the command not found hooks.
+# When the daemon is not running, the searches of a file name or path with
+# -b, -c, -v and -R are answered from the indexes written by pkgfile
+# --update, without the imports and the option parsing of pkgfile.
+# Exit status is 0 if something was printed, 1 if not, and 2 if neither the
+# daemon nor the indexes could answer, in which case pkgfile should be run
+# instead.
+
+import os
+import sys
+import socket
+
+DAEMON_SOCKET = os.getenv('PKGFILED_SOCKET', '/var/run/pkgtools/pkgfiled.sock')
+# seconds to wait for the daemon, after which the indexes or pkgfile answer
+TIMEOUT = 2
+CONFIG_DIR = '/etc/pkgtools'
+FILELIST_DIR = '/var/cache/pkgtools/lists'
+
+def get_filelist_dir():
+    '''return FILELIST_DIR as set in pkgfile.conf or its XDG_CONFIG_HOME copy'''
+
+    filelist_dir = FILELIST_DIR
+    conf_files = [os.path.join(CONFIG_DIR, 'pkgfile.conf')]
+    if os.getenv('XDG_CONFIG_HOME') is not None:
+        conf_files.append(os.path.join(os.getenv('XDG_CONFIG_HOME'), 'pkgtools', 'pkgfile.conf'))
+    for conf_file in conf_files:
+        try:
+            with open(conf_file) as f:
+                for line in f:
+                    option, sep, value = line.split('#', 1)[0].partition('=')
+                    if sep and option.strip() == 'FILELIST_DIR':
+                        filelist_dir = value.strip('"\' \n').rstrip('/')
+        except IOError:
+            pass
+    return filelist_dir
+
+def query_indexes(args):
+    '''print the packages owning a file like pkgfile would, from the indexes
+    only; return None if they can not answer'''
+
+    import re
+    import pkgfile
+
+    flags = pkgfile.MATCH_ICASE
+    binaries = verbose = False
+    repo = target = None
+    while args:
+        arg = args.pop(0)
+        if arg in ('-R', '--repo') and args:
+            repo = args.pop(0)
+        elif arg in ('--binaries', '--verbose', '--case-sensitive', '--search'):
+            binaries = binaries or arg == '--binaries'
+            verbose = verbose or arg == '--verbose'
+            flags = 0 if arg == '--case-sensitive' else flags
+        elif arg.startswith('-') and len(arg) > 1 and not arg.startswith('--'):
+            if arg.strip('-bcsv'):
+                return None
+            binaries = binaries or 'b' in arg
+            verbose = verbose or 'v' in arg
+            flags = 0 if 'c' in arg else flags
+        elif arg == '--' and len(args) == 1 and target is None:
+            target = args.pop(0)
+        elif arg.startswith('-') or target is not None:
+            return None
+        else:
+            target = arg
+    # existing files are looked up in the local database by pkgfile
+    if not target or os.path.exists(target) or repo == 'local':
+        return None
+
+    filelist_dir = get_filelist_dir()
+    if repo:
+        dbfiles = [os.path.join(filelist_dir, '%s.files.tar.gz' % repo)]
+    else:
+        try:
+            dbfiles = [os.path.join(filelist_dir, f) for f in os.listdir(filelist_dir)
+                    if f.endswith('.files.tar.gz') and not f.startswith('.') and f != 'local.files.tar.gz']
+        except OSError:
+            return None
+    search_type = pkgfile.SEARCH_FILENAME
+    if target.startswith('/'):
+        search_type = pkgfile.SEARCH_PATH
+        target = target.lstrip('/')
+
+    output = []
+    for dbfile in dbfiles:
+        try:
+            st = os.stat(dbfile)
+            index = pkgfile.Index(dbfile.replace('.files.tar.gz', '.files.idx'))
+        except (OSError, IOError):
+            return None
+        if index.db_mtime != int(st.st_mtime) or index.db_size != st.st_size:
+            return None
+        repo_name = os.path.basename(dbfile).replace('.files.tar.gz', '')
+        for match in index.lookup(search_type, target, flags):
+            files = match['files']
+            if binaries:
+                files = [f for f in files if re.search(r'(?:^|/)s?bin/.', f)]
+            if not files:
+                continue
+            if verbose:
+                output.extend('%s/%s (%s) : /%s\n' % (repo_name, match['name'], match['version'], f) for f in files)
+            else:
+                output.append('%s/%s\n' % (repo_name, match['name']))
+    sys.stdout.write(''.join(output))
+    return output != []
+
+def main():
+    # an existing file is looked up in the local database by pkgfile; the
+    # daemon can not tell, since it does not run in the directory of the
+    # client
+    if any(os.path.exists(arg) for arg in sys.argv[1:] if not arg.startswith('-')):
+        return 2
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(TIMEOUT)
+    found = False
+    # the output of the daemon is followed by a NUL byte and its exit status
+    status = None
+    try:
+        sock.connect(DAEMON_SOCKET)
+        sock.sendall('\0'.join(sys.argv[1:]))
+        sock.shutdown(socket.SHUT_WR)
+        while True:
+            data = sock.recv(65536)
+            if not data:
+                break
+            if status is not None:
+                status += data
+                continue
+            data, sep, tail = data.partition('\0')
+            if sep:
+                status = tail
+            if data:
+                sys.stdout.write(data)
+                found = True
+        if status is None:
+            # the daemon closed the connection without answering
+            raise socket.error('no answer from the daemon')
+    except socket.timeout:
+        # the daemon is busy or stuck, pkgfile answers instead
+        return 2
+    except socket.error:
+        # the daemon may have answered in part
+        if found:
+            return 2
+        found = query_indexes(sys.argv[1:])
+        if found is None:
+            return 2
+    finally:
+        sock.close()
+    if status:
+        try:
+            if int(status) != 0:
+                return int(status)
+        except ValueError:
+            pass
+    return 0 if found else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,78 @@
+#!/usr/bin/python2
+###
+# pkgfile-mkdelta.py -- make the files deltas served by a mirror
+# This program is a part of pkgtools
+#
+# Copyright (C) 2010 solsTiCe d'Hiver <solstice.dhiver@gmail.com>
+#
+# Pkgtools is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# Pkgtools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+##
+
+# Run on a mirror each time a files list is replaced, with the new files
+# list and the previous ones. A delta from each previous files list to the
+# new one is written beside it, named after the packages of the previous
+# one, so that pkgfile --update finds the delta of the files list it has
+# without the mirror knowing anything of its clients.
+
+import os
+import sys
+import hashlib
+import optparse
+import pkgfile
+
+def delta_id(dbfile):
+    '''return the id of dbfile; this must be the same as delta_id in pkgfile'''
+
+    versions = dict((pkg['name'], pkg['version']) for pkg in pkgfile.list_packages(dbfile))
+    return hashlib.sha1(''.join(sorted('%s-%s\n' % pkg for pkg in versions.iteritems()))).hexdigest()
+
+def main():
+    usage = 'usage: %prog [options] NEW OLD...'
+    parser = optparse.OptionParser(usage=usage)
+    parser.add_option('-p', '--prune', action='store_true', dest='prune', default=False,
+            help='remove the deltas of NEW that were not made by this run')
+    (options, args) = parser.parse_args()
+    if len(args) < 2:
+        parser.error('NEW and at least one OLD files list are needed')
+
+    new = args[0]
+    if not new.endswith('.files.tar.gz'):
+        parser.error('%s is not a files list' % new)
+    prefix = os.path.basename(new)[:-len('.tar.gz')] + '.'
+    directory = os.path.dirname(new) or '.'
+    st = os.stat(new)
+    made = set()
+    ret = 0
+    for old in args[1:]:
+        delta = os.path.join(directory, '%s%s.delta' % (prefix, delta_id(old)))
+        try:
+            pkgfile.make_delta(old, new, delta)
+        except IOError, e:
+            print >> sys.stderr, 'Error: could not make delta from %s: %s' % (old, e)
+            ret = 1
+            continue
+        # pkgfile gives the files list the mtime of the delta it applied
+        os.utime(delta, (st.st_atime, st.st_mtime))
+        made.add(os.path.basename(delta))
+        print '%s -> %s' % (old, delta)
+
+    if options.prune:
+        for f in os.listdir(directory):
+            if f.startswith(prefix) and f.endswith('.delta') and f not in made:
+                os.unlink(os.path.join(directory, f))
+    sys.exit(ret)
+
+if __name__ == '__main__':
+    main()
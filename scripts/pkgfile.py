@@ -23,31 +23,76 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 ##
 
+# only what a query needs is imported here: the modules used to update the
+# databases, write the caches or format the output are imported where they
+# are used, so that the command not found hooks do not wait for them
 import re
-import glob
 import os
 import sys
+import marshal
 import optparse
-import subprocess
-import urllib2
-import tarfile
 import time
 import pkgfile
 
 VERSION = '22'
 CONFIG_DIR = '/etc/pkgtools'
 FILELIST_DIR = '/var/cache/pkgtools/lists'
+DAEMON_SOCKET = '/var/run/pkgtools/pkgfiled.sock'
+# requests the daemon answers at the same time
+DAEMON_THREADS = 32
+PACMAN_CONF = '/etc/pacman.conf'
+CHUNK_SIZE = 64 * 1024
+INFO_VERSION = 1
+# output formats of the queries
+FORMATS = ('text', 'json', 'null')
+
+_dbpath = None
+# counters of --stats, by database; None when they are not collected
+_stats = None
 
 def find_dbpath():
     '''find pacman dbpath'''
 
+    global _dbpath
+    if _dbpath is not None:
+        return _dbpath
+    # reading pacman.conf is much cheaper than running pacman
+    if os.path.exists(PACMAN_CONF):
+        _dbpath = parse_config(PACMAN_CONF).get('DBPath', '/var/lib/pacman/')
+        return _dbpath
+    import subprocess
     p = subprocess.Popen(['pacman', '-Tv'], stdout=subprocess.PIPE)
     output = p.communicate()[0]
     for line in output.split('\n'):
         if line.startswith('DB Path'):
-            return line.split(':')[1].strip()
+            _dbpath = line.split(':')[1].strip()
+            return _dbpath
     raise RuntimeError("Unable to determine pacman DB path")
 
+def repo_db(repo, filelist_dir=FILELIST_DIR):
+    '''return the files database of repo
+
+    The local repo is read straight from the local database of pacman.'''
+
+    if repo == 'local':
+        return os.path.join(find_dbpath(), 'local')
+    return os.path.join(filelist_dir, '%s.files.tar.gz' % repo)
+
+def repo_name(dbfile):
+    '''return the name of the repo of a files database'''
+    return os.path.basename(os.path.normpath(dbfile)).replace('.files.tar.gz', '')
+
+def list_repos(filelist_dir=FILELIST_DIR):
+    '''return the files databases of the sync repos'''
+
+    # local.files.tar.gz is left by older versions until the next update
+    try:
+        names = os.listdir(filelist_dir)
+    except OSError:
+        return []
+    return [os.path.join(filelist_dir, f) for f in names
+            if f.endswith('.files.tar.gz') and not f.startswith('.') and f != 'local.files.tar.gz']
+
 def parse_config(filename, options=None, comment_char='#', option_char='='):
     '''basic function to parse a key=value config file'''
     # Borrowed at http://www.decalage.info/en/python/configparser
@@ -86,6 +131,36 @@ def load_config(conf_file, options=None):
             options.update(local_options)
     return options
 
+def start_stats():
+    '''collect the counters of the searches and downloads for --stats'''
+
+    global _stats
+    _stats = {'databases': {}}
+    pkgfile.enable_stats()
+
+def db_stats(dbfile):
+    '''return the --stats counters of dbfile, or None if they are not collected'''
+    if _stats is None:
+        return None
+    return _stats['databases'].setdefault(dbfile, {})
+
+def report_stats():
+    '''print the counters collected since start_stats() as JSON on stderr
+
+    The counters of the C module are merged with the ones kept here, like
+    the time of the lookups and of the downloads.'''
+
+    global _stats
+    import json
+
+    if _stats is None:
+        return
+    for dbfile, counters in pkgfile.stats().iteritems():
+        _stats['databases'].setdefault(dbfile, {}).update(counters)
+    print >> sys.stderr, json.dumps(_stats, sort_keys=True)
+    _stats = None
+    pkgfile.enable_stats(False)
+
 def die(n=-1, msg='Unknown error'):
     # TODO: All calls to die() should probably just be exceptions
     print >> sys.stderr, msg
@@ -139,6 +214,7 @@ def print_pkg(pkg):
 
 def get_mirrorlist():
     """Return a list of (reponame, mirror_url) for all mirrors known to pacman"""
+    import subprocess
     p = subprocess.Popen(['pacman', '-T', '--debug'], stdout=subprocess.PIPE)
     output = p.communicate()[0]
 
@@ -150,11 +226,271 @@ def get_mirrorlist():
             mirrors.append((m.group(1), m.group(2)))
     return mirrors
 
+def parse_rate(value):
+    '''convert a wget --limit-rate value (eg. 200k or 1.5m) to bytes per second; 0 means no limit'''
+
+    m = re.match(r'^\s*([0-9]+(?:\.[0-9]*)?)\s*([kKmMgG]?)\s*$', str(value))
+    if m is None:
+        return 0
+    return int(float(m.group(1)) * {'': 1, 'k': 1024, 'm': 1024**2, 'g': 1024**3}[m.group(2).lower()])
+
+class RateLimiter(object):
+    '''throttle the total rate of the downloads done by several threads'''
+
+    def __init__(self, rate):
+        import threading
+        self.rate = rate
+        self.lock = threading.Lock()
+        self.start = time.time()
+        self.total = 0
+
+    def consume(self, n):
+        '''account for n bytes read, sleeping as long as needed to stay under the rate'''
+        if not self.rate:
+            return
+        with self.lock:
+            self.total += n
+            delay = self.start + float(self.total) / self.rate - time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+def meta_file(dbfile):
+    '''return the name of the file holding the HTTP metadata of dbfile'''
+    return dbfile.replace('.files.tar.gz', '.files.meta')
+
+def read_meta(dbfile):
+    import json
+    try:
+        with open(meta_file(dbfile)) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+def write_meta(dbfile, meta):
+    import json
+    import tempfile
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(dbfile), prefix='.meta.')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(meta, f)
+    os.chmod(tmp, 0644)
+    os.rename(tmp, meta_file(dbfile))
+
+def part_file(dbfile):
+    '''return the name of the file holding a partial download of dbfile'''
+    return dbfile.replace('.files.tar.gz', '.files.part')
+
+def download(conn, dbfile, limiter, part=None, offset=0):
+    '''stream the body of conn to dbfile
+
+    The body is written to a temporary file renamed over dbfile once it is
+    complete, so readers never see a truncated tarball. With part, the
+    body is written after the first offset bytes of that file instead,
+    and it is kept if the download is interrupted so that it can be
+    resumed. Return the number of bytes downloaded.'''
+
+    import tempfile
+    total = 0
+    if part is None:
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(dbfile), prefix='.%s.' % os.path.basename(dbfile))
+        f = os.fdopen(fd, 'wb')
+    else:
+        tmp = part
+        f = open(part, 'r+b' if offset else 'wb')
+        f.truncate(offset)
+        f.seek(offset)
+    length = conn.info().getheader('content-length')
+    try:
+        with f:
+            while True:
+                chunk = conn.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                f.write(chunk)
+                total += len(chunk)
+                limiter.consume(len(chunk))
+            f.flush()
+            os.fsync(f.fileno())
+        # reads stop without an error when the connection is closed early
+        if length is not None and length.isdigit() and total != int(length):
+            raise IOError('incomplete download of %s: %d of %s bytes' % (dbfile, total, length))
+        os.chmod(tmp, 0644)
+        os.rename(tmp, dbfile)
+    except:
+        if part is None and os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+    return total
+
+def resume_offset(dbfile, meta, url):
+    '''return the size of the partial download of dbfile from url, 0 if
+    there is none that can be resumed'''
+
+    partial = meta.get('partial') or {}
+    if partial.get('url') != url or not partial.get('validator'):
+        return 0
+    try:
+        return os.path.getsize(part_file(dbfile))
+    except os.error:
+        return 0
+
+def fetch_delta(url, dbfile, local_mtime, limiter, counters):
+    '''update dbfile with the delta at url, if the mirror has one newer than
+    dbfile; return True if it was applied'''
+
+    import urllib2
+    import email.utils
+    import tempfile
+    attempt = {'url': url, 'status': 'error', 'bytes': 0}
+    start = time.time()
+    if counters is not None:
+        counters.setdefault('mirrors', []).append(attempt)
+    request = urllib2.Request(url)
+    request.add_header('If-Modified-Since', email.utils.formatdate(local_mtime, usegmt=True))
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(dbfile), prefix='.%s.' % os.path.basename(url))
+    os.close(fd)
+    try:
+        conn = urllib2.urlopen(request, timeout=30)
+        try:
+            attempt['status'] = conn.getcode()
+            attempt['bytes'] = download(conn, tmp, limiter)
+            last_modified = conn.info().getheader('last-modified')
+        finally:
+            conn.close()
+        pkgfile.apply_delta(dbfile, tmp, dbfile)
+    except urllib2.HTTPError, e:
+        attempt['status'] = e.code
+        return False
+    except (IOError, OSError):
+        attempt['status'] = 'error'
+        return False
+    finally:
+        attempt['time'] = time.time() - start
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+    # mirrors give deltas the mtime of the files list they lead to
+    date = email.utils.parsedate_tz(last_modified or '')
+    if date is not None:
+        mtime = email.utils.mktime_tz(date)
+        os.utime(dbfile, (mtime, mtime))
+    write_meta(dbfile, {'url': os.path.join(os.path.dirname(url), os.path.basename(dbfile)),
+        'etag': None, 'last_modified': last_modified})
+    return True
+
+def fetch_repo(repo, mirrors, options, filelist_dir, limiter):
+    '''update the files list of repo from the first of mirrors that answers
+
+    Return a list of (stream, message) to print.'''
+
+    import urllib2
+    import email.utils
+    messages = [(sys.stdout, ':: Checking [%s] for files list ...' % repo)]
+    dbfile = os.path.join(filelist_dir, '%s.files.tar.gz' % repo)
+    meta = read_meta(dbfile)
+    try:
+        local_mtime = os.path.getmtime(dbfile)
+    except os.error:
+        local_mtime = None
+    force = options.update > 1 or local_mtime is None
+    counters = db_stats(dbfile)
+    old = {} if local_mtime is None else package_versions(dbfile, filelist_dir)
+    # mirrors may keep, under the id of a files list, a delta from it to
+    # their current one; see pkgfile-mkdelta
+    delta = None
+    if not force and old and getattr(options, 'delta', False):
+        delta = '%s.files.%s.delta' % (repo, delta_id(old))
+
+    for mirror in mirrors:
+        if delta is not None:
+            if options.verbose:
+                messages.append((sys.stdout, '    Trying delta from mirror %s ...' % mirror))
+            if fetch_delta(os.path.join(mirror, delta), dbfile, local_mtime, limiter, counters):
+                messages.append((sys.stdout, '    Applied delta: %d added, %d upgraded, %d removed'
+                    % update_caches(dbfile, old, options, filelist_dir)))
+                return messages
+        fileslist = os.path.join(mirror, '%s.files.tar.gz' % repo)
+        # each try of a mirror is timed for --stats
+        attempt = {'url': fileslist, 'status': 'error', 'bytes': 0}
+        start = time.time()
+        if counters is not None:
+            counters.setdefault('mirrors', []).append(attempt)
+        if options.verbose:
+            messages.append((sys.stdout, '    Trying mirror %s ...' % mirror))
+        request = urllib2.Request(fileslist)
+        if not force:
+            if meta.get('url') == fileslist and meta.get('etag'):
+                request.add_header('If-None-Match', meta['etag'])
+            if meta.get('url') == fileslist and meta.get('last_modified'):
+                request.add_header('If-Modified-Since', meta['last_modified'])
+            else:
+                request.add_header('If-Modified-Since', email.utils.formatdate(local_mtime, usegmt=True))
+        # an interrupted download is resumed if the files list did not change
+        offset = resume_offset(dbfile, meta, fileslist)
+        if offset:
+            request.add_header('Range', 'bytes=%d-' % offset)
+            request.add_header('If-Range', meta['partial']['validator'])
+        try:
+            conn = urllib2.urlopen(request, timeout=30)
+        except urllib2.HTTPError, e:
+            attempt['status'] = e.code
+            attempt['time'] = time.time() - start
+            if e.code == 304:
+                messages.append((sys.stdout, '    No update available'))
+                update_index(dbfile, filelist_dir=filelist_dir)
+                update_pack(dbfile, getattr(options, 'pack', False))
+                return messages
+            messages.append((sys.stderr, 'Warning: could not retrieve %s' % fileslist))
+            continue
+        except IOError:
+            attempt['time'] = time.time() - start
+            messages.append((sys.stderr, 'Warning: could not retrieve %s' % fileslist))
+            continue
+
+        attempt['status'] = conn.getcode()
+        try:
+            # some servers ignore conditional requests
+            last_modified = conn.info().getdate('last-modified')
+            if conn.getcode() == 206:
+                # the rest of the partial download
+                if not conn.info().getheader('content-range', '').startswith('bytes %d-' % offset):
+                    raise IOError('unexpected range from %s' % fileslist)
+            else:
+                # the whole files list, the server may not support ranges
+                offset = 0
+            if not offset and not force and last_modified is not None and time.mktime(last_modified) <= local_mtime:
+                messages.append((sys.stdout, '    No update available'))
+                downloaded = False
+            else:
+                if options.verbose:
+                    messages.append((sys.stdout, '    %s %s ...' % ('Resuming' if offset else 'Downloading', fileslist)))
+                validator = conn.info().getheader('etag')
+                if not validator or validator.startswith('W/'):
+                    validator = conn.info().getheader('last-modified')
+                # the validators of the files list in place are kept until
+                # the new one replaces it
+                write_meta(dbfile, dict(meta, partial={'url': fileslist, 'validator': validator}))
+                attempt['bytes'] = download(conn, dbfile, limiter, part_file(dbfile), offset)
+                write_meta(dbfile, {'url': fileslist,
+                    'etag': conn.info().getheader('etag'),
+                    'last_modified': conn.info().getheader('last-modified')})
+                downloaded = True
+        except (IOError, OSError):
+            attempt['status'] = 'error'
+            messages.append((sys.stderr, 'Warning: could not retrieve %s' % fileslist))
+            continue
+        finally:
+            conn.close()
+            attempt['time'] = time.time() - start
+        if downloaded and old:
+            messages.append((sys.stdout, '    %d added, %d upgraded, %d removed'
+                % update_caches(dbfile, old, options, filelist_dir)))
+        else:
+            update_caches(dbfile, old, options, filelist_dir)
+        return messages
+    return messages
+
 def update_repo(options, target_repo=None, filelist_dir=FILELIST_DIR):
     '''download .files.tar.gz for each repo found in pacman config or the one specified'''
 
-    # XXX: This function is way too big. Needs refactoring
-
     if not os.path.exists(filelist_dir):
         print >> sys.stderr, 'Warning: %s does not exist. Creating it.' % filelist_dir
         try:
@@ -162,79 +498,420 @@ def update_repo(options, target_repo=None, filelist_dir=FILELIST_DIR):
         except OSError:
             die(1, 'Error: Can\'t create %s directory' % filelist_dir)
 
+    start = time.time()
     mirror_list = get_mirrorlist()
-    repo_done = []
+    if _stats is not None:
+        _stats['mirrorlist_time'] = time.time() - start
+    repos = []
+    mirrors = {}
     for repo, mirror in mirror_list:
         if target_repo is not None and repo != target_repo:
             continue
-        if repo not in repo_done:
-            print ':: Checking [%s] for files list ...' % repo
-            repofile = '%s.files.tar.gz' % repo
-            fileslist = os.path.join(mirror, repofile)
+        if repo not in mirrors:
+            repos.append(repo)
+            mirrors[repo] = []
+        mirrors[repo].append(mirror)
 
-            try:
-                if options.verbose:
-                    print '    Trying mirror %s ...' % mirror
-                dbfile = '%s/%s.files.tar.gz' % (filelist_dir, repo)
-                try:
-                    # try to get mtime of dbfile
-                    local_mtime = os.path.getmtime(dbfile)
-                except os.error:
-                    local_mtime = 0 # fake a very old date if dbfile doesn't exist
-                # Initiate connection to get 'Last-Modified' header
-                conn = urllib2.urlopen(fileslist, timeout=30)
-                last_modified = conn.info().getdate('last-modified')
-                if last_modified is None:
-                    should_update = True
-                else:
-                    remote_mtime = time.mktime(last_modified)
-                    should_update = remote_mtime > local_mtime
-
-                if should_update or options.update > 1:
-                    if options.verbose:
-                        print '    Downloading %s ...' % fileslist
-                    f = open(dbfile, 'w')
-                    f.write(conn.read())
-                    f.close()
-                    conn.close()
-                else:
-                    print '    No update available'
-                    conn.close()
-                repo_done.append(repo)
-            except IOError:
-                print >> sys.stderr, 'Warning: could not retrieve %s' % fileslist
-                continue
+    # all repos are fetched at the same time, RATELIMIT caps their total rate
+    limiter = RateLimiter(getattr(options, 'ratelimit', 0))
+    fetch = lambda repo: fetch_repo(repo, mirrors[repo], options, filelist_dir, limiter)
+    if repos:
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(len(repos))
+        try:
+            for messages in pool.imap(fetch, repos):
+                for stream, msg in messages:
+                    print >> stream, msg
+        finally:
+            pool.close()
+            pool.join()
 
-    local_db = os.path.join(filelist_dir, 'local.files.tar.gz')
+    local_db = repo_db('local', filelist_dir)
 
     if target_repo is None or target_repo == 'local':
-        print ':: Converting local repo ...'
-        local_dbpath = os.path.join(find_dbpath(), 'local')
-        # create a tarball of local repo
-        tf = tarfile.open(local_db, 'w:gz')
-        cwd = os.getcwd() # save current working directory
-        os.chdir(local_dbpath)
-        # we don't want a ./ prefix on all the files in the tarball
-        for i in os.listdir('.'):
-            tf.add(i)
-        tf.close()
-        os.chdir(cwd) # restore it
+        # the local database is read in place, only its index is kept here;
+        # the packages that did not change are taken from the previous index
+        print ':: Indexing local repo ...'
+        update_index(local_db, force=True, filelist_dir=filelist_dir)
         print 'Done'
 
-    # remove left-over db (for example for repo removed from pacman config)
+    # remove left-over db (for example for repo removed from pacman config,
+    # or the tarball of the local repo made by older versions)
     # XXX: This should probably be in some type of behavior like pacman -Scc (pkgfile -c[c]?)
+    import glob
     repos = glob.glob(os.path.join(filelist_dir, '*.files.tar.gz'))
-    registered_repos = set(os.path.join(filelist_dir, r[0]+'.files.tar.gz') for r in mirror_list)
-    registered_repos.add(local_db)
+    registered_repos = set(repo_db(r[0], filelist_dir) for r in mirror_list)
     for r in repos:
         if r not in registered_repos:
             print ':: Deleting %s' % r
             os.unlink(r)
+            for f in (index_file(r), info_file(r), deps_file(r), meta_file(r), pack_file(r), part_file(r)):
+                if f not in (index_file(local_db, filelist_dir), info_file(local_db, filelist_dir), deps_file(local_db, filelist_dir)) and os.path.exists(f):
+                    os.unlink(f)
+
+def cache_file(dbfile, suffix, filelist_dir=FILELIST_DIR):
+    '''return the name of a file derived from dbfile, kept beside it
+
+    The files derived from the local database are kept in filelist_dir.'''
+
+    if os.path.isdir(dbfile):
+        return os.path.join(filelist_dir, '%s.files.%s' % (repo_name(dbfile), suffix))
+    return dbfile.replace('.files.tar.gz', '.files.%s' % suffix)
+
+def index_file(dbfile, filelist_dir=FILELIST_DIR):
+    '''return the name of the index built from dbfile'''
+    return cache_file(dbfile, 'idx', filelist_dir)
+
+def info_file(dbfile, filelist_dir=FILELIST_DIR):
+    '''return the name of the package info cache of dbfile'''
+    return cache_file(dbfile, 'info', filelist_dir)
+
+# opened indexes, with the stat of the database they were checked against
+_index_cache = {}
+
+def open_index(dbfile, filelist_dir=FILELIST_DIR):
+    '''return the pkgfile.Index of dbfile, or None if it is missing or stale'''
+
+    try:
+        st = os.stat(dbfile)
+    except OSError:
+        return None
+    key = (st.st_ino, int(st.st_mtime), st.st_size)
+    cached = _index_cache.get(dbfile)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    try:
+        index = pkgfile.Index(index_file(dbfile, filelist_dir))
+    except IOError:
+        return None
+    if index.db_mtime != int(st.st_mtime) or index.db_size != st.st_size:
+        return None
+    _index_cache[dbfile] = (key, index)
+    return index
+
+def update_index(dbfile, force=False, filelist_dir=FILELIST_DIR):
+    '''build the index of dbfile if it is missing or stale
+
+    The file lists of the packages of the previous index that are still in
+    dbfile in the same version are copied from it.'''
+
+    if not force and open_index(dbfile, filelist_dir) is not None:
+        return
+    try:
+        pkgfile.build_index(dbfile, index_file(dbfile, filelist_dir), update=True)
+    except IOError, e:
+        print >> sys.stderr, 'Warning: could not build index of %s: %s' % (dbfile, e)
+
+def pack_file(dbfile, filelist_dir=FILELIST_DIR):
+    '''return the name of the pack made from dbfile'''
+    return cache_file(dbfile, 'pack', filelist_dir)
+
+def db_source(dbfile, filelist_dir=FILELIST_DIR):
+    '''return the file to read dbfile from: its pack if it is up to date,
+    dbfile itself otherwise'''
+
+    if os.path.isdir(dbfile):
+        return dbfile
+    pack = pack_file(dbfile, filelist_dir)
+    try:
+        st = os.stat(dbfile)
+        if pkgfile.pack_stat(pack) == (int(st.st_mtime), st.st_size):
+            return pack
+    except (OSError, IOError):
+        pass
+    return dbfile
+
+def package_versions(dbfile, filelist_dir=FILELIST_DIR):
+    '''return a dict of the version of each package of dbfile, read from its
+    index if it is up to date; {} if dbfile can not be read'''
+
+    index = open_index(dbfile, filelist_dir)
+    try:
+        if index is not None:
+            packages = index.packages()
+        else:
+            packages = pkgfile.list_packages(db_source(dbfile, filelist_dir))
+    except IOError:
+        return {}
+    return dict((pkg['name'], pkg['version']) for pkg in packages)
+
+def delta_id(versions):
+    '''return the name under which mirrors keep the delta from a database
+    holding the packages of versions; pkgfile-mkdelta names them the same'''
+
+    import hashlib
+    return hashlib.sha1(''.join(sorted('%s-%s\n' % pkg for pkg in versions.iteritems()))).hexdigest()
+
+def update_caches(dbfile, old, options, filelist_dir=FILELIST_DIR):
+    '''update what is derived from dbfile once it was replaced, reading
+    only the packages that are not in the previous version of each
+
+    old has the versions of the packages before. Return the number of
+    packages added, upgraded and removed.'''
+
+    update_index(dbfile, filelist_dir=filelist_dir)
+    new = package_versions(dbfile, filelist_dir)
+    update_info(dbfile, new, filelist_dir)
+    update_pack(dbfile, getattr(options, 'pack', False))
+    added = sum(1 for name in new if name not in old)
+    upgraded = sum(1 for name in new if name in old and old[name] != new[name])
+    removed = sum(1 for name in old if name not in new)
+    return added, upgraded, removed
+
+def update_pack(dbfile, enabled):
+    '''build the pack of dbfile if enabled and it is missing or stale,
+    remove it otherwise'''
+
+    pack = pack_file(dbfile)
+    if not enabled:
+        if os.path.exists(pack):
+            os.unlink(pack)
+        return
+    if db_source(dbfile) == pack:
+        return
+    try:
+        # the packages of the previous pack are not compressed again
+        pkgfile.build_pack(dbfile, pack, update=True)
+    except IOError, e:
+        print >> sys.stderr, 'Warning: could not build pack of %s: %s' % (dbfile, e)
+
+def deps_file(dbfile, filelist_dir=FILELIST_DIR):
+    '''return the name of the reverse dependencies cache of dbfile'''
+    return cache_file(dbfile, 'deps', filelist_dir)
+
+def db_key(dbfile):
+    '''return the key of the caches made from dbfile
+
+    pacman rewrites the desc file of a package in place, when its install
+    reason changes for example, so the key of a database directory also
+    has the newest mtime of its desc files.'''
+
+    st = os.stat(dbfile)
+    key = (os.path.abspath(dbfile), int(st.st_mtime), st.st_size)
+    if os.path.isdir(dbfile):
+        mtimes = [os.stat(os.path.join(dbfile, d, 'desc')).st_mtime
+                for d in os.listdir(dbfile) if os.path.isfile(os.path.join(dbfile, d, 'desc'))]
+        key += (int(max(mtimes or [0])),)
+    return key
+
+def read_cache(filename, key):
+    '''return the data of a cache file, or None if it is missing or, unless
+    key is None, was not made from the same database'''
+
+    try:
+        with open(filename, 'rb') as f:
+            version, cache_key, data = marshal.load(f)
+    except (IOError, EOFError, ValueError, TypeError):
+        return None
+    if version != INFO_VERSION or (key is not None and cache_key != key):
+        return None
+    return data
+
+def write_cache(filename, key, data):
+    '''store data in a cache file, return False if it can not be written'''
+
+    import tempfile
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(filename), prefix='.%s.' % os.path.basename(filename))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            marshal.dump((INFO_VERSION, key, data), f)
+        os.chmod(tmp, 0644)
+        os.rename(tmp, filename)
+    except (IOError, OSError):
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        return False
+    return True
+
+# loaded package info caches, by database
+_info_cache = {}
+
+def read_info(dbfile, key, filelist_dir=FILELIST_DIR):
+    '''return the cached info of the packages of dbfile, or None if the
+    cache is missing or was not made from the same database'''
+
+    cached = _info_cache.get(dbfile)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    info = read_cache(info_file(dbfile, filelist_dir), key)
+    if info is not None:
+        _info_cache[dbfile] = (key, info)
+    return info
+
+def write_info(dbfile, key, info, filelist_dir=FILELIST_DIR):
+    '''store the info of all the packages of dbfile in its cache'''
+
+    if write_cache(info_file(dbfile, filelist_dir), key, info):
+        _info_cache[dbfile] = (key, info)
+
+def update_info(dbfile, versions, filelist_dir=FILELIST_DIR):
+    '''bring the package info cache of dbfile up to date, if there is one
+
+    versions has the version of each package of dbfile. The info of the
+    packages that are cached in the same version is kept, only the others
+    are read.'''
+
+    key = db_key(dbfile)
+    filename = info_file(dbfile, filelist_dir)
+    if read_info(dbfile, key, filelist_dir) is not None:
+        return
+    info = read_cache(filename, None)
+    if info is None:
+        return
+    info = dict((name, pkg) for name, pkg in info.iteritems() if versions.get(name) == pkg['version'])
+    missing = [name for name in versions if name not in info]
+    try:
+        if missing:
+            info.update((pkg['name'], pkg) for pkg in pkgfile.pkg_info(db_source(dbfile, filelist_dir), missing))
+    except IOError:
+        return
+    write_info(dbfile, key, info, filelist_dir)
+
+def packages_info(dbfile, names, filelist_dir=FILELIST_DIR):
+    '''return a dict of the pkgfile.pkg_info of the packages names of dbfile
+
+    The info of all the packages is cached in a file beside the database
+    until the database changes. Without write access to it, only the
+    given packages are read, in a single pass.'''
+
+    key = db_key(dbfile)
+    info = read_info(dbfile, key, filelist_dir)
+    if info is None:
+        if not os.access(os.path.dirname(info_file(dbfile, filelist_dir)), os.W_OK):
+            return dict((pkg['name'], pkg) for pkg in pkgfile.pkg_info(db_source(dbfile, filelist_dir), list(names)))
+        info = dict((pkg['name'], pkg) for pkg in pkgfile.pkg_info(db_source(dbfile, filelist_dir), None))
+        write_info(dbfile, key, info, filelist_dir)
+    return dict((name, info[name]) for name in names if name in info)
+
+def timed_lookup(lookup):
+    '''wrap lookup to add the time spent finding the matches of each
+    database to its --stats counters, whether they come from a Search or an
+    Index'''
+
+    def timed(dbfile):
+        counters = db_stats(dbfile)
+        counters.setdefault('lookup_time', 0.0)
+        start = time.time()
+        matches = iter(lookup(dbfile))
+        counters['lookup_time'] += time.time() - start
+        while True:
+            start = time.time()
+            try:
+                match = next(matches)
+            except StopIteration:
+                return
+            finally:
+                counters['lookup_time'] += time.time() - start
+            yield match
+    return timed
+
+def dependency_graph(dbfile, filelist_dir=FILELIST_DIR):
+    '''return the pkgfile.reverse_deps of dbfile
+
+    The graph is cached in a file beside the database until the database
+    changes, if it can be written.'''
+
+    key = db_key(dbfile)
+    filename = deps_file(dbfile, filelist_dir)
+    graph = read_cache(filename, key)
+    if graph is None:
+        graph = pkgfile.reverse_deps(dbfile)
+        if os.access(os.path.dirname(filename), os.W_OK):
+            write_cache(filename, key, graph)
+    return graph
+
+def who_needs(pkgname, filelist_dir=FILELIST_DIR):
+    '''print the explicitly installed packages that require pkgname,
+    directly or not, like whoneeds
+
+    Exit with 1 if there is none, and with 3 if pkgname is not installed,
+    as whoneeds did.'''
+
+    graph = dependency_graph(repo_db('local', filelist_dir), filelist_dir)
+    if pkgname not in graph:
+        die(3, 'Error: package "%s" is not installed' % pkgname)
+    import collections
+
+    # breadth first walk of the packages requiring pkgname
+    seen = set([pkgname])
+    queue = collections.deque([pkgname])
+    needed = []
+    while queue:
+        for dependent in graph[queue.popleft()][1]:
+            if dependent in seen:
+                continue
+            seen.add(dependent)
+            queue.append(dependent)
+            if graph[dependent][0] == 0:
+                needed.append(dependent)
+
+    print 'Packages that depend on [%s]' % pkgname
+    if not needed:
+        print '  None'
+        sys.exit(1)
+    for name in sorted(needed):
+        print '  %s' % name
+
+def search_repos(repo_list, lookup, jobs=1):
+    '''return (dbfile, lookup(dbfile)) for each dbfile of repo_list, in order
+
+    With jobs > 1, the repos are searched at the same time by a pool of
+    threads; the C module releases the GIL while it reads a tarball. The
+    matches of lookup are then collected in the threads, otherwise they
+    can be consumed as they are found.'''
+
+    if _stats is not None:
+        lookup = timed_lookup(lookup)
+    if jobs <= 1 or len(repo_list) <= 1:
+        return ((dbfile, lookup(dbfile)) for dbfile in repo_list)
+    from multiprocessing.pool import ThreadPool
+    pool = ThreadPool(min(jobs, len(repo_list)))
+    try:
+        return zip(repo_list, pool.map(lambda dbfile: list(lookup(dbfile)), repo_list, chunksize=1))
+    finally:
+        pool.close()
+        pool.join()
+
+def search_all(search, repo_list, jobs=1, filelist_dir=FILELIST_DIR):
+    '''return (dbfile, matches) for each dbfile of repo_list, in order, read
+    by a single search_many call of search with up to jobs threads'''
+
+    sources = [db_source(dbfile, filelist_dir) for dbfile in repo_list]
+    found = dict((source, []) for source in sources)
+    for source, match in search.search_many(sources, threads=jobs):
+        found[source].append(match)
+    return [(dbfile, found[source]) for dbfile, source in zip(repo_list, sources)]
 
 def is_binary(s):
     """Utility function used to determine whether a file should be displayed under -b"""
     return re.search(r'(?:^|/)s?bin/.', s) != None
 
+def json_text(value):
+    '''decode the strings of value from UTF-8, replacing what is not, since
+    the file lists may hold names in any encoding'''
+    if isinstance(value, str):
+        return value.decode('utf-8', 'replace')
+    if isinstance(value, dict):
+        return dict((json_text(k), json_text(v)) for k, v in value.iteritems())
+    if isinstance(value, (list, tuple)):
+        return [json_text(v) for v in value]
+    return value
+
+def json_record(repo, match, files, info=None):
+    '''return the JSON line of a match of repo, as written by --format=json'''
+    import json
+    record = {'repo': repo, 'name': match['name'], 'version': match['version'],
+            'files': ['/' + f for f in files]}
+    if info is not None:
+        record['info'] = info
+    return json.dumps(json_text(record), separators=(',', ':')) + '\n'
+
+def match_flags(options):
+    '''return the pkgfile flags of the searches asked by options'''
+    if options.case_sensitive:
+        return 0
+    return pkgfile.MATCH_ICASE
+
 def list_files(pkgname, options, filelist_dir=FILELIST_DIR):
     '''list files of package matching pkgname'''
 
@@ -252,128 +929,390 @@ def list_files(pkgname, options, filelist_dir=FILELIST_DIR):
         pkg = pkgname
 
     res = []
-    local_db = os.path.join(filelist_dir, 'local.files.tar.gz')
     if target_repo:
-        tmp = os.path.join(filelist_dir, '%s.files.tar.gz' % target_repo)
+        tmp = repo_db(target_repo, filelist_dir)
         if not os.path.exists(tmp):
             die(1, 'Error: %s repo does not exist' % target_repo)
         repo_list = [tmp]
     else:
-        repo_list = glob.glob(os.path.join(filelist_dir, '*.files.tar.gz'))
-        try:
-            del repo_list[repo_list.index(local_db)]
-        except ValueError:
-            # TODO: Replace with custom NoFileDBError class
-            raise RuntimeError("No local file db found. Run --update")
+        repo_list = list_repos(filelist_dir)
 
+    flags = match_flags(options)
     try:
         if options.glob:
             match_type = pkgfile.MATCH_SHELL
         elif options.regex:
-            match_type = pkgfile.MATCH_REGEX
+            match_type = pkgfile.MATCH_PCRE
         else:
             match_type = pkgfile.MATCH_SIMPLE
-        search = pkgfile.Search(match_type, pkgfile.SEARCH_PACKAGE, pkgname)
+        if not pkg:
+            die(1, 'Error: No target specified')
+        search = pkgfile.Search(match_type, pkgfile.SEARCH_PACKAGE, pkg, flags)
     except pkgfile.RegexError:
         die(1, 'Error: invalid pattern or regular expression')
 
+    def lookup(dbfile):
+        index = None
+        if match_type == pkgfile.MATCH_SIMPLE:
+            index = open_index(dbfile, filelist_dir)
+        if index is not None:
+            return index.lookup(pkgfile.SEARCH_PACKAGE, pkg, flags)
+        # with --unsorted, packages are printed as they are read
+        return search.iter(db_source(dbfile, filelist_dir))
+
+    # matches are written as they come, instead of being formatted by print
+    write = sys.stdout.write
     found_pkg = False
-    for dbfile in repo_list:
-        repo = os.path.basename(dbfile).replace('.files.tar.gz', '')
-
-        matches = search(dbfile)
-        # XXX: nested loop, investigate options
-        for match in sorted(matches):
-            for file_ in sorted(match['files']):
-                if options.binaries:
-                    if is_binary(file_):
-                        print '%s /%s' % (match['name'], file_)
-                        found_pkg = True
-                else:
-                    print '%s /%s' % (match['name'], file_)
-                    found_pkg = True
+    if match_type != pkgfile.MATCH_SIMPLE and options.jobs > 1:
+        # no index can be used, all the repos are read in one call
+        results = search_all(search, repo_list, options.jobs, filelist_dir)
+    else:
+        results = search_repos(repo_list, lookup, options.jobs)
+    for dbfile, matches in results:
+        repo = repo_name(dbfile)
+        if not options.unsorted:
+            # the packages of a repo are only streamed with --unsorted
+            matches = sorted(matches, key=lambda m: (m['name'], m['version']))
+        for match in matches:
+            files = match['files']
+            if not options.unsorted:
+                files = sorted(files)
+            if options.binaries:
+                files = filter(is_binary, files)
+            if not files:
+                continue
+            found_pkg = True
+            if options.format == 'json':
+                write(json_record(repo, match, files))
+            elif options.format == 'null':
+                write(''.join('/%s\0' % f for f in files))
+            else:
+                write(''.join('%s /%s\n' % (match['name'], f) for f in files))
 
     if not found_pkg:
-        print 'Package "%s" not found' % pkg,
+        # keep the output of the machine readable formats clean
+        out = sys.stdout if options.format == 'text' else sys.stderr
+        print >> out, 'Package "%s" not found' % pkg,
         if target_repo != '':
-            print ' in [%s] repo ' % target_repo,
-        print
+            print >> out, ' in [%s] repo ' % target_repo,
+        print >> out
 
 def query_pkg(filename, options, filelist_dir=FILELIST_DIR):
     '''search package with a file matching filename'''
 
+    flags = match_flags(options)
     try:
         search_type = pkgfile.SEARCH_FILENAME
         if options.glob:
             match_type = pkgfile.MATCH_SHELL
         elif options.regex:
-            match_type = pkgfile.MATCH_REGEX
+            match_type = pkgfile.MATCH_PCRE
         else:
             match_type = pkgfile.MATCH_SIMPLE
             if filename.startswith('/'):
                 search_type = pkgfile.SEARCH_PATH
                 filename = filename.lstrip('/')
-        search = pkgfile.Search(match_type, search_type, filename)
+        if not filename:
+            die(1, 'Error: No target specified')
+        search = pkgfile.Search(match_type, search_type, filename, flags)
     except pkgfile.RegexError:
         die(1, 'Error: invalid pattern or regular expression')
 
     target_repo = options.repo
-    local_db = os.path.join(filelist_dir, 'local.files.tar.gz')
     if target_repo:
-        tmp = os.path.join(filelist_dir, '%s.files.tar.gz' % target_repo)
+        tmp = repo_db(target_repo, filelist_dir)
         if not os.path.exists(tmp):
             die(1, 'Error: %s repo does not exist' % target_repo)
         repo_list = [tmp]
-    elif os.path.exists(filename) or target_repo == 'local':
-        repo_list = [local_db]
+    elif not getattr(options, 'remote', False) and os.path.exists(filename):
+        repo_list = [repo_db('local', filelist_dir)]
     else:
-        repo_list = glob.glob(os.path.join(filelist_dir, '*.files.tar.gz'))
-        del repo_list[repo_list.index(local_db)]
+        repo_list = list_repos(filelist_dir)
 
-    for dbfile in repo_list:
+    def lookup(dbfile):
         # search the package name that have a filename
-        matches = search(dbfile)
-        repo = os.path.basename(dbfile).replace('.files.tar.gz', '')
+        index = None
+        if match_type == pkgfile.MATCH_SIMPLE:
+            index = open_index(dbfile, filelist_dir)
+        if index is not None:
+            return index.lookup(search_type, filename, flags)
+        return search.iter(db_source(dbfile, filelist_dir))
+
+    if match_type != pkgfile.MATCH_SIMPLE and options.jobs > 1:
+        # no index can be used, all the repos are read in one call
+        results = search_all(search, repo_list, options.jobs, filelist_dir)
+    else:
+        results = search_repos(repo_list, lookup, options.jobs)
+    write = sys.stdout.write
+    for dbfile, matches in results:
+        repo = repo_name(dbfile)
+        if options.info:
+            # the info of all the matches is read at once
+            matches = list(matches)
+            info = packages_info(dbfile, set(m['name'] for m in matches), filelist_dir)
 
         for match in matches:
             files = match['files']
             if options.binaries:
                 files = filter(is_binary, files)
             if files != []:
+                pkg = None
                 if options.info:
-                    pkg = pkgfile.pkg_info(dbfile, [match['name']])[0]
+                    pkg = info.get(match['name'])
+                    if pkg is None:
+                        continue
+                if options.format == 'json':
+                    write(json_record(repo, match, files, pkg))
+                elif options.format == 'null':
+                    write('%s/%s\0' % (repo, match['name']))
+                elif options.info:
                     print_pkg(pkg)
                     if options.verbose:
                         print '\n'.join('%s/%s : /%s' % (repo, match['name'], f) for f in files)
                         print
+                elif options.verbose:
+                    write(''.join('%s/%s (%s) : /%s\n' % (repo, match['name'], match['version'], f) for f in files))
                 else:
-                    if options.verbose:
-                        print '\n'.join('%s/%s (%s) : /%s' % (repo, match['name'], match['version'], f) for f in files)
-                    else:
-                        print '%s/%s' % (repo, match['name'])
+                    write('%s/%s\n' % (repo, match['name']))
 
-def main():
-    # This section is here for backward compatibility
-    dict_options = load_config('pkgfile.conf')
+def batch_query(source, options, filelist_dir=FILELIST_DIR):
+    '''search the packages owning each target read from source, one per line
+
+    Every repo is read only once whatever the number of targets. Results are
+    printed as "target<TAB>repo/pkg" lines.'''
+
+    if source is None or source == '-':
+        targets = [l.strip() for l in sys.stdin]
+    else:
+        try:
+            with open(source) as f:
+                targets = [l.strip() for l in f]
+        except IOError:
+            die(1, 'Error: unable to read %s' % source)
+    targets = [t for t in targets if t]
+
+    if options.glob:
+        match_type = pkgfile.MATCH_SHELL
+    elif options.regex:
+        match_type = pkgfile.MATCH_PCRE
+    else:
+        match_type = pkgfile.MATCH_SIMPLE
+    flags = match_flags(options)
     try:
-        filelist_dir = dict_options['FILELIST_DIR'].rstrip('/')
-    except KeyError:
-        filelist_dir = FILELIST_DIR
-    # PKGTOOLS_DIR is meaningless here
-    # CONFIG_DIR is useless
-    # RATELIMIT is not used yet
-    # options are:
-    #   * use wget
-    #   * make a throttling urlretrieve
-    #   * use urlgrabber
-    #   * use pycurl
-    # CMD_SEARCH_ENABLED is not used here
-    # UPDATE_CRON neither
+        if match_type == pkgfile.MATCH_SIMPLE:
+            # exact names are looked up in a hash set whatever their number,
+            # matched files are then mapped back to the targets
+            fold = str.lower if flags & pkgfile.MATCH_ICASE else str
+            names, paths = {}, {}
+            for i, target in enumerate(targets):
+                if target.startswith('/'):
+                    paths.setdefault(fold(target.lstrip('/')), []).append(i)
+                else:
+                    names.setdefault(fold(target), []).append(i)
+            search = pkgfile.MultiSearch(pkgfile.MATCH_SET, pkgfile.SEARCH_FILENAME,
+                    [names.keys(), (pkgfile.SEARCH_PATH, paths.keys())], flags)
+            def owners(i, f):
+                if i == 0:
+                    return names.get(fold(os.path.basename(f)), [])
+                return paths.get(fold(f), [])
+        else:
+            search = pkgfile.MultiSearch(match_type, pkgfile.SEARCH_FILENAME, targets, flags)
+            owners = lambda i, f: [i]
+    except pkgfile.RegexError:
+        die(1, 'Error: invalid pattern or regular expression')
 
+    target_repo = options.repo
+    if target_repo:
+        repo_list = [repo_db(target_repo, filelist_dir)]
+        if not os.path.exists(repo_list[0]):
+            die(1, 'Error: %s repo does not exist' % target_repo)
+    else:
+        repo_list = list_repos(filelist_dir)
+
+    lookup = lambda dbfile: search(db_source(dbfile, filelist_dir))
+    for dbfile, matches in search_repos(repo_list, lookup, options.jobs):
+        repo = repo_name(dbfile)
+        for i, match in matches:
+            files = match['files']
+            if options.binaries:
+                files = filter(is_binary, files)
+            found = {}
+            for f in files:
+                for t in owners(i, f):
+                    found.setdefault(t, []).append(f)
+            for t in sorted(found):
+                if options.verbose:
+                    print '\n'.join('%s\t%s/%s (%s) : /%s' % (targets[t], repo, match['name'], match['version'], f) for f in found[t])
+                else:
+                    print '%s\t%s/%s' % (targets[t], repo, match['name'])
+
+class ThreadOutput(object):
+    '''a file writing to the stream set for the current thread, or to the
+    default one
+
+    The daemon answers several requests at the same time, so sys.stdout and
+    sys.stderr can not simply be replaced by the connection of each.'''
+
+    def __init__(self, default):
+        import threading
+        object.__setattr__(self, 'default', default)
+        object.__setattr__(self, 'local', threading.local())
+
+    def stream(self):
+        return getattr(self.local, 'stream', None) or self.default
+
+    def __getattr__(self, name):
+        return getattr(self.stream(), name)
+
+    def __setattr__(self, name, value):
+        # print sets softspace
+        setattr(self.stream(), name, value)
+
+class RequestLock(object):
+    '''let the requests of the daemon run at the same time, except those
+    asking for --stats, which run alone since the counters are global'''
+
+    def __init__(self):
+        import threading
+        self.cond = threading.Condition()
+        self.running = 0
+        self.exclusive = False
+
+    def acquire(self, exclusive):
+        with self.cond:
+            while self.exclusive or (exclusive and self.running):
+                self.cond.wait()
+            self.running += 1
+            self.exclusive = exclusive
+
+    def release(self):
+        with self.cond:
+            self.running -= 1
+            self.exclusive = False
+            self.cond.notify_all()
+
+def handle_request(conn, filelist_dir, lock):
+    '''answer a query sent to the daemon
+
+    A request is the command line arguments of a query, separated by NUL
+    bytes. The output of the query is sent back, followed by a NUL byte and
+    its exit status, then the connection is closed. A query that fails does
+    not stop the daemon. sys.stdout and sys.stderr must be ThreadOutput.'''
+
+    data = ''
+    while True:
+        chunk = conn.recv(CHUNK_SIZE)
+        if not chunk:
+            break
+        data += chunk
+    request = args = data.split('\0') if data else []
+
+    out = conn.makefile('w')
+    # the output of the query in this thread goes to the client
+    sys.stdout.local.stream = sys.stderr.local.stream = out
+    status = 0
+    locked = False
+    try:
+        parser = make_parser(filelist_dir)
+        (options, args) = parser.parse_args(args)
+        lock.acquire(options.stats)
+        locked = True
+        # the paths of the client are not looked at, pkgfile-client sends
+        # the targets that exist to pkgfile instead
+        options.remote = True
+        if options.update or options.batch or options.daemon:
+            die(1, 'Error: only queries are allowed')
+        if options.stats:
+            start_stats()
+        if options.glob and options.regex:
+            die(1, 'Error: -g/--glob and -r/--regex are exclusive.')
+        if not args:
+            die(1, 'Error: No target specified')
+        if options.list:
+            list_files(args[0], options, filelist_dir=filelist_dir)
+        elif options.whoneeds:
+            who_needs(args[0], filelist_dir=filelist_dir)
+        else:
+            query_pkg(args[0], options, filelist_dir=filelist_dir)
+    except SystemExit, e:
+        status = e.code if isinstance(e.code, int) else 1
+    except Exception, e:
+        status = 1
+        print >> out, 'Error: %s' % e
+        print >> sys.stderr.default, 'Warning: request %r failed: %s' % (request, e)
+    finally:
+        if locked:
+            report_stats()
+            lock.release()
+        sys.stdout.local.stream = sys.stderr.local.stream = None
+        out.write('\0%d' % status)
+        out.close()
+
+def serve_connection(conn, filelist_dir, lock):
+    '''answer the request of conn, from a thread of its own'''
+
+    import socket
+
+    conn.settimeout(5)
+    try:
+        handle_request(conn, filelist_dir, lock)
+    except (IOError, socket.error), e:
+        print >> sys.stderr.default, 'Warning: request failed: %s' % e
+    finally:
+        conn.close()
+
+def serve(filelist_dir, socket_path):
+    '''answer the queries of pkgfile-client on a Unix socket
+
+    Each connection is answered by a thread of its own, so that a slow
+    query or a client that does not send its request does not hold up the
+    others. The opened indexes are kept between queries and reopened when
+    update_repo() replaces their database.'''
+
+    import socket
+    import threading
+
+    socket_dir = os.path.dirname(socket_path)
+    if not os.path.isdir(socket_dir):
+        os.makedirs(socket_dir, 0755)
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(socket_path)
+    os.chmod(socket_path, 0666)
+    sock.listen(16)
+    sys.stdout = ThreadOutput(sys.stdout)
+    sys.stderr = ThreadOutput(sys.stderr)
+    lock = RequestLock()
+    # a bound on the threads, the connections beyond it are closed at once
+    slots = threading.BoundedSemaphore(DAEMON_THREADS)
+    def run(conn):
+        try:
+            serve_connection(conn, filelist_dir, lock)
+        finally:
+            slots.release()
+    try:
+        while True:
+            conn = sock.accept()[0]
+            if not slots.acquire(False):
+                conn.close()
+                continue
+            thread = threading.Thread(target=run, args=(conn,))
+            thread.daemon = True
+            thread.start()
+    finally:
+        sock.close()
+        os.unlink(socket_path)
+
+def make_parser(filelist_dir):
     usage = '%prog [ACTIONS] [OPTIONS] filename'
     parser = optparse.OptionParser(usage=usage, version='%%prog %s' % VERSION)
     # actions
     actions = optparse.OptionGroup(parser, 'ACTIONS')
+    actions.add_option('--batch', dest='batch', action='store_true',
+            default=False, help='search the owners of many files read from a file, or stdin if none or "-" is given')
+    actions.add_option('--daemon', dest='daemon', action='store_true',
+            default=False, help='answer the queries of pkgfile-client on a Unix socket')
     actions.add_option('-i', '--info', dest='info', action='store_true',
             default=False, help='provides information about the package owning a file')
     actions.add_option('-l', '--list', dest='list', action='store_true',
@@ -382,6 +1321,8 @@ def main():
             default=True, help='search which package owns a file')
     actions.add_option('-u', '--update', dest='update', action='count',
             default=0, help='update to the latest filelist. This requires write permission to %s' % filelist_dir)
+    actions.add_option('--whoneeds', dest='whoneeds', action='store_true',
+            default=False, help='show the explicitly installed packages that require a package, directly or not')
     parser.add_option_group(actions)
 
     # options
@@ -392,22 +1333,73 @@ def main():
     parser.add_option('-g', '--glob', dest='glob', action='store_true',
             default=False, help='allow the use of * and ? as wildcards.')
     parser.add_option('-r', '--regex', dest='regex', action='store_true',
-            default=False, help='allow the use of regex in searches')
+            default=False, help='allow the use of perl compatible regex in searches')
+    parser.add_option('-j', '--jobs', dest='jobs', action='store', type='int',
+            default=1, help='search up to N repositories at the same time')
     parser.add_option('-R', '--repo', dest='repo', action='store',
             default='', help='search only in the specified repository')
     parser.add_option('-v', '--verbose', dest='verbose', action='store_true',
             default=False, help='enable verbose output')
+    parser.add_option('--format', dest='format', action='store', type='choice',
+            choices=FORMATS, default='text', help='output format of -s and -l: text, json for a JSON object per package, or null for NUL terminated names (packages with -s, files with -l)')
+    parser.add_option('--unsorted', dest='unsorted', action='store_true',
+            default=False, help='with -l, print the packages as they are found and their files in database order, without sorting them')
+    parser.add_option('--stats', dest='stats', action='store_true',
+            default=False, help='print the counters and timings of the searches and downloads, by database, as JSON on stderr')
+    return parser
 
+def main():
+    # This section is here for backward compatibility
+    dict_options = load_config('pkgfile.conf')
+    try:
+        filelist_dir = dict_options['FILELIST_DIR'].rstrip('/')
+    except KeyError:
+        filelist_dir = FILELIST_DIR
+    # PKGTOOLS_DIR is meaningless here
+    # CONFIG_DIR is useless
+    # CMD_SEARCH_ENABLED is not used here
+    # UPDATE_CRON neither
+
+    parser = make_parser(filelist_dir)
     (options, args) = parser.parse_args()
 
+    options.ratelimit = parse_rate(dict_options.get('RATELIMIT', 0))
+    options.pack = dict_options.get('PACK_LISTS', 0) == 1
+    options.delta = dict_options.get('DELTA_UPDATES', 1) == 1
+
     if options.glob and options.regex:
         die(1, 'Error: -g/--glob and -r/--regex are exclusive.')
+    if options.batch and options.format != 'text':
+        die(1, 'Error: --format is not supported with --batch')
+
+    if options.stats and not options.daemon:
+        start_stats()
+    try:
+        run(options, args, parser, dict_options, filelist_dir)
+    finally:
+        report_stats()
+
+def run(options, args, parser, dict_options, filelist_dir):
+    '''do the action asked on the command line'''
 
     if options.update:
         try:
             update_repo(options, filelist_dir=filelist_dir, target_repo=args[0])
         except IndexError:
             update_repo(options, filelist_dir=filelist_dir)
+    elif options.daemon:
+        serve(filelist_dir, dict_options.get('DAEMON_SOCKET', DAEMON_SOCKET))
+    elif options.whoneeds:
+        try:
+            who_needs(args[0], filelist_dir=filelist_dir)
+        except IndexError:
+            parser.print_help()
+            die(1, 'Error: No target specified')
+    elif options.batch:
+        try:
+            batch_query(args[0], options, filelist_dir=filelist_dir)
+        except IndexError:
+            batch_query(None, options, filelist_dir=filelist_dir)
     elif options.list:
         try:
             list_files(args[0], options, filelist_dir=filelist_dir)
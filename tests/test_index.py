@@ -0,0 +1,64 @@
+#!/usr/bin/python2
+###
+# test_index.py -- tests of the files indexes of the pkgfile module
+# This program is a part of pkgtools
+#
+# Pkgtools is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# Pkgtools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+##
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'bench'))
+import pkgbench
+pkgbench.setup_module_path(os.getenv('PKGFILE_MODULE_PATH'))
+import pkgfile
+
+class IndexTest(unittest.TestCase):
+    '''a lookup in the index finds the same packages as a search of the
+    tarball'''
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix='pkgfile-test.')
+        self.dbfile = os.path.join(self.workdir, 'core.files.tar.gz')
+        self.indexfile = os.path.join(self.workdir, 'core.files.idx')
+        pkgbench.write_files_db([
+            pkgbench.Package('rootf', ['README', 'usr/', 'usr/share/README'], []),
+            pkgbench.Package('other', ['README', 'Readme/'], [])],
+            self.dbfile, 'gz')
+        pkgfile.build_index(self.dbfile, self.indexfile)
+        self.index = pkgfile.Index(self.indexfile)
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def assertSameOwners(self, searchtype, target, flags=0):
+        found = self.index.lookup(searchtype, target, flags)
+        searched = pkgfile.Search(pkgfile.MATCH_SIMPLE, searchtype, target, flags)(self.dbfile)
+        self.assertEqual(sorted((m['name'], sorted(m['files'])) for m in found),
+                sorted((m['name'], sorted(m['files'])) for m in searched))
+
+    def test_file_at_root(self):
+        # a path without a / has no file name
+        self.assertEqual([m['name'] for m in self.index.lookup(pkgfile.SEARCH_FILENAME, 'README')], ['rootf'])
+        for flags in (0, pkgfile.MATCH_ICASE):
+            self.assertSameOwners(pkgfile.SEARCH_FILENAME, 'README', flags)
+            self.assertSameOwners(pkgfile.SEARCH_PATH, 'README', flags)
+
+if __name__ == '__main__':
+    unittest.main()
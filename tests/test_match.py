@@ -0,0 +1,79 @@
+#!/usr/bin/python2
+###
+# test_match.py -- tests of the matching methods of the pkgfile module
+# This program is a part of pkgtools
+#
+# Pkgtools is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# Pkgtools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+##
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'bench'))
+import pkgbench
+pkgbench.setup_module_path(os.getenv('PKGFILE_MODULE_PATH'))
+import pkgfile
+
+class PcreLiteralTest(unittest.TestCase):
+    '''the literal looked for before running a pattern must not reject the
+    files it matches'''
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix='pkgfile-test.')
+        self.dbfile = os.path.join(self.workdir, 'core.files.tar.gz')
+        pkgbench.write_files_db([
+            pkgbench.Package('glibc', ['usr/bin/ldd', 'usr/include/stdio.h', 'usr/lib/libc.so.6'], []),
+            pkgbench.Package('bash', ['usr/bin/bash', 'usr/share/man/man1/bash.1'], [])],
+            self.dbfile, 'gz')
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def owners(self, pattern):
+        search = pkgfile.Search(pkgfile.MATCH_PCRE, pkgfile.SEARCH_FILENAME, pattern)
+        return sorted(m['name'] for m in search(self.dbfile))
+
+    def test_punctuation_escape(self):
+        self.assertEqual(self.owners(r'libc\.so'), ['glibc'])
+        self.assertEqual(self.owners(r'bash\.1$'), ['bash'])
+
+    def test_hexadecimal_escape(self):
+        self.assertEqual(self.owners(r'libc\x2eso'), ['glibc'])
+        self.assertEqual(self.owners(r'\x73tdio'), ['glibc'])
+        self.assertEqual(self.owners(r'\x{73}tdio'), ['glibc'])
+
+    def test_octal_escape(self):
+        self.assertEqual(self.owners(r'\163tdio'), ['glibc'])
+
+    def test_property_escape(self):
+        self.assertEqual(self.owners(r'\pLdd'), ['glibc'])
+        self.assertEqual(self.owners(r'\p{L}dd'), ['glibc'])
+
+    def test_control_escape(self):
+        self.assertEqual(self.owners(r'\cJ?ldd'), ['glibc'])
+
+    def test_quoted_literal(self):
+        self.assertEqual(self.owners(r'\Qstdio.h\E'), ['glibc'])
+        self.assertEqual(self.owners(r'\Qstdio\E\.h'), ['glibc'])
+
+    def test_class_escape(self):
+        self.assertEqual(self.owners(r'std\w+\.h'), ['glibc'])
+        self.assertEqual(self.owners(r'\dldd'), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,277 @@
+#!/usr/bin/python2
+###
+# test_update.py -- tests of the downloads of pkgfile --update
+# This program is a part of pkgtools
+#
+# Pkgtools is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# Pkgtools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+##
+
+import os
+import sys
+import random
+import shutil
+import time
+import hashlib
+import StringIO
+import tempfile
+import unittest
+import email.utils
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'bench'))
+import pkgbench
+pkgbench.setup_module_path(os.getenv('PKGFILE_MODULE_PATH'))
+cli = pkgbench.load_script('pkgfile')
+mkdelta = pkgbench.load_script('pkgfile-mkdelta')
+pkgfile = cli.pkgfile
+
+class RangeMirrorHandler(pkgbench.MirrorHandler):
+    '''answer conditional and range requests like a real mirror, and cut
+    the body after server.truncate bytes when it is set'''
+
+    def do_GET(self):
+        self.server.requests.append(dict(self.headers.items()))
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            self.server.answers.append((os.path.basename(self.path), 404))
+            self.send_error(404)
+            return
+        with open(path, 'rb') as f:
+            data = f.read()
+        etag = '"%s"' % hashlib.md5(data).hexdigest()
+        last_modified = email.utils.formatdate(os.path.getmtime(path), usegmt=True)
+        if self.headers.get('if-none-match') == etag or \
+                self.headers.get('if-modified-since') == last_modified:
+            self.server.answers.append((os.path.basename(self.path), 304))
+            self.send_response(304)
+            self.end_headers()
+            return
+        start = 0
+        if self.headers.get('range', '').startswith('bytes=') and \
+                self.headers.get('if-range') in (etag, last_modified):
+            start = int(self.headers['range'][len('bytes='):].rstrip('-'))
+        self.server.answers.append((os.path.basename(self.path), 206 if start else 200))
+        if start:
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, len(data) - 1, len(data)))
+        else:
+            self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', last_modified)
+        self.send_header('Content-Length', str(len(data) - start))
+        self.end_headers()
+        body = data[start:]
+        if self.server.truncate is not None:
+            body = body[:self.server.truncate]
+        self.server.sent += len(body)
+        self.wfile.write(body)
+
+class UpdateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix='pkgfile-test.')
+        self.lists_dir = os.path.join(self.workdir, 'lists')
+        os.makedirs(self.lists_dir)
+        os.makedirs(os.path.join(self.workdir, 'mirror', 'core'))
+        self.mirror_db = os.path.join(self.workdir, 'mirror', 'core', 'core.files.tar.gz')
+        pkgbench.write_files_db(pkgbench.make_packages(random.Random(1), 200, 30),
+                self.mirror_db, 'gz')
+        self.dbfile = os.path.join(self.lists_dir, 'core.files.tar.gz')
+        self.options = cli.make_parser(self.lists_dir).parse_args(['-u'])[0]
+        self.options.ratelimit = 0
+        self.servers = []
+
+    def tearDown(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+        shutil.rmtree(self.workdir)
+
+    def start_mirror(self, handler=RangeMirrorHandler):
+        server = pkgbench.start_mirror(os.path.join(self.workdir, 'mirror'), handler)
+        server.requests = []
+        server.answers = []
+        server.truncate = None
+        server.sent = 0
+        self.servers.append(server)
+        return server
+
+    def fetch(self, server):
+        '''fetch core from server, return the warnings printed'''
+        mirror = 'http://127.0.0.1:%d/core' % server.server_port
+        self.messages = cli.fetch_repo('core', [mirror], self.options, self.lists_dir, cli.RateLimiter(0))
+        return [msg for stream, msg in self.messages if stream is sys.stderr]
+
+    def read(self, filename):
+        with open(filename, 'rb') as f:
+            return f.read()
+
+    def test_unchanged(self):
+        server = self.start_mirror()
+        self.assertEqual(self.fetch(server), [])
+        self.assertEqual(self.read(self.dbfile), self.read(self.mirror_db))
+        mtime = os.path.getmtime(self.dbfile)
+        server.sent = 0
+        self.assertEqual(self.fetch(server), [])
+        self.assertIn('if-none-match', server.requests[-1])
+        self.assertEqual(server.sent, 0)
+        self.assertEqual(os.path.getmtime(self.dbfile), mtime)
+
+    def test_resume(self):
+        server = self.start_mirror()
+        size = os.path.getsize(self.mirror_db)
+        server.truncate = size // 3
+        self.assertNotEqual(self.fetch(server), [])
+        # the truncated body is kept aside, never in place of the files list
+        self.assertFalse(os.path.exists(self.dbfile))
+        self.assertEqual(os.path.getsize(cli.part_file(self.dbfile)), size // 3)
+
+        server.truncate = None
+        server.sent = 0
+        self.assertEqual(self.fetch(server), [])
+        self.assertEqual(server.requests[-1].get('range'), 'bytes=%d-' % (size // 3))
+        self.assertEqual(server.sent, size - size // 3)
+        self.assertEqual(self.read(self.dbfile), self.read(self.mirror_db))
+        self.assertFalse(os.path.exists(cli.part_file(self.dbfile)))
+        self.assertNotIn('partial', cli.read_meta(self.dbfile))
+
+    def test_resume_changed(self):
+        server = self.start_mirror()
+        server.truncate = 1000
+        self.fetch(server)
+        # a new files list is published before the download is resumed
+        pkgbench.write_files_db(pkgbench.make_packages(random.Random(2), 200, 30),
+                self.mirror_db, 'gz')
+        server.truncate = None
+        self.assertEqual(self.fetch(server), [])
+        self.assertEqual(self.read(self.dbfile), self.read(self.mirror_db))
+
+    def test_range_ignored(self):
+        # SimpleHTTPServer ignores Range and the conditional headers
+        server = self.start_mirror(pkgbench.MirrorHandler)
+        with open(self.mirror_db, 'rb') as f:
+            partial = f.read(1000)
+        with open(cli.part_file(self.dbfile), 'wb') as f:
+            f.write(partial)
+        cli.write_meta(self.dbfile, {'partial': {'url': 'http://127.0.0.1:%d/core/core.files.tar.gz'
+            % server.server_port, 'validator': email.utils.formatdate(usegmt=True)}})
+        self.assertEqual(self.fetch(server), [])
+        self.assertEqual(self.read(self.dbfile), self.read(self.mirror_db))
+        self.assertFalse(os.path.exists(cli.part_file(self.dbfile)))
+
+class DeltaTest(UpdateTest):
+
+    def setUp(self):
+        UpdateTest.setUp(self)
+        self.options.delta = True
+        self.old_db = os.path.join(self.workdir, 'old.files.tar.gz')
+        shutil.copy2(self.mirror_db, self.old_db)
+
+    def publish(self):
+        '''replace the files list of the mirror by a newer one, where some
+        packages were upgraded, removed or added'''
+        pkgs = pkgbench.make_packages(random.Random(1), 200, 30)
+        for pkg in pkgs[::20]:
+            pkg.version = '2.0-1'
+        pkgs = [pkg for i, pkg in enumerate(pkgs) if i % 25 != 1]
+        pkgs += pkgbench.make_packages(random.Random(2), 3, 30, 200)
+        pkgbench.write_files_db(pkgs, self.mirror_db, 'gz')
+        # newer than the files list fetched by the client
+        self.mtime = int(time.time()) + 100
+        os.utime(self.mirror_db, (self.mtime, self.mtime))
+
+    def mkdelta(self, *args):
+        '''run pkgfile-mkdelta with args, return its exit status'''
+        argv, stdout = sys.argv, sys.stdout
+        sys.argv = ['pkgfile-mkdelta'] + list(args)
+        sys.stdout = StringIO.StringIO()
+        try:
+            mkdelta.main()
+        except SystemExit, e:
+            return e.code
+        finally:
+            sys.argv, sys.stdout = argv, stdout
+
+    def assertSameDb(self, dbfile, other):
+        search = pkgfile.Search(pkgfile.MATCH_SHELL, pkgfile.SEARCH_PATH, '*')
+        self.assertEqual(pkgfile.list_packages(dbfile), pkgfile.list_packages(other))
+        self.assertEqual(search(dbfile), search(other))
+
+    def test_delta(self):
+        server = self.start_mirror()
+        self.assertEqual(self.fetch(server), [])
+        self.publish()
+        self.assertEqual(self.mkdelta(self.mirror_db, self.old_db), 0)
+        old_id = cli.delta_id(cli.package_versions(self.old_db, self.lists_dir))
+        delta = 'core.files.%s.delta' % old_id
+        self.assertTrue(os.path.exists(os.path.join(os.path.dirname(self.mirror_db), delta)))
+
+        server.sent = 0
+        del server.answers[:]
+        self.assertEqual(self.fetch(server), [])
+        self.assertEqual(server.answers, [(delta, 200)])
+        self.assertLess(server.sent, os.path.getsize(self.mirror_db) // 4)
+        self.assertSameDb(self.dbfile, self.mirror_db)
+        self.assertIn('Applied delta', ''.join(msg for stream, msg in self.messages))
+        # the index updated from the previous one is the one of a full build
+        indexfile = os.path.join(self.workdir, 'full.idx')
+        pkgfile.build_index(self.dbfile, indexfile)
+        self.assertEqual(self.read(cli.index_file(self.dbfile, self.lists_dir)), self.read(indexfile))
+
+        # there is no delta from the new files list, and it did not change
+        server.sent = 0
+        del server.answers[:]
+        self.assertEqual(self.fetch(server), [])
+        new_id = cli.delta_id(cli.package_versions(self.dbfile, self.lists_dir))
+        self.assertEqual(server.answers, [('core.files.%s.delta' % new_id, 404),
+            ('core.files.tar.gz', 304)])
+        self.assertEqual(server.sent, 0)
+
+    def test_no_delta(self):
+        server = self.start_mirror()
+        self.fetch(server)
+        self.publish()
+        del server.answers[:]
+        self.assertEqual(self.fetch(server), [])
+        self.assertEqual([code for name, code in server.answers], [404, 200])
+        self.assertEqual(self.read(self.dbfile), self.read(self.mirror_db))
+
+    def test_wrong_base(self):
+        other = os.path.join(self.workdir, 'other.files.tar.gz')
+        pkgbench.write_files_db(pkgbench.make_packages(random.Random(3), 50, 10), other, 'gz')
+        self.publish()
+        delta = os.path.join(self.workdir, 'core.delta')
+        pkgfile.make_delta(self.old_db, self.mirror_db, delta)
+        self.assertRaises(IOError, pkgfile.apply_delta, other, delta,
+                os.path.join(self.workdir, 'applied.files.tar.gz'))
+        self.assertFalse(os.path.exists(os.path.join(self.workdir, 'applied.files.tar.gz')))
+
+    def test_wrong_base_fallback(self):
+        # the mirror serves, under the name of the files list of the client,
+        # a delta that was made from its new files list, lacking the
+        # packages upgraded since the one of the client
+        server = self.start_mirror()
+        self.fetch(server)
+        self.publish()
+        old_id = cli.delta_id(cli.package_versions(self.old_db, self.lists_dir))
+        delta = os.path.join(os.path.dirname(self.mirror_db), 'core.files.%s.delta' % old_id)
+        pkgfile.make_delta(self.mirror_db, self.mirror_db, delta)
+        os.utime(delta, (self.mtime, self.mtime))
+        del server.answers[:]
+        self.assertEqual(self.fetch(server), [])
+        self.assertEqual([code for name, code in server.answers], [200, 200])
+        self.assertEqual(self.read(self.dbfile), self.read(self.mirror_db))
+
+if __name__ == '__main__':
+    unittest.main()